@@ -1,10 +1,40 @@
 """
 cache dataframes using duckdb
+
+put(conn, key, df) and get(conn, key) keep dataframes under a key. The
+entries (table, content hash, bytes, last use) are kept in a table of the
+same database, so a database file given to connect keeps the cache across
+sessions. The least recently used entries are evicted when the cache grows
+over a byte budget (DUCK_CACHE_MB, 1024 by default) or a number of entries.
+
+save_df(conn, df, name, zero_copy=True) registers a pandas or arrow frame
+as a view which duckdb scans in place instead of copying it into a table.
+The view is materialized when it has been queried PROMOTE_AFTER times or
+by release_df before the frame is dropped or changed.
+
+save_df also takes an iterator of dataframes or arrow record batches which
+are appended chunk by chunk, and get_batches reads a table back in batches
+of BATCH_ROWS rows, so tables larger than memory go in and out of the
+cache.
+
+The functions use one connection from one thread. Cache shares a database
+between threads: each thread queries through its own cursor, reads run in
+parallel and writes wait for the reads to finish and run one at a time.
+
+@cached(conn) memoizes a function returning a dataframe in the cache, keyed
+by its qualified name, source code and arguments.
 """
+import hashlib
+import os
 import pathlib
 import logging
+import contextlib
+import functools
+import inspect
 import random
+import threading
 import time
+import weakref
 
 import numpy as np
 import pandas as pd
@@ -14,17 +44,100 @@ import duckdb
 SCRIPT_DIR = pathlib.Path(__file__).parent.resolve()
 log = logging.getLogger(__file__)
 
+ENTRIES_TABLE = 'cache_entries'
+# queries of a registered view before it is materialized
+PROMOTE_AFTER = 3
+BATCH_ROWS = 1_000_000
+MAX_BYTES = int(os.environ.get('DUCK_CACHE_MB', 1024)) * 1024 * 1024
+
 
 def get_random_table_name():
     return 'table_{}'.format(random.randrange(int(1e5), int(1e6)))
 
 
+# registered frames and their number of queries by connection
+_views = weakref.WeakKeyDictionary()
+
+
+def _conn_views(conn) -> dict:
+    return _views.setdefault(conn, {})
+
+
+def is_view(conn, name: str) -> bool:
+    'returns true if name is a registered frame not yet materialized'
+    return name in _conn_views(conn)
+
+
+def _use(conn, name: str):
+    'count a query of a view and materialize it when used repeatedly'
+    view = _conn_views(conn).get(name)
+    if view is None:
+        return
+    view['uses'] += 1
+    if view['uses'] >= PROMOTE_AFTER:
+        log.info('materializing view %s after %d uses', name, view['uses'])
+        promote(conn, name)
+
+
+def promote(conn, name: str) -> bool:
+    'materialize a registered view as a table of the same name'
+    view = _conn_views(conn).pop(name, None)
+    if view is None:
+        return False
+    conn.unregister(name)
+    _create_table_from_df(conn, view['df'], name)
+    return True
+
+
+def release_df(conn, name: str) -> bool:
+    """
+    copy a registered frame into a table before the frame is released
+
+    returns false if name is already a table
+    """
+    return promote(conn, name)
+
+
+def drop_df(conn, name: str):
+    'drop a table or unregister a view'
+    if _conn_views(conn).pop(name, None) is not None:
+        conn.unregister(name)
+    else:
+        conn.execute(f'drop table if exists {name}')
+
+
 def get_df(conn, name: str):
     "get duckdb table as a dataframe"
+    _use(conn, name)
     sql = f'select * from {name}'
     return conn.execute(sql).fetchdf()
 
 
+def get_batches(conn, name: str, batch_size: int = BATCH_ROWS,
+                arrow: bool = False):
+    """
+    yield duckdb table as dataframes of up to batch_size rows
+
+    with arrow the batches are arrow record batches. the batches are read
+    through a cursor of their own so conn can be used between batches
+    """
+    _use(conn, name)
+    cursor = conn.cursor()
+    try:
+        # a registered frame is only visible to the connection registering it
+        view = _conn_views(conn).get(name)
+        if view is not None:
+            cursor.register(name, view['df'])
+        result = cursor.execute(f'select * from {name}')
+        # newer duckdb deprecates fetch_record_batch for to_arrow_reader
+        to_reader = getattr(result, 'to_arrow_reader', None) \
+            or result.fetch_record_batch
+        for batch in to_reader(batch_size):
+            yield batch if arrow else batch.to_pandas()
+    finally:
+        cursor.close()
+
+
 def list_tables(conn):
     'get list of tables in duckdb'
     return [table_tuple[0] for table_tuple in conn.execute(
@@ -56,14 +169,370 @@ def _create_table_from_df2(conn, df, register_name, name):
 
 
 def _create_table_from_df(conn, df, name):
-    'create duckdb table name from dataframe df'
-    rel = conn.from_df(df)
+    'create duckdb table name from a pandas dataframe or arrow table df'
+    if isinstance(df, pd.DataFrame):
+        rel = conn.from_df(df)
+    else:
+        rel = conn.from_arrow(df)
     rel.create(name)
 
 
-def save_df(conn, df, name):
-    "save dataframe to a new table in duckdb"
-    _create_table_from_df(conn, df, name)
+def _is_frame(df) -> bool:
+    'pandas dataframe or arrow table or batch rather than chunks'
+    # an arrow record batch reader is a one shot stream of chunks
+    if hasattr(df, 'read_next_batch'):
+        return False
+    return isinstance(df, pd.DataFrame) or hasattr(df, 'schema')
+
+
+def _log_progress(chunks: int, rows: int):
+    log.info('saved %d chunks, %s rows', chunks, f'{rows:,}')
+
+
+def _save_chunks(conn, chunks, name, progress=_log_progress):
+    'append dataframes or arrow record batches to a new table, rows, bytes'
+    total_rows = 0
+    total_bytes = 0
+    count = 0
+    try:
+        for count, chunk in enumerate(chunks, 1):
+            if count == 1:
+                _create_table_from_df(conn, chunk, name)
+            elif isinstance(chunk, pd.DataFrame):
+                conn.from_df(chunk).insert_into(name)
+            else:
+                conn.from_arrow(chunk).insert_into(name)
+            total_rows += len(chunk)
+            total_bytes += df_bytes(chunk)
+            if progress:
+                progress(count, total_rows)
+    except BaseException:
+        conn.execute(f'drop table if exists {name}')
+        raise
+    if count == 0:
+        raise ValueError(f'no chunks to save in {name}')
+    return total_rows, total_bytes
+
+
+def save_df(conn, df, name, zero_copy: bool = False,
+            progress=_log_progress):
+    """
+    save dataframe to a new table in duckdb
+
+    df is a pandas dataframe, an arrow table or an iterator of dataframes or
+    arrow record batches such as a record batch reader. chunks are appended
+    as they arrive and progress(chunks, rows) is called after each one.
+    with zero_copy the pandas or arrow frame is registered as a view
+    without copying it. call release_df before dropping the frame
+    """
+    if not _is_frame(df):
+        if zero_copy:
+            raise ValueError('zero_copy needs a dataframe, not chunks')
+        _save_chunks(conn, df, name, progress)
+    elif zero_copy:
+        conn.register(name, df)
+        _conn_views(conn)[name] = {'df': df, 'uses': 0}
+    else:
+        _create_table_from_df(conn, df, name)
+
+
+def connect(database: str = ':memory:'):
+    'connect to an in-memory or on-disk cache database'
+    if database != ':memory:':
+        pathlib.Path(database).parent.mkdir(parents=True, exist_ok=True)
+    conn = duckdb.connect(database=database, read_only=False)
+    conn.execute(f"""
+        create table if not exists {ENTRIES_TABLE} (
+            key varchar primary key,
+            table_name varchar,
+            content_hash varchar,
+            bytes bigint,
+            rows bigint,
+            created double,
+            last_used double
+        )""")
+    # views registered by an earlier session are gone
+    tables = list_tables(conn)
+    for key, table_name in conn.execute(
+            f'select key, table_name from {ENTRIES_TABLE}').fetchall():
+        if table_name not in tables:
+            conn.execute(
+                f'delete from {ENTRIES_TABLE} where key = ?', [key])
+    return conn
+
+
+def df_bytes(df) -> int:
+    'memory used by a dataframe including python objects'
+    if not isinstance(df, pd.DataFrame):
+        return df.nbytes
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def df_hash(df) -> str:
+    'hash of the columns, types, index and values of a dataframe'
+    digest = hashlib.sha1()
+    digest.update(repr([(str(col), str(df[col].dtype))
+                        for col in df.columns]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).values)
+    return digest.hexdigest()
+
+
+def _entry(conn, key: str):
+    'table name and content hash of a cache entry or None'
+    return conn.execute(
+        f'select table_name, content_hash from {ENTRIES_TABLE} '
+        'where key = ?', [key]).fetchone()
+
+
+def delete(conn, key: str) -> bool:
+    'remove a cache entry, returns false if there is none'
+    entry = _entry(conn, key)
+    if entry is None:
+        return False
+    drop_df(conn, entry[0])
+    conn.execute(f'delete from {ENTRIES_TABLE} where key = ?', [key])
+    return True
+
+
+def put(conn, key: str, df, hash_content: bool = False,
+        max_bytes: int = MAX_BYTES, max_entries: int = 0,
+        zero_copy: bool = False):
+    """
+    cache dataframe df as key replacing an older entry
+
+    with hash_content an entry with the same content is kept instead of
+    being written again. zero_copy registers df as a view (see save_df).
+    a view counts its full size against max_bytes as it is materialized
+    once used repeatedly. df may be an iterator of chunks, which cannot be
+    hashed or registered. the older entry is replaced only after df is
+    saved. returns the keys evicted to stay in the budget
+    """
+    chunked = not _is_frame(df)
+    if chunked and (hash_content or zero_copy):
+        raise ValueError('hash_content and zero_copy need a dataframe')
+    content_hash = df_hash(df) if hash_content else None
+    entry = _entry(conn, key)
+    now = time.time()
+    if entry is not None and content_hash is not None \
+            and entry[1] == content_hash:
+        _touch(conn, key)
+        return []
+    table_name = get_new_table_name(conn)
+    if chunked:
+        rows, size = _save_chunks(conn, df, table_name)
+    else:
+        rows, size = len(df), df_bytes(df)
+        save_df(conn, df, table_name, zero_copy)
+    try:
+        _swap_entry(conn, key, entry, [table_name, content_hash, size,
+                                       rows, now, now])
+    except BaseException:
+        drop_df(conn, table_name)
+        raise
+    return evict(conn, max_bytes, max_entries, keep=key)
+
+
+def _swap_entry(conn, key: str, entry, values: list):
+    'point key at a new table and drop its old table in one transaction'
+    old_view = entry is not None and is_view(conn, entry[0])
+    conn.begin()
+    try:
+        if entry is None:
+            conn.execute(
+                f'insert into {ENTRIES_TABLE} values (?, ?, ?, ?, ?, ?, ?)',
+                [key] + values)
+        else:
+            conn.execute(
+                f'update {ENTRIES_TABLE} set table_name = ?, '
+                'content_hash = ?, bytes = ?, rows = ?, created = ?, '
+                'last_used = ? where key = ?', values + [key])
+            if not old_view:
+                conn.execute(f'drop table if exists {entry[0]}')
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    if old_view:
+        # views are not part of the database and cannot be rolled back
+        drop_df(conn, entry[0])
+
+
+def _touch(conn, key: str):
+    conn.execute(
+        f'update {ENTRIES_TABLE} set last_used = ? where key = ?',
+        [time.time(), key])
+
+
+def get(conn, key: str, default=None):
+    'cached dataframe of key or default when not cached'
+    entry = _entry(conn, key)
+    if entry is None:
+        return default
+    _touch(conn, key)
+    return get_df(conn, entry[0])
+
+
+def entries(conn):
+    'cache entries as a dataframe, least recently used first'
+    return conn.execute(
+        f'select * from {ENTRIES_TABLE} order by last_used').fetchdf()
+
+
+def cache_bytes(conn) -> int:
+    'bytes of all cached dataframes'
+    return conn.execute(
+        f'select coalesce(sum(bytes), 0) from {ENTRIES_TABLE}').fetchone()[0]
+
+
+def evict(conn, max_bytes: int = MAX_BYTES, max_entries: int = 0,
+          keep: str = None):
+    """
+    remove least recently used entries over max_bytes or max_entries
+
+    0 disables a limit. the keep entry is never evicted. returns the
+    evicted keys
+    """
+    rows = conn.execute(
+        f'select key, bytes from {ENTRIES_TABLE} '
+        'order by last_used').fetchall()
+    total = sum(size for _, size in rows)
+    count = len(rows)
+    evicted = []
+    for key, size in rows:
+        over_bytes = max_bytes and total > max_bytes
+        over_entries = max_entries and count > max_entries
+        if not (over_bytes or over_entries):
+            break
+        if key == keep:
+            continue
+        delete(conn, key)
+        log.info('evicted %s (%d bytes)', key, size)
+        evicted.append(key)
+        total -= size
+        count -= 1
+    return evicted
+
+
+class ReadWriteLock:
+    'lock shared by readers or held by one writer, writers go first'
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.readers = 0
+        self.writing = False
+        self.writers_waiting = 0
+
+    @contextlib.contextmanager
+    def read(self):
+        with self.condition:
+            while self.writing or self.writers_waiting:
+                self.condition.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                if not self.readers:
+                    self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def write(self):
+        with self.condition:
+            self.writers_waiting += 1
+            while self.writing or self.readers:
+                self.condition.wait()
+            self.writers_waiting -= 1
+            self.writing = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+
+class Cache:
+    """
+    cache of a database shared by threads
+
+    each thread uses its own cursor of the connection. lookups run in
+    parallel, puts, deletes and evictions wait for them and run alone.
+    frames cannot be registered zero copy as a view is only visible to the
+    cursor which registered it
+    """
+
+    def __init__(self, database: str = ':memory:',
+                 max_bytes: int = MAX_BYTES, max_entries: int = 0):
+        self.conn = connect(database)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.lock = ReadWriteLock()
+        # readers update the last use of entries one at a time
+        self.touch_lock = threading.Lock()
+        self.local = threading.local()
+
+    def cursor(self):
+        'cursor of the calling thread'
+        cursor = getattr(self.local, 'cursor', None)
+        if cursor is None:
+            cursor = self.local.cursor = self.conn.cursor()
+        return cursor
+
+    def get(self, key: str, default=None):
+        cursor = self.cursor()
+        with self.lock.read():
+            entry = _entry(cursor, key)
+            if entry is None:
+                return default
+            df = get_df(cursor, entry[0])
+            with self.touch_lock:
+                _touch(cursor, key)
+        return df
+
+    def get_batches(self, key: str, batch_size: int = BATCH_ROWS,
+                    arrow: bool = False):
+        """
+        batches of key
+
+        the lock is only held to start the read, which runs in a cursor of
+        its own, so writers and the calling thread can use the cache between
+        batches
+        """
+        cursor = self.cursor()
+        with self.lock.read():
+            entry = _entry(cursor, key)
+            if entry is None:
+                raise KeyError(key)
+            with self.touch_lock:
+                _touch(cursor, key)
+            batches = get_batches(cursor, entry[0], batch_size, arrow)
+            # start the query while the table cannot be evicted
+            first = next(batches, None)
+        if first is not None:
+            yield first
+            yield from batches
+
+    def put(self, key: str, df, hash_content: bool = False):
+        with self.lock.write():
+            return put(self.cursor(), key, df, hash_content,
+                       self.max_bytes, self.max_entries)
+
+    def delete(self, key: str) -> bool:
+        with self.lock.write():
+            return delete(self.cursor(), key)
+
+    def evict(self) -> list:
+        with self.lock.write():
+            return evict(self.cursor(), self.max_bytes, self.max_entries)
+
+    def entries(self):
+        with self.lock.read():
+            return entries(self.cursor())
+
+    def close(self):
+        with self.lock.write():
+            self.conn.close()
 
 
 def get_example_name_value_df(rows=10):
@@ -90,6 +559,127 @@ def timer_func(func):
     return wrap_func
 
 
+class Unhashable(Exception):
+    'argument without a key identifying its content'
+
+
+_SCALARS = (str, bytes, bool, int, float, complex)
+
+
+def _arg_hash(value):
+    """
+    key of an argument, by content for dataframes and arrays
+
+    containers are keyed item by item and builtin scalars by repr. raises
+    Unhashable when the repr of another value is truncated or shows its
+    address instead of its content
+    """
+    if value is None or isinstance(value, _SCALARS):
+        return repr(value)
+    if isinstance(value, pd.DataFrame):
+        return df_hash(value)
+    if isinstance(value, pd.Series):
+        return df_hash(value.to_frame())
+    if isinstance(value, np.ndarray):
+        if value.dtype == object:
+            return ('ndarray', value.shape, _arg_hash(value.tolist()))
+        digest = hashlib.sha1(np.ascontiguousarray(value).tobytes())
+        return ('ndarray', str(value.dtype), value.shape, digest.hexdigest())
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__, [_arg_hash(item) for item in value])
+    if isinstance(value, dict):
+        return ('dict', sorted((repr(_arg_hash(key)), _arg_hash(item))
+                               for key, item in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return (type(value).__name__,
+                sorted(repr(_arg_hash(item)) for item in value))
+    text = repr(value)
+    if ' at 0x' in text or '...' in text:
+        raise Unhashable(text)
+    return text
+
+
+def _source_hash(func) -> str:
+    try:
+        source = inspect.getsource(func).encode()
+    except (OSError, TypeError):
+        source = func.__code__.co_code
+    return hashlib.sha1(source).hexdigest()[:12]
+
+
+def _store_functions(store):
+    'get, put, delete and entries of a connection or a Cache'
+    if isinstance(store, Cache):
+        return store.get, store.put, store.delete, store.entries
+    return tuple(functools.partial(func, store)
+                 for func in (get, put, delete, entries))
+
+
+def cached(store):
+    """
+    decorator caching the dataframes returned by a function in store
+
+    store is a connection or a Cache. the key hashes the qualified name and
+    source of the function and its arguments, dataframes and arrays by
+    content and other arguments by repr. calls with an argument without a
+    usable repr are not cached. entries of an older version of the function
+    are deleted when it is first called. wrapper.stats counts the hits,
+    misses and uncached calls and the seconds spent in hits and misses
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        prefix = f'{func.__module__}.{func.__qualname__}:'
+        version = f'{prefix}{_source_hash(func)}:'
+        lookup, save, remove, list_entries = _store_functions(store)
+        stats = {'hits': 0, 'misses': 0, 'uncached': 0, 'hit_seconds': 0.0,
+                 'miss_seconds': 0.0}
+        stats_lock = threading.Lock()
+        invalidated = []
+
+        def invalidate():
+            for key in list_entries().key:
+                if key.startswith(prefix) and not key.startswith(version):
+                    log.info('deleting %s of an older version', key)
+                    remove(key)
+            invalidated.append(True)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            if not invalidated:
+                invalidate()
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            try:
+                arg_hashes = [(name, _arg_hash(value))
+                              for name, value in bound.arguments.items()]
+            except Unhashable as exc:
+                log.info('not caching %s, no key for %s',
+                         func.__qualname__, exc)
+                with stats_lock:
+                    stats['uncached'] += 1
+                return func(*args, **kwargs)
+            digest = hashlib.sha1(repr(arg_hashes).encode())
+            key = version + digest.hexdigest()
+            result = lookup(key)
+            hit = result is not None
+            if not hit:
+                result = func(*args, **kwargs)
+                if isinstance(result, pd.DataFrame):
+                    save(key, result)
+            elapsed = time.time() - start
+            outcome = 'hit' if hit else 'miss'
+            with stats_lock:
+                stats['hits' if hit else 'misses'] += 1
+                stats[f'{outcome}_seconds'] += elapsed
+            log.info('%s %s in %.4fs', func.__qualname__, outcome, elapsed)
+            return result
+
+        wrapper.stats = stats
+        return wrapper
+    return decorator
+
+
 def main() -> None:
     conn = duckdb.connect(database=":memory:", read_only=False)
     df = pd.DataFrame({
@@ -114,6 +704,11 @@ def main() -> None:
     print('Time to save dataframe with {:,} rows: {:.4f}s'.format(
           example_df.shape[0], time.time() - start))
 
+    start = time.time()
+    save_df(conn, example_df, 'view3', zero_copy=True)
+    print('Time to register dataframe with {:,} rows: {:.4f}s'.format(
+          example_df.shape[0], time.time() - start))
+
     print('It takes about 2 minutes to group and sum data. Please wait...')
 
     @timer_func
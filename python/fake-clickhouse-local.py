@@ -0,0 +1,53 @@
+"""
+Stand-in for clickhouse-local --interactive used by test_parq_chlocal.
+
+Speaks the part of the protocol parq_chlocal uses: one statement per line
+on stdin, SELECT '<marker>' FORMAT TSVRaw echoes the marker and a query
+ending in INTO OUTFILE '<file>' FORMAT Arrow writes an arrow file with the
+query text and the process id. A query containing bad fails with an
+exception on stderr and one containing crash exits the process.
+"""
+import os
+import re
+import sys
+
+import pyarrow as pa
+
+VERSION = "0.0.0-fake"
+
+OUTFILE = re.compile(r"^(.*) INTO OUTFILE '([^']+)' FORMAT Arrow;$")
+MARKER = re.compile(r"^SELECT '(__parq_done_\d+__)' FORMAT TSVRaw;$")
+
+
+def write_result(sql: str, result_file: str):
+    if sql == "SELECT version()":
+        tbl = pa.table({"version()": [VERSION]})
+    else:
+        tbl = pa.table({"query": [sql], "pid": [os.getpid()]})
+    with pa.OSFile(result_file, "wb") as sink:
+        with pa.ipc.new_file(sink, tbl.schema) as writer:
+            writer.write_table(tbl)
+
+
+def main():
+    for line in sys.stdin:
+        line = line.strip()
+        marker = MARKER.match(line)
+        if marker:
+            print(marker.group(1), flush=True)
+            continue
+        outfile = OUTFILE.match(line)
+        if outfile is None:
+            continue
+        sql, result_file = outfile.groups()
+        if "crash" in sql:
+            sys.exit(1)
+        if "bad" in sql:
+            print("Code: 62. DB::Exception: Syntax error", file=sys.stderr)
+            sys.stderr.flush()
+            continue
+        write_result(sql, result_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,10 +7,10 @@ import sqlalchemy as sa
 import ibis
 import fire
 
-import pyarrow.parquet as pq
-
 from IPython import embed
 
+import parq_footer
+
 
 def clickhouse_sqlalchemy(engine):
     ''' Use pandas and sqlalchemy to read data
@@ -72,15 +72,14 @@ def _check_file(parquet_file):
 
 def _parquet_rowgroup(parquet_file, rowgroup_idx):
     assert isinstance(rowgroup_idx, int), 'rowgroup_idx not valid'
-    parq_file = pq.ParquetFile(parquet_file)
-    metadata = parq_file.metadata
+    metadata = parq_footer.read_metadata(parquet_file)
 
     if rowgroup_idx >= metadata.num_row_groups:
         sys.exit(
             'rowgroup_idx should be less than {}'.format(
                 metadata.num_row_groups))
 
-    return parq_file.metadata.row_group(rowgroup_idx)
+    return metadata.row_group(rowgroup_idx)
 
 
 def _parquet_rowgroup_column(parquet_file, rowgroup_idx, col_idx):
@@ -95,8 +94,7 @@ def _parquet_rowgroup_column(parquet_file, rowgroup_idx, col_idx):
 
 
 def _parquet_column_index(parquet_file, column_name):
-    parq_file = pq.ParquetFile(parquet_file)
-    metadata = parq_file.metadata
+    metadata = parq_footer.read_metadata(parquet_file)
     schema = metadata.schema
     if column_name not in schema.names:
         sys.exit('Invalid column name {}'.format(
@@ -125,20 +123,17 @@ class Parquet:
 
     def metadata(self, parquet_file):
         _check_file(parquet_file)
-        parq_file = pq.ParquetFile(parquet_file)
-        metadata = parq_file.metadata
+        metadata = parq_footer.read_metadata(parquet_file)
         print(metadata)
 
     def schema(self, parquet_file):
-        parq_file = pq.ParquetFile(parquet_file)
-        metadata = parq_file.metadata
+        metadata = parq_footer.read_metadata(parquet_file)
         print(metadata.schema)
 
     def column(self, parquet_file, column_name):
         col_idx = _parquet_column_index(parquet_file, column_name)
         assert col_idx >= 0, 'Invalid column {}'.format(column_name)
-        parq_file = pq.ParquetFile(parquet_file)
-        metadata = parq_file.metadata
+        metadata = parq_footer.read_metadata(parquet_file)
         print(metadata.schema.column(col_idx))
 
     def rowgroup(self, parquet_file, rowgroup_idx):
@@ -157,8 +152,7 @@ class Parquet:
     def column_min_max(self, parquet_file, column_name):
         col_idx = _parquet_column_index(parquet_file, column_name)
         assert col_idx >= 0, 'Invalid column {}'.format(column_name)
-        parq_file = pq.ParquetFile(parquet_file)
-        metadata = parq_file.metadata
+        metadata = parq_footer.read_metadata(parquet_file)
         global_min = None
         global_max = None
 
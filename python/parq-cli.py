@@ -1,14 +1,34 @@
 """
 Compare pandas, duckdb, pyarrow, polars, clickhouse.
 
-python parq-cli.py pandas ~/ontime-100m.parquet  # 65s
-python parq-cli.py duck-pandas ~/ontime-100m.parquet  # 0.9s
-python parq-cli.py duck-arrow ~/ontime-100m.parquet  # 1.4s
-python parq-cli.py arrow-parquet ~/ontime-100m.parquet  # 5s
-python parq-cli.py arrow-parquet-partitioned ~/ontime-100m.parquet  # 4.8s
-python parq-cli.py arrow-dataset-parquet ~/ontime-100m.parquet  # 4.4s
-python parq-cli.py polars-parquet ~/ontime-100m.parquet  # 4.4s
+python parq-cli.py pandas ~/ontime-100m.parquet
+python parq-cli.py duck-pandas ~/ontime-100m.parquet
+python parq-cli.py duck-arrow ~/ontime-100m.parquet
+python parq-cli.py arrow-parquet ~/ontime-100m.parquet
+python parq-cli.py arrow-parquet-partitioned ~/ontime-100m.parquet
+python parq-cli.py arrow-dataset-parquet ~/ontime-100m.parquet
+python parq-cli.py polars-parquet ~/ontime-100m.parquet
+
+Timings depend on the machine and the page cache so use the bench command
+to compare engines instead of a single run.
+
+python parq-cli.py bench ~/ontime-100m.parquet --runs=5 --output=bench.json
+
+Engines are imported when their command runs. Use import-times to see the
+startup cost of each engine and --import-time to report the imports of a
+single command.
+
+python parq-cli.py import-times
+python parq-cli.py duck-arrow ~/ontime-100m.parquet --import-time
+
+Files are given as a file, a directory, a glob or a comma separated list.
+The files are read in parallel and their results merged.
+
+python parq-cli.py arrow-row-groups "~/data/*_cleaned.gzip.parq"
 """
+import atexit
+import contextlib
+import importlib
 import logging
 import time
 import os
@@ -20,35 +40,53 @@ from collections.abc import Iterable
 
 from typing import List
 
-import numpy as np
+from subprocess import DEVNULL, CalledProcessError, check_output
 
-from distutils.spawn import find_executable
-from clickhouse_driver import Client
+import pyarrow as pa
+import pyarrow.parquet as pq
 
-from typing import NamedTuple
+import fire
 
-from subprocess import check_output
+import parq_bench
+import parq_clickhouse
+import parq_derived
+import parq_files
+import parq_footer
+import parq_output
+import parq_profile
+import parq_query
+import parq_stats
+from parq_query import QuerySpec
 
-import pyarrow as pa
-import pyarrow.dataset as ds
-import pyarrow.parquet as pq
-import pyarrow.compute as pc
+log = logging.getLogger(__name__)
+SCRIPT_DIR = pathlib.Path(__file__).parent.resolve()
 
-import duckdb
-import pandas as pd
+# Seconds taken by the first import of each engine module
+IMPORT_TIMES = {}
 
-import datafusion
-from datafusion import functions as f
-from datafusion import col
-from datafusion import literal
 
-import polars as pl
+def import_engine(module_name: str):
+    """
+    Import a module only needed by some engines.
 
-import fire
+    Engines are imported when their command runs so the metadata commands
+    neither pay for nor require pandas, duckdb, polars, datafusion or
+    clickhouse_driver.
+    """
+    if module_name not in sys.modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(module_name)
+        except ImportError as exc:
+            sys.exit(f"Cannot import {module_name}: {exc}. Is it installed?")
+        IMPORT_TIMES[module_name] = time.perf_counter() - start
+    return sys.modules[module_name]
 
 
-log = logging.getLogger(__name__)
-SCRIPT_DIR = pathlib.Path(__file__).parent.resolve()
+def print_import_times():
+    """Print the time taken by engine imports."""
+    for module_name, elapsed in IMPORT_TIMES.items():
+        print(f"Import {module_name:<24s}{elapsed:.4f}", file=sys.stderr)
 
 
 def to_string_ljustify(df):
@@ -57,7 +95,7 @@ def to_string_ljustify(df):
     for col_name in df.columns:
         col = df[col_name]
         if col.dtype == "object":
-            col_len_max = col.apply(len).max()
+            col_len_max = col.str.len().max()
             col_format = "{{:<{}s}}".format(col_len_max)
             col_formatters.append(col_format.format)
         else:
@@ -75,6 +113,7 @@ def to_string_ljustify(df):
 def print_tty_redir(df):
     """Print data frame to a tty (partial) or redirected output (full)."""
     if df is not None:
+        pd = import_engine("pandas")
         if sys.stdout.isatty():
             print(df.to_string(index=False))
         else:
@@ -91,6 +130,26 @@ def check_file_exists(file_name: str):
         sys.exit(f"File {data_file} does not exist")
 
 
+def check_files(parquet_file) -> List[str]:
+    """
+    Files of a file, directory, glob or comma separated list.
+
+    Exits if there are no files or a file does not exist.
+    """
+    parquet_files = parq_files.expand(parquet_file)
+    if not parquet_files:
+        sys.exit(f"No parquet files in {parquet_file}")
+    for data_file in parquet_files:
+        check_file_exists(data_file)
+    return parquet_files
+
+
+def print_file_header(parquet_files: List[str], parquet_file: str):
+    """Print the file name before its output when there are several."""
+    if len(parquet_files) > 1:
+        print(f"==> {parquet_file} <==")
+
+
 def column_schema_to_dict(column_schema) -> dict:
     """Convert column schema to dict."""
     attrs = [
@@ -109,20 +168,27 @@ def check_column_exists(parquet_file: str, column_name: str):
 
     returns parquet metadata
     """
-    pq_file = pq.ParquetFile(parquet_file)
-    schema = pq_file.metadata.schema
-    if column_name not in schema.names:
+    metadata = parq_footer.read_metadata(parquet_file)
+    if column_name not in metadata.schema.names:
         sys.exit(f"Invalid column {column_name}")
-    return pq_file.metadata
+    return metadata
 
 
-def get_min_row_groups(
-    all_row_groups: int, head_row_groups: int, all: bool = False
-):
-    """Returns smaller number of row groups unless all is True."""
-    if all:
-        return all_row_groups
-    return min(all_row_groups, head_row_groups)
+def check_query_columns(parquet_files: List[str], spec: QuerySpec):
+    """Exits if a column of the query is not in every file."""
+    for metadata in read_metadatas(parquet_files):
+        names = set(metadata.schema.names)
+        for column_name in spec.input_columns():
+            if column_name not in names:
+                sys.exit(f"Invalid column {column_name}")
+
+
+def warn_all_row_groups(all_row_groups: bool):
+    """Warn that --all is no longer needed to see every row group."""
+    if all_row_groups:
+        print(
+            "--all is deprecated, every row group is shown", file=sys.stderr
+        )
 
 
 """
@@ -133,51 +199,18 @@ select * from parquet_schema('{}')
 """
 
 
-ParquetClickhouseType = NamedTuple(
-    "ParquetClickhouseType", [("parquet", str), ("clickhouse", str)]
-)
-
-pc_types = [
-    pc_type.split()
-    for pc_type in (
-        "UINT8 UInt8",
-        "INT8 Int8",
-        "UINT16 UInt16",
-        "INT16 Int16",
-        "UINT32 UInt32",
-        "INT32 Int32",
-        "UINT64 UInt64",
-        "INT64 Int64",
-        "FLOAT Float32",
-        "DOUBLE Float64",
-        "BYTE_ARRAY String",
-    )
-]
-pc_dict = {p_type: c_type for p_type, c_type in pc_types}
-cp_dict = {c_type: p_type for p_type, c_type in pc_types}
-
-
 def check_executable(executable_name):
-    """Return False if executable is not available."""
-    prg = find_executable(executable_name)
+    """Exits if executable is not in the PATH."""
+    prg = shutil.which(executable_name)
     if prg is None:
         sys.exit(f"Cannot find {executable_name}. Is it in the PATH?")
-    output = check_output("{} --version".format(prg), shell=True)
-    print("Found {}".format(output.decode("unicode_escape")))
+    return prg
 
 
-def get_clickhouse_types(parquet_file):
+def get_clickhouse_types(parquet_files: List[str]):
     """Get parquet columns as clickhouse types string."""
-    pq_file = pq.ParquetFile(parquet_file)
-    schema = pq_file.metadata.schema
-    pq_types = []
-    for idx, col_name in enumerate(schema.names):
-        col_name = schema.column(idx).name
-        col_type = schema.column(idx).physical_type
-        pq_types.append([col_name, pc_dict[col_type]])
-    return ", ".join(
-        f"{col_name} {col_type}" for col_name, col_type in pq_types
-    )
+    metadatas = parq_files.map_files(parq_footer.read_metadata, parquet_files)
+    return parq_clickhouse.structure(metadatas)
 
 
 def ch_server_184m():
@@ -187,7 +220,10 @@ def ch_server_184m():
     if ch_password is None:
         msg = "Clickhouse password for user {} not specified. Set CH_PASSWORD"
         sys.exit(msg.format(ch_user))
-    client = Client("127.0.0.1", user=ch_user, password=ch_password)
+    clickhouse_driver = import_engine("clickhouse_driver")
+    client = clickhouse_driver.Client(
+        "127.0.0.1", user=ch_user, password=ch_password
+    )
     # for database in client.execute('show databases'):
     #     print(database)
     sql = """
@@ -207,6 +243,7 @@ def ch_server_184m():
 def arrow_compute_example():
     """Arrow compute examples."""
     # https://arrow.apache.org/cookbook/py/data.html
+    pc = import_engine("pyarrow.compute")
 
     tbl = pa.table({"name": list("aabccc"), "value": [1, 1, 1, 2, 3, 3]})
     print("table data")
@@ -265,6 +302,12 @@ def datafusion_compute_example():
     """Datafusion compute examples."""
     # https://arrow.apache.org/cookbook/py/data.html
 
+    pc = import_engine("pyarrow.compute")
+    datafusion = import_engine("datafusion")
+    f = import_engine("datafusion.functions")
+    col = datafusion.col
+    literal = datafusion.literal
+
     tbl = pa.table({"name": list("aabccc"), "value": list(range(6))})
 
     ctx = datafusion.ExecutionContext()
@@ -334,331 +377,1411 @@ def datafusion_compute_example():
     )
 
 
-def write_parquet_partitioned(parquet_file: str, partition_cols: List[str]):
-    """Write partitioned parquet file."""
-    local = pa.fs.LocalFileSystem()
-    tbl = pq.read_table(parquet_file, filesystem=local)
-    pq_root_path = pathlib.Path(parquet_file).with_suffix(suffix='')
-    home_pq_path = pathlib.Path.home() / '.parq-cli' / pq_root_path.name
-    if home_pq_path.exists():
-        shutil.rmtree(home_pq_path)
-    pq.write_to_dataset(
-        tbl, home_pq_path, partition_cols=partition_cols, compression="lz4"
+def derived_copy_files(parquet_files: List[str], fmt: str, **options):
+    """
+    Cached copies of parquet files converted in parallel.
+
+    Prints the conversion time of each copy.
+    """
+    copies = parq_derived.derived_copies(parquet_files, fmt, **options)
+    for derived in copies:
+        if derived.convert_time:
+            print(
+                "Converted to {} in {:.4f} ({:,} bytes)".format(
+                    fmt, derived.convert_time, derived.size
+                )
+            )
+        else:
+            print(f"Reused cached {fmt} copy {derived.path.name}")
+    return [derived.path for derived in copies]
+
+
+def read_metadatas(parquet_files: List[str]):
+    """Footers of parquet files read in parallel."""
+    return parq_files.map_files(parq_footer.read_metadata, parquet_files)
+
+
+def concat_tables(tables):
+    """One table of the tables of several files."""
+    tables = list(tables)
+    if len(tables) == 1:
+        return tables[0]
+    # partition columns of each file have their own dictionaries
+    tbl = pa.concat_tables(tables, promote_options="default")
+    return tbl.unify_dictionaries()
+
+
+def polars_parquet_engine(parquet_files: List[str], spec: QuerySpec):
+    """Use polars to process parquet files."""
+    pl = import_engine("polars")
+
+    def query():
+        lazy_frame = pl.concat(
+            [pl.scan_parquet(parquet_file) for parquet_file in parquet_files]
+        )
+        result = parq_query.polars_query(spec, lazy_frame)
+        with parq_profile.span("aggregate"):
+            result = result.collect()
+        with parq_profile.span("convert"):
+            return result.to_pandas()
+
+    return query
+
+
+def pandas_engine(parquet_files: List[str], spec: QuerySpec):
+    """Query parquet files using pandas, reading the files in parallel."""
+    pd = import_engine("pandas")
+    if spec.filters:
+        pq_files = {
+            parquet_file: parq_footer.open_parquet(parquet_file)
+            for parquet_file in parquet_files
+        }
+        row_groups = {
+            parquet_file: parq_stats.matching_row_groups(
+                pq_file.metadata, spec.filters
+            )
+            for parquet_file, pq_file in pq_files.items()
+        }
+
+    def read_file(parquet_file):
+        if spec.filters:
+            pq_file = pq_files[parquet_file]
+            with parq_profile.span("decode"):
+                tbl = pq_file.read_row_groups(row_groups[parquet_file])
+            with parq_profile.span("convert"):
+                return tbl.to_pandas()
+        with parq_profile.span("decode"):
+            return pd.read_parquet(
+                parq_profile.input_file(parquet_file), engine='pyarrow'
+            )
+
+    def query():
+        dfs = parq_files.map_files(read_file, parquet_files)
+        with parq_profile.span("convert"):
+            if len(dfs) == 1:
+                df = dfs[0]
+            else:
+                df = pd.concat(dfs, ignore_index=True)
+        with parq_profile.span("aggregate"):
+            return parq_query.pandas_query(spec, df)
+
+    return query
+
+
+def duckdb_source(parquet_files: List[str]) -> str:
+    """Duckdb table function scanning parquet files."""
+    if len(parquet_files) == 1:
+        return f"parquet_scan('{parquet_files[0]}')"
+    paths = ", ".join(f"'{parquet_file}'" for parquet_file in parquet_files)
+    return f"parquet_scan([{paths}])"
+
+
+def duck_pandas_engine(parquet_files: List[str], spec: QuerySpec):
+    """Query parquet files using duckdb and pandas."""
+    duckdb = import_engine("duckdb")
+    con = duckdb.connect(database=":memory:", read_only=False)
+    sql_query = parq_query.to_sql(spec, duckdb_source(parquet_files))
+
+    def query():
+        with parq_profile.span("aggregate"):
+            result = con.execute(sql_query)
+        with parq_profile.span("convert"):
+            return result.fetchdf()
+
+    return query
+
+
+def duck_arrow_engine(parquet_files: List[str], spec: QuerySpec):
+    """Query parquet files using duckdb and arrow."""
+    ds = import_engine("pyarrow.dataset")
+    duckdb = import_engine("duckdb")
+    ontime = ds.dataset(parquet_files)
+    ontime_db = duckdb.arrow(ontime)
+
+    @parq_profile.phase("aggregate")
+    def query():
+        rel = ontime_db
+        if spec.filters:
+            rel = rel.filter(parq_query.sql_where(spec))
+        if not spec.aggregates:
+            return rel.project(parq_query.sql_select_list(spec)).df()
+        return rel.aggregate(
+            parq_query.sql_select_list(spec), ", ".join(spec.group_by)
+        ).df()
+
+    return query
+
+
+def ch_local_engine(
+    parquet_files: List[str], spec: QuerySpec, workers: int = 1
+):
+    """
+    Query parquet files using a pool of clickhouse-local processes.
+
+    The processes are started once so queries do not pay for the startup.
+    Several files are read as a union of file table functions which
+    clickhouse reads in parallel.
+    """
+    parq_chlocal = import_engine("parq_chlocal")
+    executable = check_executable(parq_chlocal.EXECUTABLE)
+    ch_types_str = get_clickhouse_types(parquet_files)
+    print(ch_types_str)
+
+    pool = parq_chlocal.WorkerPool(workers, executable)
+    atexit.register(pool.close)
+    print(
+        "Started {} clickhouse-local {} in {:.4f}".format(
+            len(pool.workers), pool.workers[0].version, pool.startup_time
+        )
     )
-    return home_pq_path
+
+    sources = [
+        "file('{}', Parquet, '{}')".format(parquet_file, ch_types_str)
+        for parquet_file in parquet_files
+    ]
+    source = sources[0]
+    if len(sources) > 1:
+        selects = " UNION ALL ".join(f"SELECT * FROM {s}" for s in sources)
+        source = f"({selects})"
+    clickhouse_query = parq_query.to_sql(spec, source)
+
+    @parq_profile.phase("aggregate")
+    def query():
+        return pool.query(clickhouse_query)
+
+    return query
 
 
-def write_feather_file(parquet_file: str):
-    """Write feather file."""
+def arrow_parquet_engine(parquet_files: List[str], spec: QuerySpec):
+    """Use arrow to read parquet files skipping row groups using filters."""
     local = pa.fs.LocalFileSystem()
-    tbl = pq.read_table(parquet_file, filesystem=local)
-    feather_file = pathlib.Path(parquet_file).with_suffix(suffix='.feather')
-    home_feather = pathlib.Path.home() / '.parq-cli' / feather_file.name
-    if home_feather.exists():
-        home_feather.unlink()
-    pa.feather.write_feather(tbl, home_feather, compression="lz4")
-    return home_feather
+    if spec.filters:
+        pq_files = {
+            parquet_file: parq_footer.open_parquet(parquet_file)
+            for parquet_file in parquet_files
+        }
+        row_groups = {
+            parquet_file: parq_stats.matching_row_groups(
+                pq_file.metadata, spec.filters
+            )
+            for parquet_file, pq_file in pq_files.items()
+        }
+
+    @parq_profile.phase("decode")
+    def read_file(parquet_file):
+        if spec.filters:
+            pq_file = pq_files[parquet_file]
+            return pq_file.read_row_groups(row_groups[parquet_file])
+        source = parq_profile.input_file(parquet_file)
+        return pq.read_table(source, filesystem=local)
+
+    def query():
+        tables = parq_files.map_files(read_file, parquet_files)
+        with parq_profile.span("aggregate"):
+            return parq_query.arrow_query(spec, concat_tables(tables))
+
+    return query
+
+
+def arrow_parquet_partitioned_engine(
+    parquet_files: List[str],
+    spec: QuerySpec,
+    partition_by="Year",
+    codec="lz4",
+):
+    """Use arrow to read partitioned copies of parquet files."""
+    home_pq_paths = derived_copy_files(
+        parquet_files,
+        "partitioned",
+        partition_cols=parq_query.split_names(partition_by),
+        codec=codec,
+    )
+
+    @parq_profile.phase("decode")
+    def read_copy(home_pq_path):
+        local = pa.fs.LocalFileSystem()
+        return pq.read_table(home_pq_path, filesystem=local)
+
+    def query():
+        tables = parq_files.map_files(read_copy, home_pq_paths)
+        with parq_profile.span("aggregate"):
+            return parq_query.arrow_query(spec, concat_tables(tables))
+
+    return query
+
+
+def arrow_parquet_feather_engine(
+    parquet_files: List[str], spec: QuerySpec, codec="lz4"
+):
+    """Use arrow to read feather copies of parquet files."""
+    feather = import_engine("pyarrow.feather")
+    home_feathers = derived_copy_files(parquet_files, "feather", codec=codec)
+
+    @parq_profile.phase("decode")
+    def read_copy(home_feather):
+        return feather.read_table(home_feather, columns=spec.input_columns())
+
+    def query():
+        tables = parq_files.map_files(read_copy, home_feathers)
+        with parq_profile.span("aggregate"):
+            return parq_query.arrow_query(spec, concat_tables(tables))
+
+    return query
+
+
+def arrow_ipc_mmap_engine(parquet_files: List[str], spec: QuerySpec):
+    """
+    Use arrow to query memory mapped uncompressed arrow IPC copies.
+
+    Column buffers are used in place from the page cache without being
+    decompressed or copied.
+    """
+    ipc_files = derived_copy_files(
+        parquet_files, "feather", codec="uncompressed"
+    )
+
+    @parq_profile.phase("read")
+    def read_table():
+        tables = []
+        for ipc_file in ipc_files:
+            source = pa.memory_map(str(ipc_file))
+            tables.append(pa.ipc.open_file(source).read_all())
+        return concat_tables(tables)
+
+    def column_bytes(ipc_file):
+        # batches of a memory map are views, only their metadata is read
+        reader = pa.ipc.open_file(pa.memory_map(str(ipc_file)))
+        return sum(
+            reader.get_batch(idx)
+            .select(spec.input_columns())
+            .get_total_buffer_size()
+            for idx in range(reader.num_record_batches)
+        )
+
+    print(
+        "Query column buffers are {:,} of {:,} file bytes".format(
+            sum(column_bytes(ipc_file) for ipc_file in ipc_files),
+            sum(ipc_file.stat().st_size for ipc_file in ipc_files),
+        )
+    )
+
+    def query():
+        tbl = read_table().select(spec.input_columns())
+        with parq_profile.span("aggregate"):
+            return parq_query.arrow_query(spec, tbl)
+
+    return query
+
+
+def arrow_dataset_parquet_engine(parquet_files: List[str], spec: QuerySpec):
+    """Use arrow datasets to read parquet files."""
+    ds = import_engine("pyarrow.dataset")
+
+    def query():
+        # filters are pushed down to the dataset scan
+        with parq_profile.span("decode"):
+            tbl = ds.dataset(parquet_files, format="parquet").to_table(
+                columns=spec.input_columns(),
+                filter=parq_query.arrow_expression(spec.filters),
+            )
+        with parq_profile.span("aggregate"):
+            return parq_query.arrow_query(spec._replace(filters=[]), tbl)
+
+    return query
+
+
+def print_plans(plans):
+    """Print the row groups skipped, answered from statistics and scanned."""
+    print(
+        "Row groups: {} skipped, {} from statistics, {} scanned".format(
+            sum(len(plan.skipped) for plan in plans),
+            sum(len(plan.from_stats) for plan in plans),
+            sum(len(plan.scanned) for plan in plans),
+        )
+    )
+
+
+def arrow_row_groups_engine(
+    parquet_files: List[str],
+    spec: QuerySpec,
+    workers: int = 0,
+    stats: bool = True,
+):
+    """
+    Use arrow to aggregate row groups in parallel and merge the results.
+
+    Only the query columns are read and each worker holds one row group.
+    The row groups of all files share the workers. Row groups which cannot
+    match the filters are skipped. Counts, null counts, min and max are
+    answered from statistics where possible.
+    """
+    parq_aggregate = import_engine("parq_aggregate")
+    metadatas = read_metadatas(parquet_files)
+    plans = [
+        parq_aggregate.plan_row_groups(metadata, spec, stats)
+        for metadata in metadatas
+    ]
+    print_plans(plans)
+
+    def query():
+        return parq_aggregate.scan_files(
+            parquet_files, spec, metadatas, plans, workers
+        )
+
+    return query
+
+
+def arrow_stream_engine(
+    parquet_files: List[str],
+    spec: QuerySpec,
+    memory_mb: int = 256,
+    batch_size: int = 0,
+    stats: bool = True,
+):
+    """
+    Use arrow to fold record batches into a partial aggregate.
+
+    Memory depends on the batch size and the number of groups, not on the
+    file sizes, so files larger than memory can be queried. Files are
+    streamed one after the other.
+    """
+    parq_aggregate = import_engine("parq_aggregate")
+    metadatas = read_metadatas(parquet_files)
+    plans = [
+        parq_aggregate.plan_row_groups(metadata, spec, stats)
+        for metadata in metadatas
+    ]
+    memory_budget = memory_mb * 1024 * 1024
+    if not batch_size:
+        batch_size = min(
+            parq_aggregate.stream_batch_size(
+                metadata, spec.input_columns(), memory_budget
+            )
+            for metadata in metadatas
+        )
+    print_plans(plans)
+    print(f"Batch size {batch_size:,} rows, memory budget {memory_mb} MB")
+
+    def query():
+        return parq_aggregate.stream_files(
+            parquet_files, spec, metadatas, plans, memory_budget, batch_size
+        )
+
+    return query
+
+
+def hll_sketch_engine(parquet_files: List[str], spec: QuerySpec):
+    """
+    Answer counts and approximate distinct counts from HyperLogLog sketches.
+
+    The sketches are built by the sketch build command. The sketches of
+    several files are merged like the sketches of row groups.
+    """
+    parq_sketch = import_engine("parq_sketch")
+    sketches = []
+    for parquet_file in parquet_files:
+        sketch_info = parq_sketch.find(parquet_file, spec)
+        if sketch_info is None:
+            sys.exit(
+                f"No sketch for the query on {parquet_file}. Build one with "
+                "sketch build and the same query options"
+            )
+        sketch = parq_sketch.load(sketch_info.path)
+        metadata = parq_footer.read_metadata(parquet_file)
+        stale = parq_sketch.stale_row_groups(metadata, sketch)
+        if stale:
+            sys.exit(
+                f"Sketch of {parquet_file} is missing {len(stale)} row "
+                "groups. Run sketch build"
+            )
+        sketches.append(sketch)
+    sketch = parq_sketch.combine(sketches, spec)
+
+    @parq_profile.phase("aggregate")
+    def query():
+        return parq_sketch.query(sketch, spec)
+
+    return query
+
+
+def datafusion_parquet_engine(parquet_files: List[str], spec: QuerySpec):
+    """Use datafusion to process parquet files."""
+    datafusion = import_engine("datafusion")
+    ctx = datafusion.ExecutionContext()
+    for idx, parquet_file in enumerate(parquet_files):
+        ctx.register_parquet(f"t{idx}", parquet_file)
+
+    df = ctx.table("t0")
+    for idx in range(1, len(parquet_files)):
+        df = df.union(ctx.table(f"t{idx}"))
+
+    def query():
+        batches = parq_query.datafusion_query(spec, df)
+        with parq_profile.span("aggregate"):
+            return pa.Table.from_batches(batches.collect())
+
+    return query
+
+
+# Each engine does its setup and returns a query function which is timed
+ENGINES = {
+    "pandas": pandas_engine,
+    "duck_pandas": duck_pandas_engine,
+    "duck_arrow": duck_arrow_engine,
+    "arrow_parquet": arrow_parquet_engine,
+    "arrow_parquet_partitioned": arrow_parquet_partitioned_engine,
+    "arrow_parquet_feather": arrow_parquet_feather_engine,
+    "arrow_ipc_mmap": arrow_ipc_mmap_engine,
+    "arrow_dataset_parquet": arrow_dataset_parquet_engine,
+    "arrow_row_groups": arrow_row_groups_engine,
+    "arrow_stream": arrow_stream_engine,
+    "polars_parquet": polars_parquet_engine,
+    "datafusion_parquet": datafusion_parquet_engine,
+    "hll_sketch": hll_sketch_engine,
+    "ch_local": ch_local_engine,
+}
+
+# Engines needing sketches built or clickhouse-local installed, only run by
+# bench and verify when named
+OPTIONAL_ENGINES = {"hll_sketch", "ch_local"}
+DEFAULT_ENGINES = ",".join(
+    name for name in ENGINES if name not in OPTIONAL_ENGINES
+)
+
+# Modules imported by each engine in addition to pyarrow.parquet
+ENGINE_MODULES = {
+    "pandas": ["pandas"],
+    "duck_pandas": ["duckdb", "pandas"],
+    "duck_arrow": ["pyarrow.dataset", "duckdb", "pandas"],
+    "arrow_parquet": [],
+    "arrow_parquet_partitioned": [],
+    "arrow_parquet_feather": ["pyarrow.feather"],
+    "arrow_ipc_mmap": [],
+    "arrow_dataset_parquet": ["pyarrow.dataset"],
+    "arrow_row_groups": ["parq_aggregate"],
+    "arrow_stream": ["parq_aggregate"],
+    "polars_parquet": ["polars"],
+    "datafusion_parquet": ["datafusion", "datafusion.functions"],
+    "hll_sketch": ["parq_sketch"],
+    "ch_local": ["parq_chlocal"],
+}
+# Modules imported by every command
+CORE_MODULES = ["pyarrow.parquet", "fire"]
+
+# Aggregates that engines only approximate, compared with a tolerance
+APPROX_AGGS = {
+    "datafusion_parquet": {"count_distinct"},
+    "hll_sketch": {"count_distinct"},
+}
+
+
+def get_engine_names(engines) -> List[str]:
+    """Engine names from a comma separated string or a sequence."""
+    if isinstance(engines, str):
+        engines = engines.split(",")
+    names = [engine.strip().replace("-", "_") for engine in engines]
+    for name in names:
+        if name not in ENGINES:
+            sys.exit(
+                "Invalid engine {}. Choose from {}".format(
+                    name, ", ".join(ENGINES)
+                )
+            )
+    return names
+
+
+def engine_error(engine_name: str, exc: Exception) -> str:
+    """Print and return the error of an engine which failed."""
+    error = f"{type(exc).__name__}: {exc}"
+    print(f"{engine_name} failed: {error}", file=sys.stderr)
+    return error
+
+
+def setup_engine(engine_name: str, parquet_files: List[str], spec: QuerySpec):
+    """
+    Query function of an engine or None when it cannot run.
+
+    Engines exit when a prerequisite is missing, which would end a
+    comparison of several engines and lose the results already gathered.
+    """
+    try:
+        return ENGINES[engine_name](parquet_files, spec)
+    except SystemExit as exc:
+        print(f"Skipping {engine_name}: {exc}", file=sys.stderr)
+        return None
+    except Exception as exc:
+        engine_error(engine_name, exc)
+        return None
+
+
+def cold_import_time(module_names: List[str]) -> float:
+    """Seconds to import modules in a new interpreter."""
+    imports = "; ".join(f"import {name}" for name in module_names)
+    code = (
+        "import time; start = time.perf_counter(); {}; "
+        "print(time.perf_counter() - start)"
+    ).format(imports or "pass")
+    output = check_output([sys.executable, "-c", code], stderr=DEVNULL)
+    return float(output)
+
+
+def rss_bytes() -> int:
+    """Resident memory of the process or 0 when unknown."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+
+def time_engine(
+    engine_name: str, parquet_file, spec: QuerySpec, **engine_options
+):
+    """Time a single query using an engine and return the result."""
+    parquet_files = check_files(parquet_file)
+    check_query_columns(parquet_files, spec)
+    if len(parquet_files) > 1:
+        print(f"Querying {len(parquet_files)} files")
+    if spec.filters:
+        metadatas = read_metadatas(parquet_files)
+        print(parq_stats.pruning_summary(metadatas, spec.filters))
+    with parq_profile.span("setup"):
+        query = ENGINES[engine_name](parquet_files, spec, **engine_options)
+
+    rss_before = rss_bytes()
+    allocated_before = pa.total_allocated_bytes()
+    start = time.time()
+    result = query()
+    elapsed = time.time() - start
+    print(f"Elapsed {elapsed:.4f}")
+    print(
+        "RSS growth {:.1f} MB, arrow allocated {:.1f} MB".format(
+            (rss_bytes() - rss_before) / 2**20,
+            (pa.total_allocated_bytes() - allocated_before) / 2**20,
+        )
+    )
+    return result
+
+
+def run_engine(
+    engine_name: str,
+    parquet_file,
+    spec: QuerySpec,
+    output: str = "",
+    **engine_options,
+):
+    """
+    Time a single query using an engine and print the result.
+
+    With an output the result is written to stdout or a file in the output
+    format and everything else is printed to stderr.
+    """
+    if not output:
+        result = time_engine(engine_name, parquet_file, spec, **engine_options)
+        if isinstance(result, pa.Table):
+            with parq_profile.span("convert"):
+                result = result.to_pandas()
+        with parq_profile.span("render"):
+            print(result)
+        return
+
+    parq_output.output_format(output)
+    parq_verify = import_engine("parq_verify")
+    with contextlib.redirect_stdout(sys.stderr):
+        result = time_engine(engine_name, parquet_file, spec, **engine_options)
+    with parq_profile.span("convert"):
+        result = parq_verify.to_arrow(result)
+    with parq_profile.span("render"):
+        parq_output.write_table(result, output)
+
+
+def start_profile(profile, sample: str):
+    """
+    Record phase spans and optionally sample stacks until exit.
+
+    The phase times are printed to stderr at exit. profile can be a .json
+    file for the Chrome trace of the spans and sample a file for the
+    folded stacks of the sampling profiler.
+    """
+    parq_profile.enable()
+    sampler = parq_profile.Sampler().start() if sample else None
+
+    def report():
+        recorded = parq_profile.disable()
+        parq_profile.print_summary(recorded)
+        if isinstance(profile, str):
+            parq_profile.write_chrome_trace(recorded, profile)
+            print(f"Wrote Chrome trace {profile}", file=sys.stderr)
+        if sampler is not None:
+            sampler.stop()
+            sampler.write_folded(sample)
+            print(f"Wrote folded stacks {sample}", file=sys.stderr)
+
+    atexit.register(report)
+
+
+class SketchCommands:
+    """
+    HyperLogLog sketches of row groups for approximate distinct counts.
+
+    Sketches are built for the count_distinct columns of the query by its
+    group by and filter columns.
+
+    python parq-cli.py sketch build ~/ontime-100m.parquet \\
+        --group-by=Year --agg="count(*),count_distinct(Carrier)"
+    python parq-cli.py hll-sketch ~/ontime-100m.parquet \\
+        --group-by=Year --agg="count(*),count_distinct(Carrier)"
+    """
+
+    def __init__(self, commands):
+        self.commands = commands
+
+    def build(self, parquet_file: str, workers: int = 0):
+        """Build sketches for the query, scanning only new row groups."""
+        parquet_files = check_files(parquet_file)
+        parq_sketch = import_engine("parq_sketch")
+        spec = self.commands.spec()
+        check_query_columns(parquet_files, spec)
+        keys, columns = parq_sketch.spec_columns(spec)
+        if not columns:
+            sys.exit("The query has no count_distinct aggregates")
+        start = time.time()
+        scanned = reused = 0
+        for data_file in parquet_files:
+            file_scanned, file_reused = parq_sketch.build(
+                data_file, columns, keys, workers
+            )
+            scanned += file_scanned
+            reused += file_reused
+        elapsed = time.time() - start
+        print(
+            "Sketched {} row groups, reused {} in {:.4f}".format(
+                scanned, reused, elapsed
+            )
+        )
+
+    def list(self, parquet_file: str):
+        """List the sketches of files."""
+        _ = self  # disable lsp unused warning
+        parquet_files = check_files(parquet_file)
+        parq_sketch = import_engine("parq_sketch")
+        for data_file in parquet_files:
+            print_file_header(parquet_files, data_file)
+            path_key = parq_footer.fingerprint(data_file).split("-")[0]
+            paths = parq_sketch.CACHE_DIR.glob(f"{path_key}-*.sketch.arrow")
+            for path in paths:
+                sketch = parq_sketch.load(path)
+                if sketch is None:
+                    continue
+                sketch_info = parq_sketch.info(path, sketch)
+                print(
+                    "group by {} sketches {} ({:,} rows)".format(
+                        ",".join(sketch_info.keys) or "-",
+                        ",".join(sketch_info.columns),
+                        sketch.num_rows,
+                    )
+                )
+
+
+class IndexCommands:
+    """
+    Zone maps (min and max of slices of row groups) for point lookups.
+
+    Lookups prune whole row groups, pages are not skipped within a read
+    column chunk. Zone maps prune best when the file is sorted by the
+    column, see the optimize command.
+
+    python parq-cli.py index build ~/ontime-100m.parquet TailNum,FlightNum
+    python parq-cli.py lookup ~/ontime-100m.parquet TailNum N657AW
+    """
+
+    def build(
+        self,
+        parquet_file: str,
+        columns,
+        zone_rows: int = 128 * 1024,
+        workers: int = 0,
+    ):
+        """Build the zone maps of columns in one scan."""
+        _ = self  # disable lsp unused warning
+        parquet_files = check_files(parquet_file)
+        parq_index = import_engine("parq_index")
+        columns = parq_query.split_names(columns)
+        for data_file in parquet_files:
+            start = time.time()
+            try:
+                paths = parq_index.build(
+                    data_file, columns, zone_rows, workers
+                )
+            except ValueError as exc:
+                sys.exit(str(exc))
+            elapsed = time.time() - start
+            print(
+                "Indexed {} of {} in {:.4f} ({:,} bytes)".format(
+                    ",".join(columns),
+                    data_file,
+                    elapsed,
+                    sum(path.stat().st_size for path in paths),
+                )
+            )
+
+    def list(self, parquet_file: str):
+        """List the indexed columns of files."""
+        _ = self  # disable lsp unused warning
+        parquet_files = check_files(parquet_file)
+        parq_index = import_engine("parq_index")
+        for data_file in parquet_files:
+            print_file_header(parquet_files, data_file)
+            path_key = parq_footer.fingerprint(data_file).split("-")[0]
+            for path in parq_index.CACHE_DIR.glob(f"{path_key}-*.zonemap.*"):
+                column = path.name[len(path_key) + 1:].split(".")[0]
+                try:
+                    index = parq_index.load(data_file, column)
+                except parq_index.StaleIndex:
+                    print(f"{column} (stale)")
+                    continue
+                if index is not None:
+                    print(f"{column} ({index.num_rows:,} zones)")
 
 
 class Commands:
     """
     Query parquet files.
 
-    python parq-cli.py pandas ~/ontime-100m.parquet  # 62s
-    python parq-cli.py duck-pandas ~/ontime-100m.parquet  # 7s
-    python parq-cli.py duck-arrow ~/ontime-100m.parquet  # 8s
-    python parq-cli.py arrow-parquet ~/ontime-100m.parquet  # 5.7s
-    python parq-cli.py arrow-parquet-partitioned ~/ontime-100m.parquet  # 4.8s
-    python parq-cli.py arrow-parquet-feather ~/ontime-100m.parquet  # 4.3s
-    python parq-cli.py arrow-dataset-parquet ~/ontime-100m.parquet  # 4.4s
-    python parq-cli.py polars-parquet ~/ontime-100m.parquet  # 5s
+    python parq-cli.py bench ~/ontime-100m.parquet --engines=pandas,duck_arrow
+    python parq-cli.py bench ~/ontime-100m.parquet --output=bench.csv
+
+    The query run by the engines is a named query or a JSON file
+    ({"group_by": ..., "aggregates": ..., "where": ..., "columns": ...})
+    with optional group keys, aggregates and filters replacing its own.
+
+    python parq-cli.py duck-arrow ~/ontime-100m.parquet --query=origin_delay
+    python parq-cli.py polars-parquet ~/ontime-100m.parquet \\
+        --group-by=Year,Carrier --agg="count(*),max(DepDelay)" \\
+        --where="Year >= 2005 and Carrier = 'AA'"
+
+    Results are written without pandas by --output as csv, jsonl, parquet
+    or arrow (an IPC stream) to stdout or to a file with that suffix.
+
+    python parq-cli.py arrow-parquet ~/ontime-100m.parquet --output=csv
+    python parq-cli.py duck-arrow ~/ontime-100m.parquet --output=result.parquet
+
+    --profile prints the time of each phase (footer, read, decode,
+    aggregate, convert, render) to stderr. --profile=trace.json also writes
+    a Chrome trace and --sample=stacks.folded the stacks of a sampling
+    profiler for flamegraph.pl or speedscope.
+
+    python parq-cli.py arrow-parquet ~/ontime-100m.parquet \\
+        --profile=trace.json --sample=stacks.folded
     """
 
+    def __init__(
+        self,
+        query: str = parq_query.DEFAULT_QUERY,
+        group_by=None,
+        agg=None,
+        where: str = "",
+        output: str = "",
+        import_time: bool = False,
+        profile=False,
+        sample: str = "",
+    ):
+        self.query = query
+        self.group_by = group_by
+        self.agg = agg
+        self.where = where
+        self.output = output
+        self.sketch = SketchCommands(self)
+        self.index = IndexCommands()
+        if import_time:
+            atexit.register(print_import_times)
+        if profile or sample:
+            start_profile(profile, sample)
+
+    def spec(self) -> QuerySpec:
+        """Query spec from the command line options."""
+        return parq_query.build_spec(
+            self.query, self.group_by, self.agg, self.where
+        )
+
+    def run_engine(self, engine_name: str, parquet_file, **options):
+        """Run an engine with the query and output options."""
+        run_engine(
+            engine_name, parquet_file, self.spec(), self.output, **options
+        )
+
+    def query_sql(self):
+        """Print the query run by the engines as SQL."""
+        print(parq_query.describe(self.spec()))
+
     def metadata(self, parquet_file: str):
         """Get metadata."""
         _ = self  # disable lsp unused warning
-        check_file_exists(parquet_file)
-        pq_file = pq.ParquetFile(parquet_file)
-        metadata = pq_file.metadata
-        print(metadata)
+        parquet_files = check_files(parquet_file)
+        metadatas = read_metadatas(parquet_files)
+        for data_file, metadata in zip(parquet_files, metadatas):
+            print_file_header(parquet_files, data_file)
+            print(metadata)
 
     def schema(self, parquet_file: str):
         """Get column schema."""
         _ = self  # disable lsp unused warning
-        check_file_exists(parquet_file)
-        pq_file = pq.ParquetFile(parquet_file)
-        metadata = pq_file.metadata
-        print(metadata.schema)
+        parquet_files = check_files(parquet_file)
+        metadatas = read_metadatas(parquet_files)
+        for data_file, metadata in zip(parquet_files, metadatas):
+            print_file_header(parquet_files, data_file)
+            print(metadata.schema)
 
     def column_names(self, parquet_file: str):
-        """Get column names."""
+        """Get column names of all files."""
         _ = self  # disable lsp unused warning
-        check_file_exists(parquet_file)
-        pq_file = pq.ParquetFile(parquet_file)
-        metadata = pq_file.metadata
-        print("\n".join(metadata.schema.names))
+        parquet_files = check_files(parquet_file)
+        names = {}
+        for metadata in read_metadatas(parquet_files):
+            names.update(dict.fromkeys(metadata.schema.names))
+        print("\n".join(names))
 
     def column_info(self, parquet_file: str):
-        """Get column information."""
-        _ = self  # disable lsp unused warning
-        check_file_exists(parquet_file)
-        pq_file = pq.ParquetFile(parquet_file)
-        schema = pq_file.metadata.schema
+        """Get column information, one row per file and column."""
+        parquet_files = check_files(parquet_file)
 
         column_schema_list = []
-        for idx, _ in enumerate(schema.names):
-            # print('{}/{} {}'.format(
-            #     idx + 1, len(schema.names), str(schema.column(idx))))
-            column_schema_list.append(
-                column_schema_to_dict(schema.column(idx))
-            )
-
+        for data_file, metadata in zip(
+            parquet_files, read_metadatas(parquet_files)
+        ):
+            schema = metadata.schema
+            for idx, _ in enumerate(schema.names):
+                # print('{}/{} {}'.format(
+                #     idx + 1, len(schema.names), str(schema.column(idx))))
+                column_schema = column_schema_to_dict(schema.column(idx))
+                if len(parquet_files) > 1:
+                    column_schema["file"] = data_file
+                column_schema_list.append(column_schema)
+
+        if self.output:
+            tbl = pa.Table.from_pylist(column_schema_list)
+            parq_output.write_table(tbl, self.output)
+            return
+        pd = import_engine("pandas")
         df = pd.DataFrame.from_records(column_schema_list)
         print_tty_redir(df)
 
-    def column_stats_set(self, parquet_file: str, all: bool = False):
-        """Get number of row groups with column stats."""
+    def clickhouse_types(self, parquet_file: str):
+        """Get the narrowest clickhouse type of each column of all files."""
         _ = self  # disable lsp unused warning
-        check_file_exists(parquet_file)
-        pq_file = pq.ParquetFile(parquet_file)
-        metadata = pq_file.metadata
+        metadatas = read_metadatas(check_files(parquet_file))
+        for name, col_type in parq_clickhouse.clickhouse_types(metadatas):
+            print(f"{name:<24s}{col_type}")
 
-        head_row_groups = 5
-        total_row_groups = get_min_row_groups(
-            metadata.num_row_groups, head_row_groups, all
-        )
-
-        column_stats = [0] * metadata.num_columns
-        for row_idx in range(total_row_groups):
-            for col_idx in range(metadata.num_columns):
-                if metadata.row_group(row_idx).column(col_idx).is_stats_set:
-                    column_stats[col_idx] += 1
+    def column_stats_set(self, parquet_file: str, all: bool = False):
+        """
+        Get number of row groups with column stats of each file.
 
-        for count, column in zip(column_stats, metadata.schema.names):
-            print("{:10d}/{}\t{}".format(count, total_row_groups, column))
+        All row groups are counted, --all is accepted for old scripts.
+        """
+        _ = self  # disable lsp unused warning
+        warn_all_row_groups(all)
+        parquet_files = check_files(parquet_file)
+        footers = parq_files.map_files(parq_footer.read_footer, parquet_files)
+
+        for data_file, footer in zip(parquet_files, footers):
+            counts = footer.stats.group_by("column", use_threads=False)
+            counts = counts.aggregate([("is_stats_set", "sum")])
+            column_stats = dict(
+                zip(
+                    counts.column("column").to_pylist(),
+                    counts.column("is_stats_set_sum").to_pylist(),
+                )
+            )
+            total_row_groups = footer.metadata.num_row_groups
+            print_file_header(parquet_files, data_file)
+            for col_idx, column in enumerate(footer.metadata.schema.names):
+                print(
+                    "{:10d}/{}\t{}".format(
+                        column_stats.get(col_idx, 0), total_row_groups, column
+                    )
+                )
 
     def column_stats(
         self, parquet_file: str, column_name: str, all: bool = False
     ):
-        """Get column stats for a single column."""
-        _ = self  # disable lsp unused warning
-        check_file_exists(parquet_file)
-        metadata = check_column_exists(parquet_file, column_name)
-
-        head_row_groups = 5
-        total_row_groups = get_min_row_groups(
-            metadata.num_row_groups, head_row_groups, all
-        )
-
-        col_idx = metadata.schema.names.index(column_name)
-
-        stat_list = []
-        for row_idx in range(total_row_groups):
-            row_col_meta = metadata.row_group(row_idx).column(col_idx)
-            if row_col_meta.is_stats_set:
-                stat_list.append(row_col_meta.statistics.to_dict())
+        """
+        Get column stats of every row group for a single column.
 
-        df = pd.DataFrame.from_records(stat_list)
+        With several files the row groups of each file are listed. All row
+        groups are listed, --all is accepted for old scripts.
+        """
+        warn_all_row_groups(all)
+        parquet_files = check_files(parquet_file)
+        pc = import_engine("pyarrow.compute")
+
+        def file_stats(data_file):
+            check_column_exists(data_file, column_name)
+            stats = parq_footer.read_statistics(data_file)
+            mask = pc.equal(stats.column("name"), column_name)
+            return stats.filter(pc.and_(mask, stats.column("is_stats_set")))
+
+        tables = parq_files.map_files(file_stats, parquet_files)
+        stat_columns = [
+            "has_min_max",
+            "min",
+            "max",
+            "null_count",
+            "distinct_count",
+            "num_values",
+        ]
+        if len(parquet_files) > 1:
+            tables = [
+                tbl.append_column(
+                    "file", pa.array([data_file] * tbl.num_rows, pa.string())
+                )
+                for data_file, tbl in zip(parquet_files, tables)
+            ]
+            stat_columns = ["file", "row_group"] + stat_columns
+        stats = pa.concat_tables(tables)
+        if self.output:
+            parq_output.write_table(stats.select(stat_columns), self.output)
+            return
+        df = stats.select(stat_columns).to_pandas()
         print(df)
 
-    def polars_parquet(self, parquet_file: str):
-        """Use datafusion to process parquet files."""
-        _ = self
+    def column_summary(self, parquet_file: str):
+        """
+        Summarize the footer statistics of each column over all row groups.
 
-        check_file_exists(parquet_file)
+        Prints row groups without statistics, nulls, min, max, compressed
+        and uncompressed bytes, codecs and encodings of all files.
+        """
+        parquet_files = check_files(parquet_file)
+        footers = parq_files.map_files(parq_footer.read_footer, parquet_files)
+        stats = pa.concat_tables(footer.stats for footer in footers)
+        schema = footers[0].metadata.schema.to_arrow_schema()
+        summary = parq_stats.summarize(stats, schema)
+        if self.output:
+            parq_output.write_table(summary, self.output)
+            return
+        print_tty_redir(summary.to_pandas())
+
+    def lookup(
+        self, parquet_file: str, column_name: str, value, workers: int = 0
+    ):
+        """
+        Rows where a column equals a value using its zone maps.
 
+        Pruning is per row group: only the column of row groups with a
+        zone that may hold the value is read, and all columns only of row
+        groups with matches. Column chunks are read whole, no page is
+        skipped. The zone maps are built by index build.
+        """
+        parquet_files = check_files(parquet_file)
+        parq_index = import_engine("parq_index")
         start = time.time()
-        df = pl.scan_parquet(parquet_file)
-        result = df.groupby("Year").agg(
-            [
-                pl.count("Year").alias("Year_count"),
-                pl.col("Carrier").unique().count().alias("carrier_uniq_ct"),
-            ]
-        )
-        df_pandas = result.collect().to_pandas().sort_values(by='Year')
+        lookups = []
+        for data_file in parquet_files:
+            check_column_exists(data_file, column_name)
+            try:
+                index = parq_index.load(data_file, column_name)
+            except parq_index.StaleIndex as exc:
+                sys.exit(f"{exc}. Run index build")
+            if index is None:
+                sys.exit(
+                    f"No index of {column_name} for {data_file}. "
+                    "Run index build"
+                )
+            lookups.append(
+                parq_index.lookup(
+                    data_file, column_name, value, index, workers
+                )
+            )
         elapsed = time.time() - start
-        print(f"Elapsed {elapsed:.4f}")
-        print("result:\n", df_pandas)
-
-    def pandas(self, parquet_file: str):
-        """Query parquet file using pandas."""
-        _ = self  # disable lsp unused warning
-        check_file_exists(parquet_file)
 
-        start = time.time()
-        df = pd.read_parquet(parquet_file, engine='pyarrow')
-        df2 = df.groupby('Year').agg(
-            ct=('Year', np.size),
-            carrier_uniq_ct=('Carrier', lambda srs: np.unique(srs).size),
+        summary_file = sys.stderr if self.output else sys.stdout
+        print(
+            "Row groups read {}/{} for {}, {} for all columns, "
+            "{:,} of {:,} compressed bytes".format(
+                sum(found.candidate_row_groups for found in lookups),
+                sum(found.row_groups for found in lookups),
+                column_name,
+                sum(found.matched_row_groups for found in lookups),
+                sum(found.bytes_read for found in lookups),
+                sum(found.file_bytes for found in lookups),
+            ),
+            file=summary_file,
         )
-        elapsed = time.time() - start
-        print(f"Elapsed {elapsed:.4f}")
-        print(df2)
+        print(f"Elapsed {elapsed:.4f}", file=summary_file)
+        result = concat_tables(found.result for found in lookups)
+        if self.output:
+            parq_output.write_table(result, self.output)
+            return
+        print_tty_redir(result.to_pandas())
+
+    def optimize(
+        self,
+        parquet_file: str,
+        target: str = "",
+        sort_by="",
+        row_group_rows: int = 1024 * 1024,
+        page_kb: int = 1024,
+        dictionary="auto",
+        codec: str = "zstd",
+        page_index: bool = True,
+        bloom_filters="",
+        engines="arrow_parquet,arrow_row_groups,duck_pandas",
+        runs: int = 3,
+    ):
+        """
+        Rewrite files in a layout for faster scans and time engines on both.
+
+        The rewrite is sorted by sort_by, has row groups of row_group_rows
+        and pages of page_kb, dictionary encodes the dictionary columns
+        (auto, all, none or a list) and compresses with codec, a default
+        codec with column overrides like zstd,TailNum=snappy. A page index
+        and bloom filters for the bloom_filters columns can be added. The
+        rewrite of each file goes to target (a directory with several files)
+        or below ~/.parq-cli/optimized, outside the input directories. The
+        query options are timed with the engines before and after.
+
+        python parq-cli.py optimize ~/ontime-100m.parquet \\
+            --sort-by=Year,Carrier --row-group-rows=250000 \\
+            --codec=zstd,DepDelay=lz4 --where="Year = 2005"
+        """
+        parquet_files = check_files(parquet_file)
+        spec = self.spec()
+        check_query_columns(parquet_files, spec)
+        parq_optimize = import_engine("parq_optimize")
+
+        targets = []
+        target_paths = parq_optimize.target_paths(parquet_files, target)
+        for data_file, target_path in zip(parquet_files, target_paths):
+            target_path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                rewritten = parq_optimize.rewrite(
+                    data_file,
+                    str(target_path),
+                    sort_by=sort_by,
+                    row_group_rows=row_group_rows,
+                    page_bytes=page_kb * 1024,
+                    dictionary=dictionary,
+                    codec=codec,
+                    page_index=page_index,
+                    bloom_filters=bloom_filters,
+                )
+            except (ValueError, OSError, pa.ArrowException) as exc:
+                sys.exit(f"Cannot rewrite {data_file}: {exc}")
+            print(
+                "Rewrote {} to {} in {:.4f} ({:,} to {:,} bytes)".format(
+                    data_file,
+                    target_path,
+                    rewritten.elapsed,
+                    rewritten.source_bytes,
+                    rewritten.target_bytes,
+                )
+            )
+            for label, path in [("before", data_file), ("after", target_path)]:
+                metadata = pq.read_metadata(path)
+                print(f"  {label:<8s}{parq_optimize.describe(metadata)}")
+            targets.append(str(target_path))
+
+        timings = []
+        for engine_name in get_engine_names(engines):
+            medians = []
+            for files in [parquet_files, targets]:
+                # engine setup output would break up the table
+                with contextlib.redirect_stdout(sys.stderr):
+                    query = setup_engine(engine_name, files, spec)
+                    if query is None:
+                        break
+                    try:
+                        run_times = parq_bench.time_runs(query, runs, warmup=1)
+                    except Exception as exc:
+                        engine_error(engine_name, exc)
+                        break
+                medians.append(parq_bench.summarize("", run_times).median)
+            else:
+                timings.append((engine_name, *medians))
+
+        print(f"{'engine':<28s}{'before':>10s}{'after':>10s}{'speedup':>10s}")
+        for engine_name, before, after in timings:
+            print(
+                "{:<28s}{:>10.4f}{:>10.4f}{:>9.2f}x".format(
+                    engine_name, before, after, before / after
+                )
+            )
 
-    def duck_pandas(self, parquet_file: str):
-        """Query parquet file using duckdb and pandas."""
-        _ = self  # disable lsp unused warning
-        check_file_exists(parquet_file)
-        con = duckdb.connect(database=":memory:", read_only=False)
+    def import_times(self, engines=",".join(ENGINES)):
+        """
+        Time the imports of each engine in a new interpreter.
 
-        sql = """
-            select Year, count(*) ct, count(distinct Carrier) carrier_uniq_ct
-            from parquet_scan('{}')
-            group by Year
+        The engine times include the modules imported by every command.
         """
-        sql_query = sql.format(f"{parquet_file}")
+        _ = self  # disable lsp unused warning
+        core = cold_import_time(CORE_MODULES)
+        print(f"{'core':<28s}{core:.4f}")
+        for engine_name in get_engine_names(engines):
+            module_names = CORE_MODULES + ENGINE_MODULES[engine_name]
+            try:
+                elapsed = f"{cold_import_time(module_names):.4f}"
+            except CalledProcessError:
+                elapsed = "not installed"
+            print(f"{engine_name:<28s}{elapsed}")
+
+    def derived_copies(self):
+        """List cached copies of parquet files, least recently used first."""
+        _ = self  # disable lsp unused warning
+        cached = parq_derived.entries()
+        for entry in cached:
+            last_used = time.strftime(
+                "%Y-%m-%d %H:%M:%S", time.localtime(entry.last_used)
+            )
+            print(f"{entry.size:>14,d}  {last_used}  {entry.path.name}")
+        total = sum(entry.size for entry in cached)
+        print(
+            "{:>14,d}  total of {} MB budget".format(
+                total, parq_derived.DISK_BUDGET_MB
+            )
+        )
 
-        start = time.time()
-        df = con.execute(sql_query).fetchdf()
-        elapsed = time.time() - start
-        print(f"Elapsed {elapsed:.4f}")
-        print(df)
+    def clear_derived_copies(self):
+        """Remove the cached copies of all files."""
+        _ = self  # disable lsp unused warning
+        parq_derived.clear()
 
-    def duck_arrow(self, parquet_file):
-        """Query parquet file using duckdb and arrow."""
+    def clear_footer_cache(self):
+        """Remove the cached footers and statistics of all files."""
         _ = self  # disable lsp unused warning
-        check_file_exists(parquet_file)
+        parq_footer.clear()
+
+    def bench(
+        self,
+        parquet_file: str,
+        engines=DEFAULT_ENGINES,
+        runs: int = 5,
+        warmup: int = 1,
+    ):
+        """
+        Time engines over repeated runs after warmup runs.
 
-        ontime = ds.dataset(parquet_file)
-        ontime_db = duckdb.arrow(ontime)
+        --output writes the timings to a .json or .csv file, or to stdout
+        as csv or json with everything else printed to stderr.
 
-        start = time.time()
-        df = ontime_db.aggregate(
-            """
-            Year,
-            count(*) as ct,
-            count(distinct Carrier) as carrier_uniq_ct
-        """,
-            "Year",
-        ).df()
-        elapsed = time.time() - start
-        print(f"Elapsed {elapsed:.4f}")
-        print(df)
+        python parq-cli.py bench ~/ontime-100m.parquet \\
+            --engines=duck_pandas,arrow_parquet --runs=10 --output=bench.json
+        """
+        parquet_files = check_files(parquet_file)
+        if runs < 1 or warmup < 0:
+            sys.exit("runs should be at least 1 and warmup at least 0")
+        to_stdout = False
+        if self.output:
+            to_stdout = parq_bench.output_format(self.output)[1] is None
+
+        spec = self.spec()
+        check_query_columns(parquet_files, spec)
+        stats_list = []
+        messages = sys.stderr if to_stdout else sys.stdout
+        with contextlib.redirect_stdout(messages):
+            for engine_name in get_engine_names(engines):
+                log.info("benchmarking %s", engine_name)
+                query = setup_engine(engine_name, parquet_files, spec)
+                if query is None:
+                    continue
+                try:
+                    timings = parq_bench.time_runs(query, runs, warmup)
+                except Exception as exc:
+                    # the other engines still run
+                    engine_error(engine_name, exc)
+                    continue
+                stats_list.append(parq_bench.summarize(engine_name, timings))
+            parq_bench.print_stats(stats_list)
+
+        if self.output:
+            env = parq_bench.environment(parquet_files)
+            env["warmup"] = warmup
+            parq_bench.write_results(self.output, env, stats_list)
+
+    def verify(
+        self,
+        parquet_file: str,
+        engines=DEFAULT_ENGINES,
+        reference: str = "duck_pandas",
+        rtol: float = 1e-9,
+        approx_rtol: float = 0.05,
+    ):
+        """
+        Check that engines return the same result as a reference engine.
 
-    def ch_local(self, parquet_file: str):
-        """Query parquet file using clickhouse-local."""
-        _ = self  # disable lsp unused warning
-        check_file_exists(parquet_file)
-
-        executable_name = "clickhouse-local"
-        check_executable(executable_name)
-        ch_types_str = get_clickhouse_types(parquet_file)
-        print(ch_types_str)
-
-        sql = """
-            select Year, count(*) ct, count(distinct Carrier) carrier_uniq_ct
-            from file(
-                '{}', Parquet,
-                '{}'
-            )
-            group by Year
-        """.format(
-            parquet_file, ch_types_str
+        Approximate aggregates (datafusion count_distinct) are compared
+        with approx_rtol and all other numbers with rtol.
+
+        python parq-cli.py verify ~/ontime-100m.parquet \\
+            --engines=polars_parquet,datafusion_parquet --reference=duck_arrow
+        """
+        parquet_files = check_files(parquet_file)
+        parq_verify = import_engine("parq_verify")
+        spec = self.spec()
+        check_query_columns(parquet_files, spec)
+        reference = get_engine_names(reference)[0]
+
+        log.info("running %s", reference)
+        expected = parq_verify.normalize(
+            ENGINES[reference](parquet_files, spec)(), spec
         )
+        mismatches_by_engine = {}
+        failures = {}
+        for engine_name in get_engine_names(engines):
+            if engine_name == reference:
+                continue
+            log.info("running %s", engine_name)
+            query = setup_engine(engine_name, parquet_files, spec)
+            if query is None:
+                continue
+            try:
+                actual = parq_verify.normalize(query(), spec)
+            except Exception as exc:
+                # the other engines still run
+                failures[engine_name] = engine_error(engine_name, exc)
+                continue
+            approx_columns = parq_verify.approx_columns(
+                spec, APPROX_AGGS.get(engine_name, set())
+            )
+            mismatches_by_engine[engine_name] = parq_verify.compare(
+                expected,
+                actual,
+                rtol=rtol,
+                approx_columns=approx_columns,
+                approx_rtol=approx_rtol,
+            )
 
-        clickhouse_query = sql.replace("\n", " ")
+        parq_verify.print_report(reference, mismatches_by_engine, failures)
+        if any(mismatches_by_engine.values()):
+            sys.exit("Results do not match")
+        if failures:
+            sys.exit("Engines failed: " + ", ".join(failures))
 
-        start = time.time()
-        output = check_output(
-            [executable_name, "--query", clickhouse_query], shell=False
-        )
-        elapsed = time.time() - start
-        print(f"Elapsed {elapsed:.4f}")
-        print(output.decode("utf-8").strip())
+    def polars_parquet(self, parquet_file: str):
+        """Use polars to process parquet files."""
+        self.run_engine("polars_parquet", parquet_file)
 
-    def arrow_parquet(self, parquet_file: str):
-        """Use arrow to read parquet files."""
-        _ = self  # disable lsp unused warning
-        check_file_exists(parquet_file)
+    def pandas(self, parquet_file: str):
+        """Query parquet file using pandas."""
+        self.run_engine("pandas", parquet_file)
 
-        local = pa.fs.LocalFileSystem()
+    def duck_pandas(self, parquet_file: str):
+        """Query parquet file using duckdb and pandas."""
+        self.run_engine("duck_pandas", parquet_file)
 
-        start = time.time()
-        tbl = pq.read_table(parquet_file, filesystem=local)
+    def duck_arrow(self, parquet_file):
+        """Query parquet file using duckdb and arrow."""
+        self.run_engine("duck_arrow", parquet_file)
 
-        result = tbl.group_by("Year").aggregate(
-            [("Year", "count"), ("Carrier", "count_distinct")]
-        )
-        elapsed = time.time() - start
-        print(f"Elapsed {elapsed:.4f}")
-        print(result.to_pandas())
+    def ch_local(self, parquet_file: str, workers: int = 1):
+        """
+        Query parquet file using clickhouse-local.
 
-    def arrow_parquet_partitioned(self, parquet_file: str):
+        Queries run on long running clickhouse-local processes and the
+        startup time of the processes is reported separately.
+        """
+        self.run_engine("ch_local", parquet_file, workers=workers)
+
+    def arrow_parquet(self, parquet_file: str):
         """Use arrow to read parquet files."""
-        _ = self  # disable lsp unused warning
-        check_file_exists(parquet_file)
+        self.run_engine("arrow_parquet", parquet_file)
 
-        partition_cols = ["Year"]
-        home_pq_path = write_parquet_partitioned(parquet_file, partition_cols)
+    def arrow_parquet_partitioned(
+        self, parquet_file: str, partition_by="Year", codec: str = "lz4"
+    ):
+        """
+        Use arrow to read a partitioned copy of parquet files.
 
-        start = time.time()
-        local = pa.fs.LocalFileSystem()
-        tbl = pq.read_table(home_pq_path, filesystem=local)
-        result = tbl.group_by("Year").aggregate(
-            [("Year", "count"), ("Carrier", "count_distinct")]
+        The copy is converted once and cached until the file changes.
+        """
+        self.run_engine(
+            "arrow_parquet_partitioned",
+            parquet_file,
+            partition_by=partition_by,
+            codec=codec,
         )
-        elapsed = time.time() - start
-        print(f"Elapsed {elapsed:.4f}")
-        print(result.to_pandas())
 
-    def arrow_parquet_feather(self, parquet_file: str):
-        """Use arrow to read parquet files."""
-        _ = self  # disable lsp unused warning
-        check_file_exists(parquet_file)
+    def arrow_parquet_feather(self, parquet_file: str, codec: str = "lz4"):
+        """
+        Use arrow to read a feather copy of parquet files.
 
-        home_feather = write_feather_file(parquet_file)
+        The copy is converted once and cached until the file changes.
+        """
+        self.run_engine("arrow_parquet_feather", parquet_file, codec=codec)
 
-        start = time.time()
-        tbl = pa.feather.read_table(home_feather, columns=["Year", "Carrier"])
-        result = tbl.group_by("Year").aggregate(
-            [("Year", "count"), ("Carrier", "count_distinct")]
-        )
-        elapsed = time.time() - start
-        print(f"Elapsed {elapsed:.4f}")
-        print(result.to_pandas())
+    def arrow_ipc_mmap(self, parquet_file: str):
+        """
+        Use arrow to query a memory mapped uncompressed arrow IPC copy.
+
+        The copy is converted once and cached until the file changes.
+        """
+        self.run_engine("arrow_ipc_mmap", parquet_file)
 
     def arrow_dataset_parquet(self, parquet_file: str):
-        """Use arrow to read parquet files."""
-        _ = self  # disable lsp unused warning
-        check_file_exists(parquet_file)
+        """Use arrow datasets to read parquet files."""
+        self.run_engine("arrow_dataset_parquet", parquet_file)
 
-        start = time.time()
-        tbl = ds.dataset(parquet_file, format="parquet").to_table(
-            columns=["Year", "Carrier"]
-        )
-        result = tbl.group_by("Year").aggregate(
-            [("Year", "count"), ("Carrier", "count_distinct")]
+    def arrow_row_groups(
+        self, parquet_file: str, workers: int = 0, stats: bool = True
+    ):
+        """
+        Use arrow to aggregate row groups in parallel (0 for all cores).
+
+        Use --nostats to scan row groups that statistics could answer.
+
+        python parq-cli.py arrow-row-groups ~/ontime-100m.parquet \\
+            --group-by=Year --agg="count(*),min(DepDelay),null_count(TailNum)"
+        """
+        self.run_engine(
+            "arrow_row_groups",
+            parquet_file,
+            workers=workers,
+            stats=stats,
         )
-        elapsed = time.time() - start
-        print(f"Elapsed {elapsed:.4f}")
-        print(result.to_pandas())
 
-    def datafusion_parquet(self, parquet_file: str):
-        """Use datafusion to process parquet files."""
-        _ = self
+    def arrow_stream(
+        self,
+        parquet_file: str,
+        memory_mb: int = 256,
+        batch_size: int = 0,
+        stats: bool = True,
+    ):
+        """
+        Use arrow to aggregate record batches within a memory budget.
 
-        check_file_exists(parquet_file)
-        ctx = datafusion.ExecutionContext()
-        ctx.register_parquet("t", parquet_file)
+        The batch size is derived from the budget unless given. Prints the
+        peak resident memory of the process.
 
-        df = ctx.table("t")
-        start = time.time()
-        batches = df.aggregate(
-            [col("Year")],
-            [
-                f.count(col("Year")).alias("Year_ct"),
-                f.approx_distinct(col("Carrier")).alias("approx_dist"),
-            ],
+        python parq-cli.py arrow-stream ~/ontime-100m.parquet \\
+            --memory-mb=64 --group-by=Origin --agg="avg(DepDelay)"
+        """
+        import resource
+
+        self.run_engine(
+            "arrow_stream",
+            parquet_file,
+            memory_mb=memory_mb,
+            batch_size=batch_size,
+            stats=stats,
         )
-        result = pa.Table.from_batches(batches.collect())
-        elapsed = time.time() - start
-        print(f"Elapsed {elapsed:.4f}")
-        print("result:", result.to_pandas())
+        # kilobytes on linux
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # the result may have been written to stdout
+        messages = sys.stderr if self.output else sys.stdout
+        print(f"Peak RSS {peak_rss / 1024:.1f} MB", file=messages)
+
+    def hll_sketch(self, parquet_file: str):
+        """Answer approximate distinct counts from HyperLogLog sketches."""
+        self.run_engine("hll_sketch", parquet_file)
+
+    def datafusion_parquet(self, parquet_file: str):
+        """Use datafusion to process parquet files."""
+        self.run_engine("datafusion_parquet", parquet_file)
 
 
 def main():
     """Main function."""
-    fire.Fire(Commands())
+    fire.Fire(Commands)
     # fire.Fire({'arrow-compute-example': arrow_compute_example})
 
 
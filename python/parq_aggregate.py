@@ -0,0 +1,598 @@
+"""
+Partial aggregation of query specs with arrow compute.
+
+Chunks of a file (row groups, record batches, files) are aggregated to
+partial tables which are merged and finalized into the query result. A
+partial table has the group keys, one or two partial columns per aggregate
+(_p0, _p1, _p1_count for avg, ...) and the distinct values of count_distinct
+aggregates (_d2, ...) as extra rows where the other partial columns are
+null. Merging is a group by on the keys and distinct value columns so the
+distinct values of all chunks are deduplicated without keeping sets.
+"""
+import collections
+import concurrent.futures
+import logging
+import os
+
+from typing import Callable, Iterable, List, NamedTuple, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import parq_footer
+import parq_profile
+import parq_stats
+
+from parq_query import QuerySpec, arrow_expression
+
+log = logging.getLogger(__name__)
+
+MERGE_FUNCS = {
+    "count": "sum",
+    "null_count": "sum",
+    "sum": "sum",
+    "min": "min",
+    "max": "max",
+}
+
+# aggregates that can be answered from row group statistics
+STATS_FUNCS = ["count", "null_count", "min", "max"]
+
+
+def partial_names(spec: QuerySpec):
+    """Partial column names with their merge function."""
+    names = []
+    for idx, agg in enumerate(spec.aggregates):
+        if agg.func == "avg":
+            names.append((f"_p{idx}", "sum"))
+            names.append((f"_p{idx}_count", "sum"))
+        elif agg.func != "count_distinct":
+            names.append((f"_p{idx}", MERGE_FUNCS[agg.func]))
+    return names
+
+
+def distinct_names(spec: QuerySpec) -> List[str]:
+    """Columns holding distinct values of count_distinct aggregates."""
+    return [
+        f"_d{idx}"
+        for idx, agg in enumerate(spec.aggregates)
+        if agg.func == "count_distinct"
+    ]
+
+
+def align(tbl: pa.Table, fields: List[pa.Field]) -> pa.Table:
+    """Table with the fields in order adding null columns where missing."""
+    columns = []
+    for field in fields:
+        if field.name in tbl.column_names:
+            columns.append(tbl.column(field.name))
+        else:
+            columns.append(pa.nulls(tbl.num_rows, field.type))
+    return pa.table(columns, schema=pa.schema(fields))
+
+
+@parq_profile.phase("aggregate")
+def partial_aggregate(spec: QuerySpec, tbl: pa.Table) -> pa.Table:
+    """Filter a chunk and aggregate it to a partial table."""
+    expr = arrow_expression(spec.filters)
+    if expr is not None:
+        tbl = tbl.filter(expr)
+    keys = list(spec.group_by)
+
+    # aggregations are shared, e.g. count(DepDelay) and avg(DepDelay)
+    aggregations = {}
+    partial_outputs = {}
+
+    def add(partial_name, target, func):
+        if target is None:
+            aggregations[("count_all",)] = ([], "count_all")
+            partial_outputs[partial_name] = "count_all"
+            return
+        options = None
+        if func == "count":
+            options = pc.CountOptions(mode="only_valid")
+        aggregations[(target, func)] = (target, func, options)
+        partial_outputs[partial_name] = f"{target}_{func}"
+
+    for idx, agg in enumerate(spec.aggregates):
+        if agg.column == "*":
+            add(f"_p{idx}", None, "count_all")
+        elif agg.func == "avg":
+            add(f"_p{idx}", agg.column, "sum")
+            add(f"_p{idx}_count", agg.column, "count")
+        elif agg.func == "null_count":
+            add(f"_p{idx}_all", None, "count_all")
+            add(f"_p{idx}", agg.column, "count")
+        elif agg.func != "count_distinct":
+            add(f"_p{idx}", agg.column, agg.func)
+
+    grouped = tbl.group_by(keys).aggregate(list(aggregations.values()))
+    columns = {key: grouped.column(key) for key in keys}
+    for name, output in partial_outputs.items():
+        columns[name] = grouped.column(output)
+    for idx, agg in enumerate(spec.aggregates):
+        if agg.func == "null_count":
+            all_rows = columns.pop(f"_p{idx}_all")
+            columns[f"_p{idx}"] = pc.subtract(all_rows, columns[f"_p{idx}"])
+    main = pa.table(list(columns.values()), names=list(columns))
+
+    fields = [tbl.schema.field(key) for key in keys]
+    fields += [main.schema.field(name) for name, _ in partial_names(spec)]
+    pieces = [main]
+    for idx, agg in enumerate(spec.aggregates):
+        if agg.func != "count_distinct":
+            continue
+        distinct_name = f"_d{idx}"
+        values = pa.table(
+            [tbl.column(key) for key in keys] + [tbl.column(agg.column)],
+            names=keys + [distinct_name],
+        )
+        pieces.append(values.group_by(keys + [distinct_name]).aggregate([]))
+        value_type = tbl.schema.field(agg.column).type
+        fields.append(pa.field(distinct_name, value_type))
+
+    return pa.concat_tables([align(piece, fields) for piece in pieces])
+
+
+@parq_profile.phase("aggregate")
+def merge_partials(spec: QuerySpec, partials: List[pa.Table]) -> pa.Table:
+    """Merge partial tables into a single partial table."""
+    tbl = pa.concat_tables(partials)
+    keys = list(spec.group_by) + distinct_names(spec)
+    names = partial_names(spec)
+    merged = tbl.group_by(keys).aggregate(
+        [(name, func) for name, func in names]
+    )
+    columns = [merged.column(key) for key in keys]
+    columns += [merged.column(f"{name}_{func}") for name, func in names]
+    merged = pa.table(columns, names=keys + [name for name, _ in names])
+    return merged.select(tbl.column_names)
+
+
+@parq_profile.phase("aggregate")
+def finalize(spec: QuerySpec, partial: pa.Table) -> pa.Table:
+    """Query result from a partial table."""
+    keys = list(spec.group_by)
+    aggregations = []
+    for idx, agg in enumerate(spec.aggregates):
+        if agg.func == "count_distinct":
+            options = pc.CountOptions(mode="only_valid")
+            aggregations.append((f"_d{idx}", "count_distinct", options))
+        elif agg.func == "avg":
+            aggregations.append((f"_p{idx}", "sum"))
+            aggregations.append((f"_p{idx}_count", "sum"))
+        else:
+            aggregations.append((f"_p{idx}", MERGE_FUNCS[agg.func]))
+    grouped = partial.group_by(keys).aggregate(aggregations)
+
+    columns = [grouped.column(key) for key in keys]
+    for idx, agg in enumerate(spec.aggregates):
+        if agg.func == "count_distinct":
+            columns.append(grouped.column(f"_d{idx}_count_distinct"))
+        elif agg.func == "avg":
+            total = grouped.column(f"_p{idx}_sum").cast(pa.float64())
+            count = grouped.column(f"_p{idx}_count_sum")
+            columns.append(pc.divide(total, count))
+        elif agg.func in ("count", "null_count"):
+            columns.append(pc.fill_null(grouped.column(f"_p{idx}_sum"), 0))
+        else:
+            func = MERGE_FUNCS[agg.func]
+            columns.append(grouped.column(f"_p{idx}_{func}"))
+    return pa.table(columns, names=spec.output_columns())
+
+
+class ScanPlan(NamedTuple):
+    skipped: List[int]
+    from_stats: List[int]
+    scanned: List[int]
+
+
+def stats_answerable(spec: QuerySpec) -> bool:
+    """Whether all aggregates can be answered from statistics."""
+    return bool(spec.aggregates) and all(
+        agg.func in STATS_FUNCS for agg in spec.aggregates
+    )
+
+
+def row_group_stats_partial(
+    metadata, spec: QuerySpec, row_group: int
+) -> Optional[dict]:
+    """
+    Partial row of a row group from statistics.
+
+    Returns None when the statistics are missing or inconclusive, e.g. when
+    a group key has more than one value in the row group.
+    """
+    names = metadata.schema.names
+    num_rows = metadata.row_group(row_group).num_rows
+
+    def stats_of(column):
+        col_stats = parq_stats.column_stats(
+            metadata, row_group, names.index(column)
+        )
+        if col_stats is None or col_stats.null_count is None:
+            return None
+        return col_stats
+
+    row = {}
+    for key in spec.group_by:
+        key_stats = stats_of(key)
+        if key_stats is None:
+            return None
+        if key_stats.null_count == num_rows:
+            row[key] = None
+        elif (
+            key_stats.null_count == 0
+            and key_stats.min is not None
+            and key_stats.min == key_stats.max
+        ):
+            row[key] = key_stats.min
+        else:
+            return None
+
+    for idx, agg in enumerate(spec.aggregates):
+        if agg.column == "*":
+            row[f"_p{idx}"] = num_rows
+            continue
+        agg_stats = stats_of(agg.column)
+        if agg_stats is None:
+            return None
+        if agg.func == "count":
+            row[f"_p{idx}"] = num_rows - agg_stats.null_count
+        elif agg.func == "null_count":
+            row[f"_p{idx}"] = agg_stats.null_count
+        elif agg_stats.null_count == num_rows:
+            row[f"_p{idx}"] = None
+        elif agg_stats.min is None:
+            return None
+        else:
+            row[f"_p{idx}"] = getattr(agg_stats, agg.func)
+    return row
+
+
+def plan_row_groups(metadata, spec: QuerySpec, use_stats: bool = True):
+    """
+    Split row groups into skipped, answered from statistics and scanned.
+
+    Row groups are answered from statistics when all their rows match the
+    filters and the aggregates are counts, null counts, min or max.
+    """
+    matches = parq_stats.row_group_matches(metadata, spec.filters)
+    use_stats = use_stats and stats_answerable(spec)
+    plan = ScanPlan([], [], [])
+    for row_group, match in enumerate(matches):
+        if match == parq_stats.NONE:
+            plan.skipped.append(row_group)
+        elif (
+            use_stats
+            and match == parq_stats.ALL
+            and row_group_stats_partial(metadata, spec, row_group)
+            is not None
+        ):
+            plan.from_stats.append(row_group)
+        else:
+            plan.scanned.append(row_group)
+    return plan
+
+
+def stats_partial(
+    metadata, spec: QuerySpec, row_groups: Iterable[int]
+) -> pa.Table:
+    """Partial table of row groups answered from statistics."""
+    schema = metadata.schema.to_arrow_schema()
+    fields = [schema.field(key) for key in spec.group_by]
+    for idx, agg in enumerate(spec.aggregates):
+        if agg.func in ("min", "max"):
+            value_type = schema.field(agg.column).type
+        else:
+            value_type = pa.int64()
+        fields.append(pa.field(f"_p{idx}", value_type))
+    rows = [
+        row_group_stats_partial(metadata, spec, row_group)
+        for row_group in row_groups
+    ]
+    return pa.Table.from_pylist(rows, schema=pa.schema(fields))
+
+
+def fold(
+    spec: QuerySpec,
+    chunks: Iterable[pa.Table],
+    merge_every: int = 8,
+    max_bytes: int = 0,
+) -> Optional[pa.Table]:
+    """
+    Merge partial tables as they arrive.
+
+    Pending partials are merged when there are merge_every of them or when
+    they hold more than max_bytes (0 disables either limit).
+    """
+    pending = []
+    pending_bytes = 0
+    warned = False
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_bytes += chunk.nbytes
+        if (merge_every and len(pending) >= merge_every) or (
+            max_bytes and pending_bytes > max_bytes
+        ):
+            merged = merge_partials(spec, pending)
+            pending = [merged]
+            pending_bytes = merged.nbytes
+            if max_bytes and pending_bytes > max_bytes and not warned:
+                log.warning(
+                    "groups need %d bytes, more than the %d byte budget",
+                    pending_bytes,
+                    max_bytes,
+                )
+                warned = True
+    if not pending:
+        return None
+    return merge_partials(spec, pending)
+
+
+def read_row_group(
+    parquet_file: str, metadata, row_group: int, columns: List[str]
+) -> pa.Table:
+    """Read columns of a row group reusing already parsed metadata."""
+    with parq_profile.span("decode"):
+        pq_file = pq.ParquetFile(
+            parq_profile.input_file(parquet_file), metadata=metadata
+        )
+        return pq_file.read_row_group(
+            row_group, columns=columns, use_threads=False
+        )
+
+
+class FileRowGroup(NamedTuple):
+    parquet_file: str
+    metadata: object
+    row_group: int
+
+
+def map_file_row_groups(
+    func: Callable[[pa.Table], pa.Table],
+    columns: List[str],
+    row_groups: Iterable[FileRowGroup],
+    workers: int = 0,
+):
+    """
+    Apply func to row groups of one or more files read in a thread pool.
+
+    Results are yielded in row group order. At most workers row groups are
+    submitted ahead of the one yielded next, so memory is bounded by the
+    number of workers rather than the number of row groups.
+    """
+    workers = workers or os.cpu_count() or 1
+
+    def task(file_row_group):
+        tbl = read_row_group(*file_row_group, columns)
+        return func(tbl)
+
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        try:
+            for file_row_group in row_groups:
+                pending.append(executor.submit(task, file_row_group))
+                if len(pending) >= workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def map_row_groups(
+    parquet_file: str,
+    func: Callable[[pa.Table], pa.Table],
+    columns: List[str],
+    row_groups: Optional[Iterable[int]] = None,
+    workers: int = 0,
+    metadata=None,
+):
+    """Apply func to row groups of a file read in a thread pool."""
+    if metadata is None:
+        metadata = parq_footer.read_metadata(parquet_file)
+    if row_groups is None:
+        row_groups = range(metadata.num_row_groups)
+    file_row_groups = [
+        FileRowGroup(parquet_file, metadata, row_group)
+        for row_group in row_groups
+    ]
+    yield from map_file_row_groups(func, columns, file_row_groups, workers)
+
+
+def finish(
+    schema: pa.Schema,
+    spec: QuerySpec,
+    partial: Optional[pa.Table],
+    stats_partials: Iterable[pa.Table] = (),
+) -> pa.Table:
+    """Query result of a partial table and partials from statistics."""
+    if partial is None:
+        partial = partial_aggregate(spec, schema.empty_table())
+    stats_partials = [
+        from_stats.cast(partial.schema) for from_stats in stats_partials
+    ]
+    if stats_partials:
+        partial = merge_partials(spec, [partial] + stats_partials)
+    return finalize(spec, partial)
+
+
+def select_rows(
+    schema: pa.Schema, spec: QuerySpec, tables: Iterable[pa.Table]
+) -> pa.Table:
+    """Filtered rows of the spec columns of tables."""
+    expr = arrow_expression(spec.filters)
+    tables = [tbl if expr is None else tbl.filter(expr) for tbl in tables]
+    if not tables:
+        tables = [schema.empty_table()]
+    return pa.concat_tables(tables).select(spec.columns)
+
+
+def scan_files(
+    files: List[str],
+    spec: QuerySpec,
+    metadatas: List,
+    plans: List[ScanPlan],
+    workers: int = 0,
+) -> pa.Table:
+    """
+    Query result of the row groups of files scanned in parallel.
+
+    The scanned row groups of all files share one thread pool and the
+    from_stats row groups of the plans are answered from statistics.
+    """
+    schema = metadatas[0].schema.to_arrow_schema()
+    row_groups = [
+        FileRowGroup(parquet_file, metadata, row_group)
+        for parquet_file, metadata, plan in zip(files, metadatas, plans)
+        for row_group in plan.scanned
+    ]
+    columns = spec.input_columns()
+    if not spec.aggregates:
+        tables = map_file_row_groups(
+            lambda tbl: tbl, columns, row_groups, workers
+        )
+        return select_rows(schema, spec, tables)
+
+    partials = map_file_row_groups(
+        lambda tbl: partial_aggregate(spec, tbl), columns, row_groups, workers
+    )
+    merge_every = 2 * (workers or os.cpu_count() or 1)
+    partial = fold(spec, partials, merge_every)
+    stats_partials = [
+        stats_partial(metadata, spec, plan.from_stats)
+        for metadata, plan in zip(metadatas, plans)
+        if plan.from_stats
+    ]
+    return finish(schema, spec, partial, stats_partials)
+
+
+def scan_row_groups(
+    parquet_file: str,
+    spec: QuerySpec,
+    row_groups: Optional[Iterable[int]] = None,
+    workers: int = 0,
+    metadata=None,
+    stats_row_groups: Iterable[int] = (),
+) -> pa.Table:
+    """
+    Query result of row groups scanned in parallel.
+
+    stats_row_groups are answered from statistics without being read.
+    """
+    if metadata is None:
+        metadata = parq_footer.read_metadata(parquet_file)
+    if row_groups is None:
+        row_groups = range(metadata.num_row_groups)
+    plan = ScanPlan([], list(stats_row_groups), list(row_groups))
+    return scan_files([parquet_file], spec, [metadata], [plan], workers)
+
+
+def stream_batch_size(
+    metadata, columns: List[str], memory_budget: int
+) -> int:
+    """
+    Rows per record batch so that a batch takes about 1/8 of the budget.
+
+    The size of a row is estimated from the uncompressed size of the
+    column chunks.
+    """
+    names = metadata.schema.names
+    col_indexes = [names.index(column) for column in columns]
+    total_bytes = 0
+    for rg_idx in range(metadata.num_row_groups):
+        rg_meta = metadata.row_group(rg_idx)
+        for col_idx in col_indexes:
+            total_bytes += rg_meta.column(col_idx).total_uncompressed_size
+    row_bytes = max(total_bytes / max(metadata.num_rows, 1), 1)
+    batch_size = int(memory_budget / 8 / row_bytes)
+    return min(max(batch_size, 1024), 1024 * 1024)
+
+
+def stream_batches(
+    parquet_file: str,
+    columns: List[str],
+    row_groups: Optional[Iterable[int]] = None,
+    batch_size: int = 65536,
+    metadata=None,
+):
+    """Record batches of the columns as tables, one batch in memory."""
+    pq_file = pq.ParquetFile(
+        parq_profile.input_file(parquet_file), metadata=metadata
+    )
+    if row_groups is not None:
+        row_groups = list(row_groups)
+    batches = pq_file.iter_batches(
+        batch_size, row_groups, columns=columns, use_threads=False
+    )
+    for batch in parq_profile.iterate("decode", batches):
+        yield pa.Table.from_batches([batch])
+
+
+def stream_files(
+    files: List[str],
+    spec: QuerySpec,
+    metadatas: List,
+    plans: List[ScanPlan],
+    memory_budget: int = 256 * 1024 * 1024,
+    batch_size: int = 0,
+) -> pa.Table:
+    """
+    Query result of record batches folded into a partial aggregate.
+
+    Files are read one after the other. Peak memory depends on the batch
+    size and the number of groups (and distinct values) instead of the file
+    sizes. Pending partials are merged when they exceed half of
+    memory_budget bytes. batch_size 0 derives the batch size from the
+    budget.
+    """
+    schema = metadatas[0].schema.to_arrow_schema()
+    columns = spec.input_columns()
+    if not batch_size:
+        batch_size = min(
+            stream_batch_size(metadata, columns, memory_budget)
+            for metadata in metadatas
+        )
+    tables = (
+        tbl
+        for parquet_file, metadata, plan in zip(files, metadatas, plans)
+        for tbl in stream_batches(
+            parquet_file, columns, plan.scanned, batch_size, metadata
+        )
+    )
+
+    if not spec.aggregates:
+        # the result itself is not bounded
+        return select_rows(schema, spec, tables)
+
+    partials = (partial_aggregate(spec, tbl) for tbl in tables)
+    partial = fold(spec, partials, merge_every=0, max_bytes=memory_budget // 2)
+    stats_partials = [
+        stats_partial(metadata, spec, plan.from_stats)
+        for metadata, plan in zip(metadatas, plans)
+        if plan.from_stats
+    ]
+    return finish(schema, spec, partial, stats_partials)
+
+
+def stream_row_groups(
+    parquet_file: str,
+    spec: QuerySpec,
+    row_groups: Optional[Iterable[int]] = None,
+    memory_budget: int = 256 * 1024 * 1024,
+    batch_size: int = 0,
+    metadata=None,
+    stats_row_groups: Iterable[int] = (),
+) -> pa.Table:
+    """Query result of the record batches of a file, see stream_files."""
+    if metadata is None:
+        metadata = parq_footer.read_metadata(parquet_file)
+    if row_groups is None:
+        row_groups = range(metadata.num_row_groups)
+    plan = ScanPlan([], list(stats_row_groups), list(row_groups))
+    return stream_files(
+        [parquet_file], spec, [metadata], [plan], memory_budget, batch_size
+    )
@@ -0,0 +1,158 @@
+"""
+Repeatable timings for parq-cli engines.
+
+Each engine is run a number of warmup times (discarded) followed by timed
+runs. The summary statistics and raw timings can be written as JSON or CSV.
+"""
+import contextlib
+import csv
+import json
+import math
+import os
+import pathlib
+import platform
+import statistics
+import sys
+import time
+
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+FORMATS = ["csv", "json"]
+
+
+class BenchStats(NamedTuple):
+    engine: str
+    runs: int
+    min: float
+    median: float
+    p95: float
+    mean: float
+    stddev: float
+    timings: List[float]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Percentile using linear interpolation between closest ranks."""
+    if not values:
+        raise ValueError("percentile of empty list")
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    lower = math.floor(rank)
+    upper = math.ceil(rank)
+    if lower == upper:
+        return ordered[lower]
+    fraction = rank - lower
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * fraction
+
+
+def time_runs(query: Callable, runs: int, warmup: int) -> List[float]:
+    """Call query warmup times then return the timings of runs calls."""
+    for _ in range(warmup):
+        query()
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        query()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(engine: str, timings: List[float]) -> BenchStats:
+    """Summary statistics of a list of timings."""
+    stddev = statistics.stdev(timings) if len(timings) > 1 else 0.0
+    return BenchStats(
+        engine=engine,
+        runs=len(timings),
+        min=min(timings),
+        median=statistics.median(timings),
+        p95=percentile(timings, 95),
+        mean=statistics.mean(timings),
+        stddev=stddev,
+        timings=timings,
+    )
+
+
+def environment(data_files: List[str]) -> dict:
+    """Details needed to compare results across machines and files."""
+    data_paths = [pathlib.Path(data_file) for data_file in data_files]
+    return {
+        "file": ",".join(str(path.resolve()) for path in data_paths),
+        "file_count": len(data_paths),
+        "file_bytes": sum(path.stat().st_size for path in data_paths),
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def print_stats(stats_list: List[BenchStats]):
+    """Print summary statistics as a table."""
+    fields = ["engine", "runs", "min", "median", "p95", "mean", "stddev"]
+    print("{:<28s}{:>6s}".format(*fields[:2]) + "".join(
+        "{:>10s}".format(field) for field in fields[2:]
+    ))
+    for stats in stats_list:
+        print("{:<28s}{:>6d}".format(stats.engine, stats.runs) + "".join(
+            "{:>10.4f}".format(getattr(stats, field)) for field in fields[2:]
+        ))
+
+
+def output_format(output: str) -> Tuple[str, Optional[str]]:
+    """Format and file of an output option, file None for stdout."""
+    if output in FORMATS:
+        return output, None
+    suffix = pathlib.Path(output).suffix.lower().lstrip(".")
+    if suffix not in FORMATS:
+        sys.exit(
+            f"Unknown output {output}. Use csv, json or a .json or .csv file"
+        )
+    return suffix, output
+
+
+def open_output(output_file: Optional[str]):
+    """File to write results to, stdout when None."""
+    if output_file is None:
+        return contextlib.nullcontext(sys.stdout)
+    return open(output_file, "w", newline="")
+
+
+def write_json(
+    output_file: Optional[str], env: dict, stats_list: List[BenchStats]
+):
+    """Write environment, summary statistics and raw timings as JSON."""
+    results = {
+        "environment": env,
+        "results": [stats._asdict() for stats in stats_list],
+    }
+    with open_output(output_file) as f:
+        json.dump(results, f, indent=2)
+
+
+def write_csv(
+    output_file: Optional[str], env: dict, stats_list: List[BenchStats]
+):
+    """Write one row per engine with the environment repeated per row."""
+    fields = list(BenchStats._fields) + list(env)
+    with open_output(output_file) as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for stats in stats_list:
+            row = stats._asdict()
+            row["timings"] = " ".join(f"{t:.6f}" for t in stats.timings)
+            row.update(env)
+            writer.writerow(row)
+
+
+def write_results(output: str, env: dict, stats_list: List[BenchStats]):
+    """
+    Write results as CSV or JSON to stdout or a file.
+
+    output is csv or json for stdout or a file ending in .csv or .json.
+    """
+    output_format_name, output_file = output_format(output)
+    if output_format_name == "csv":
+        write_csv(output_file, env, stats_list)
+    else:
+        write_json(output_file, env, stats_list)
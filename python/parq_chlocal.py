@@ -0,0 +1,181 @@
+"""
+Pool of long running clickhouse-local processes.
+
+Starting clickhouse-local for every query costs hundreds of milliseconds of
+fork/exec and initialization. Workers run clickhouse-local in interactive
+mode and are fed queries over stdin. Each query writes its result to an
+arrow file with INTO OUTFILE and is followed by a marker query so the
+worker knows when the result is complete. Worker startup is timed
+separately from the queries.
+"""
+import concurrent.futures
+import os
+import pathlib
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from typing import List
+
+import pyarrow as pa
+
+EXECUTABLE = "clickhouse-local"
+
+# seconds to wait for the exception of a failed query on stderr
+ERROR_WAIT = 2.0
+
+
+class WorkerError(RuntimeError):
+    pass
+
+
+class Worker:
+    """A clickhouse-local process running queries one at a time."""
+
+    def __init__(self, executable: str = EXECUTABLE):
+        start = time.perf_counter()
+        self.process = subprocess.Popen(
+            [executable, "--interactive"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        self.errors = queue.Queue()
+        self.error_reader = threading.Thread(
+            target=self._read_errors, daemon=True
+        )
+        self.error_reader.start()
+        self.result_dir = pathlib.Path(tempfile.mkdtemp(prefix="parq-ch-"))
+        self.queries = 0
+        self.exited = False
+        try:
+            self.version = self.query("SELECT version()").column(0)[0].as_py()
+        except BaseException:
+            self.close()
+            raise
+        self.startup_time = time.perf_counter() - start
+
+    def _read_errors(self):
+        for line in self.process.stderr:
+            self.errors.put(line.rstrip())
+
+    def _error_lines(self, timeout: float) -> List[str]:
+        """Lines on stderr, waiting up to timeout for the first one."""
+        lines = []
+        try:
+            lines.append(self.errors.get(timeout=timeout))
+            while True:
+                lines.append(self.errors.get_nowait())
+        except queue.Empty:
+            pass
+        return lines
+
+    def _run(self, sql: str):
+        """Run a statement and wait for the marker query."""
+        self.queries += 1
+        marker = f"__parq_done_{self.queries}__"
+        # interactive mode runs one statement per line
+        statement = " ".join(sql.split())
+        try:
+            self.process.stdin.write(
+                f"{statement};\nSELECT '{marker}' FORMAT TSVRaw;\n"
+            )
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            pass
+        else:
+            for line in self.process.stdout:
+                if line.strip() == marker:
+                    return
+        # stdout ends before the exit can be polled
+        self.exited = True
+        self.error_reader.join(ERROR_WAIT)
+        raise WorkerError(
+            "clickhouse-local exited: " + "\n".join(self._error_lines(0))
+        )
+
+    def query(self, sql: str) -> pa.Table:
+        """Result of a select query as an arrow table."""
+        result_file = self.result_dir / f"{self.queries + 1}.arrow"
+        self._error_lines(0)
+        self._run(f"{sql} INTO OUTFILE '{result_file}' FORMAT Arrow")
+        if not result_file.exists():
+            # stderr is not ordered with the marker on stdout
+            errors = self._error_lines(ERROR_WAIT)
+            raise WorkerError("\n".join(errors) or "no result")
+        with pa.OSFile(str(result_file)) as source:
+            tbl = pa.ipc.open_file(source).read_all()
+        result_file.unlink()
+        return tbl
+
+    def alive(self) -> bool:
+        return not self.exited and self.process.poll() is None
+
+    def close(self):
+        """Stop the process and remove its result files."""
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        shutil.rmtree(self.result_dir, ignore_errors=True)
+
+
+class WorkerPool:
+    """Workers started in parallel and shared by queries."""
+
+    def __init__(self, size: int = 0, executable: str = EXECUTABLE):
+        self.executable = executable
+        size = size or os.cpu_count() or 1
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(size) as executor:
+            futures = [
+                executor.submit(Worker, executable) for _ in range(size)
+            ]
+        errors = [future.exception() for future in futures]
+        self.workers: List[Worker] = [
+            future.result()
+            for future, error in zip(futures, errors)
+            if error is None
+        ]
+        failed = [error for error in errors if error is not None]
+        if failed:
+            # stop the workers which did start
+            self.close()
+            raise failed[0]
+        self.startup_time = time.perf_counter() - start
+        self.idle = queue.Queue()
+        for worker in self.workers:
+            self.idle.put(worker)
+
+    def query(self, sql: str) -> pa.Table:
+        """Run a query on the next idle worker, restarting dead workers."""
+        worker = self.idle.get()
+        try:
+            if not worker.alive():
+                worker.close()
+                self.workers.remove(worker)
+                worker = Worker(self.executable)
+                self.workers.append(worker)
+            return worker.query(sql)
+        finally:
+            self.idle.put(worker)
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
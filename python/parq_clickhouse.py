@@ -0,0 +1,188 @@
+"""
+ClickHouse column types for parquet files.
+
+Types are derived from the logical types of the parquet schema and narrowed
+with the footer statistics: integers get the smallest type holding their
+range, Nullable is only used for columns with nulls and dictionary encoded
+strings with small dictionaries become LowCardinality(String). Narrow types
+mean smaller hash tables and less decoding in clickhouse-local. The footers
+of several files give types holding the values of all of them.
+"""
+import datetime
+import json
+import math
+
+from typing import List, Optional, Tuple
+
+import parq_stats
+
+from parq_stats import ColumnStats
+
+PHYSICAL_TYPES = {
+    "BOOLEAN": "Bool",
+    "INT32": "Int32",
+    "INT64": "Int64",
+    "INT96": "DateTime64(9)",
+    "FLOAT": "Float32",
+    "DOUBLE": "Float64",
+    "BYTE_ARRAY": "String",
+}
+
+TIME_UNITS = {"milliseconds": 3, "microseconds": 6, "nanoseconds": 9}
+
+# ClickHouse suggests LowCardinality below about 10000 distinct values
+LOW_CARDINALITY_MAX = 10000
+
+EPOCH = datetime.date(1970, 1, 1)
+
+
+def file_row_groups(metadata):
+    """Footer and index of the row groups of one or more files."""
+    for file_metadata in parq_stats.metadata_list(metadata):
+        for row_group in range(file_metadata.num_row_groups):
+            yield file_metadata, row_group
+
+
+def column_range(metadata, col_idx: int) -> Optional[ColumnStats]:
+    """Statistics of a column over all row groups or None when missing."""
+    row_groups = []
+    for file_metadata, row_group in file_row_groups(metadata):
+        stats = parq_stats.column_stats(file_metadata, row_group, col_idx)
+        if stats is None or stats.null_count is None:
+            return None
+        # min and max are only missing for row groups of nulls
+        if stats.min is None and stats.null_count != stats.num_rows:
+            return None
+        row_groups.append(stats)
+    values = [stats for stats in row_groups if stats.min is not None]
+    return ColumnStats(
+        sum(stats.num_rows for stats in row_groups),
+        min((stats.min for stats in values), default=None),
+        max((stats.max for stats in values), default=None),
+        sum(stats.null_count for stats in row_groups),
+    )
+
+
+def int_type(lo: int, hi: int) -> str:
+    """Smallest ClickHouse integer type holding lo to hi."""
+    for bits in (8, 16, 32, 64):
+        if lo >= 0 and hi < 2**bits:
+            return f"UInt{bits}"
+        if -(2 ** (bits - 1)) <= lo and hi < 2 ** (bits - 1):
+            return f"Int{bits}"
+    return "Int128"
+
+
+def chunk_dictionary_entries(col_meta, value_len: float) -> float:
+    """
+    Estimated dictionary entries of a column chunk.
+
+    The dictionary page size is not in the footer and compresses better
+    than the indices, so the entries are solved from the uncompressed
+    chunk size assuming plain values with a 4 byte length prefix and bit
+    packed indices. The compressed dictionary page gives a lower bound.
+    """
+    entry_bytes = 4 + value_len
+    dict_span = col_meta.data_page_offset - col_meta.dictionary_page_offset
+    total = col_meta.total_uncompressed_size
+
+    def chunk_bytes(entries: float) -> float:
+        bit_width = max(1, math.ceil(math.log2(max(entries, 2))))
+        return entries * entry_bytes + col_meta.num_values * bit_width / 8
+
+    lo, hi = 0.0, total / entry_bytes
+    for _ in range(50):
+        mid = (lo + hi) / 2
+        if chunk_bytes(mid) > total:
+            hi = mid
+        else:
+            lo = mid
+    return max(lo, dict_span / entry_bytes)
+
+
+def dictionary_entries(metadata, col_idx: int, value_len: float):
+    """
+    Estimated dictionary size of the largest row group or None when a row
+    group is not dictionary encoded.
+    """
+    entries = 0
+    for file_metadata, row_group in file_row_groups(metadata):
+        col_meta = file_metadata.row_group(row_group).column(col_idx)
+        if not col_meta.has_dictionary_page:
+            return None
+        entries = max(entries, chunk_dictionary_entries(col_meta, value_len))
+    return entries
+
+
+def base_type(column_schema, col_range: Optional[ColumnStats]) -> str:
+    """ClickHouse type of a column without Nullable or LowCardinality."""
+    logical = json.loads(column_schema.logical_type.to_json())
+    logical_type = logical["Type"]
+    physical_type = column_schema.physical_type
+    has_range = col_range is not None and col_range.min is not None
+
+    if logical_type == "Date":
+        if has_range:
+            lo = (col_range.min - EPOCH).days
+            hi = (col_range.max - EPOCH).days
+            if 0 <= lo and hi < 2**16:
+                return "Date"
+        return "Date32"
+    if logical_type == "Timestamp":
+        return f"DateTime64({TIME_UNITS[logical['timeUnit']]})"
+    if logical_type == "Decimal":
+        return f"Decimal({logical['precision']}, {logical['scale']})"
+    if logical_type == "Int" or (
+        logical_type == "None" and physical_type in ("INT32", "INT64")
+    ):
+        if has_range:
+            return int_type(col_range.min, col_range.max)
+        if logical_type == "Int":
+            unsigned = "" if logical["isSigned"] else "U"
+            return f"{unsigned}Int{logical['bitWidth']}"
+    if physical_type == "FIXED_LEN_BYTE_ARRAY":
+        return f"FixedString({column_schema.length})"
+    return PHYSICAL_TYPES.get(physical_type, "String")
+
+
+def clickhouse_type(metadata, col_idx: int) -> str:
+    """Narrowest ClickHouse type of a column."""
+    schema = parq_stats.metadata_list(metadata)[0].schema
+    column_schema = schema.column(col_idx)
+    col_range = column_range(metadata, col_idx)
+    col_type = base_type(column_schema, col_range)
+
+    nullable = column_schema.max_definition_level > 0 and (
+        col_range is None or col_range.null_count > 0
+    )
+    low_cardinality = False
+    if col_type == "String":
+        value_len = 8.0
+        if col_range is not None and col_range.min is not None:
+            value_len = (len(col_range.min) + len(col_range.max)) / 2
+        entries = dictionary_entries(metadata, col_idx, value_len)
+        low_cardinality = (
+            entries is not None and entries <= LOW_CARDINALITY_MAX
+        )
+
+    if nullable:
+        col_type = f"Nullable({col_type})"
+    if low_cardinality:
+        col_type = f"LowCardinality({col_type})"
+    return col_type
+
+
+def clickhouse_types(metadata) -> List[Tuple[str, str]]:
+    """Column names with their ClickHouse types."""
+    schema = parq_stats.metadata_list(metadata)[0].schema
+    return [
+        (name, clickhouse_type(metadata, col_idx))
+        for col_idx, name in enumerate(schema.names)
+    ]
+
+
+def structure(metadata) -> str:
+    """ClickHouse table structure, e.g. for the file table function."""
+    return ", ".join(
+        f"{name} {col_type}" for name, col_type in clickhouse_types(metadata)
+    )
@@ -0,0 +1,229 @@
+"""
+Cache of copies of parquet files in other layouts.
+
+Copies (partitioned parquet datasets, feather files) are kept under
+~/.parq-cli/derived keyed by the source fingerprint, the format, the
+partition columns and the codec so that a fresh copy is reused instead of
+converting the source on every run. Copies of a changed source are removed
+and the least recently used copies are evicted when the cache grows over a
+disk budget (PARQ_CLI_CACHE_MB, 10 GB by default). Copies of several files
+are made in parallel and evicted once all of them exist so that one file's
+eviction cannot remove the copy of another file about to be read.
+"""
+import hashlib
+import logging
+import os
+import pathlib
+import shutil
+import time
+
+from typing import Collection, List, NamedTuple, Sequence
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import parq_files
+import parq_footer
+
+log = logging.getLogger(__name__)
+
+CACHE_DIR = pathlib.Path.home() / ".parq-cli" / "derived"
+DISK_BUDGET_MB = int(os.environ.get("PARQ_CLI_CACHE_MB", 10 * 1024))
+
+FORMATS = ["feather", "partitioned"]
+
+
+class Derived(NamedTuple):
+    path: pathlib.Path
+    # seconds spent converting the source, 0 when the copy was reused
+    convert_time: float
+    size: int
+
+
+class Entry(NamedTuple):
+    path: pathlib.Path
+    size: int
+    last_used: float
+
+
+def entry_key(
+    parquet_file: str, fmt: str, partition_cols: Sequence[str], codec: str
+) -> str:
+    """Cache key from the source fingerprint and the copy layout."""
+    layout = f"{fmt}:{','.join(partition_cols)}:{codec}"
+    layout_key = hashlib.sha1(layout.encode()).hexdigest()[:16]
+    return f"{parq_footer.fingerprint(parquet_file)}-{layout_key}"
+
+
+def disk_size(path: pathlib.Path) -> int:
+    """Size of a file or of all files below a directory."""
+    if path.is_file():
+        return path.stat().st_size
+    return sum(
+        entry.stat().st_size for entry in path.rglob("*") if entry.is_file()
+    )
+
+
+def _remove(path: pathlib.Path):
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def entries() -> List[Entry]:
+    """Cached copies, least recently used first."""
+    if not CACHE_DIR.exists():
+        return []
+    cached = [
+        Entry(path, disk_size(path), path.stat().st_mtime)
+        for path in CACHE_DIR.iterdir()
+        if not path.name.endswith(".tmp")
+    ]
+    return sorted(cached, key=lambda entry: entry.last_used)
+
+
+def _remove_stale(key: str):
+    """Remove copies of the same source with a different fingerprint."""
+    path_key, version_key, _ = key.split("-")
+    for path in CACHE_DIR.glob(f"{path_key}-*"):
+        if path.name.split("-")[1] != version_key:
+            log.info("removing stale copy %s", path.name)
+            _remove(path)
+
+
+def evict(
+    budget_mb: int = DISK_BUDGET_MB, keep: Collection[pathlib.Path] = ()
+):
+    """Remove least recently used copies until the cache fits the budget."""
+    cached = entries()
+    total = sum(entry.size for entry in cached)
+    for entry in cached:
+        if total <= budget_mb * 1024 * 1024:
+            break
+        if entry.path in keep:
+            continue
+        log.info("evicting %s (%d bytes)", entry.path.name, entry.size)
+        _remove(entry.path)
+        total -= entry.size
+
+
+def _convert(
+    parquet_file: str,
+    path: pathlib.Path,
+    fmt: str,
+    partition_cols: Sequence[str],
+    codec: str,
+):
+    """Write a copy of the parquet file."""
+    tbl = pq.read_table(parquet_file)
+    if fmt == "feather":
+        import pyarrow.feather as feather
+
+        feather.write_feather(tbl, str(path), compression=codec)
+    else:
+        pq.write_to_dataset(
+            tbl,
+            str(path),
+            partition_cols=list(partition_cols),
+            compression="none" if codec == "uncompressed" else codec,
+        )
+
+
+def _derived_copy(
+    parquet_file: str, fmt: str, partition_cols: Sequence[str], codec: str
+) -> Derived:
+    """Copy of a parquet file without evicting other copies."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Invalid format {fmt}. Choose from {FORMATS}")
+    key = entry_key(parquet_file, fmt, partition_cols, codec)
+    suffix = ".feather" if fmt == "feather" else ""
+    path = CACHE_DIR / f"{key}{suffix}"
+    if path.exists():
+        # the modification time records the last use
+        os.utime(path)
+        return Derived(path, 0.0, disk_size(path))
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    _remove_stale(key)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    start = time.perf_counter()
+    try:
+        _convert(parquet_file, tmp_path, fmt, partition_cols, codec)
+        os.replace(tmp_path, path)
+    except (OSError, pa.ArrowException):
+        _remove(tmp_path)
+        raise
+    convert_time = time.perf_counter() - start
+    return Derived(path, convert_time, disk_size(path))
+
+
+def derived_copy(
+    parquet_file: str,
+    fmt: str,
+    partition_cols: Sequence[str] = (),
+    codec: str = "lz4",
+    budget_mb: int = DISK_BUDGET_MB,
+) -> Derived:
+    """
+    Path of a copy of a parquet file, converting it when not cached.
+
+    fmt is feather (an arrow IPC file) or partitioned (a hive partitioned
+    parquet dataset) and codec is a compression name or uncompressed.
+    """
+    derived = _derived_copy(parquet_file, fmt, partition_cols, codec)
+    evict(budget_mb, keep={derived.path})
+    return derived
+
+
+def derived_copies(
+    parquet_files: List[str],
+    fmt: str,
+    partition_cols: Sequence[str] = (),
+    codec: str = "lz4",
+    budget_mb: int = DISK_BUDGET_MB,
+    workers: int = 0,
+) -> List[Derived]:
+    """Copies of parquet files converted in parallel (see derived_copy)."""
+    copies = parq_files.map_files(
+        lambda parquet_file: _derived_copy(
+            parquet_file, fmt, partition_cols, codec
+        ),
+        parquet_files,
+        workers,
+    )
+    evict(budget_mb, keep={derived.path for derived in copies})
+    return copies
+
+
+def legacy_copies() -> List[pathlib.Path]:
+    """
+    Copies written directly to ~/.parq-cli before copies were cached.
+
+    These are feather files and partitioned datasets (directories of
+    column=value directories) next to the cache directories.
+    """
+    parent = CACHE_DIR.parent
+    if not parent.exists():
+        return []
+    copies = []
+    for path in parent.iterdir():
+        if path.is_file() and path.suffix == ".feather":
+            copies.append(path)
+        elif path.is_dir() and any(
+            child.is_dir() and "=" in child.name for child in path.iterdir()
+        ):
+            copies.append(path)
+    return copies
+
+
+def clear():
+    """Remove all cached copies and the copies of earlier versions."""
+    for entry in entries():
+        _remove(entry.path)
+    if CACHE_DIR.exists():
+        for path in CACHE_DIR.glob("*.tmp"):
+            _remove(path)
+    for path in legacy_copies():
+        log.info("removing old copy %s", path)
+        _remove(path)
@@ -0,0 +1,66 @@
+"""
+Expand parquet paths given on the command line to a list of files.
+
+A path is a file, a directory (searched recursively for parquet files), a
+glob (~/data/*_cleaned.gzip.parq) or a comma separated list of these.
+"""
+import concurrent.futures
+import glob
+import os
+import pathlib
+
+from typing import Callable, Iterable, List, TypeVar
+
+PARQUET_SUFFIXES = {".parquet", ".parq", ".pq"}
+
+T = TypeVar("T")
+
+
+def split_paths(paths) -> List[str]:
+    """Paths from a comma separated string or a sequence."""
+    if isinstance(paths, (str, pathlib.Path)):
+        paths = str(paths).split(",")
+    return [str(path).strip() for path in paths if str(path).strip()]
+
+
+def directory_files(directory: pathlib.Path) -> List[str]:
+    """Parquet files below a directory."""
+    return sorted(
+        str(path)
+        for path in directory.rglob("*")
+        if path.is_file() and path.suffix in PARQUET_SUFFIXES
+    )
+
+
+def expand(paths) -> List[str]:
+    """
+    Files of paths which are files, directories or globs.
+
+    Paths matching nothing are returned unchanged so that the caller can
+    report them as missing.
+    """
+    files = []
+    for path in split_paths(paths):
+        path = os.path.expanduser(path)
+        data_path = pathlib.Path(path)
+        if data_path.is_dir():
+            files += directory_files(data_path)
+        elif glob.has_magic(path):
+            matches = sorted(glob.glob(path, recursive=True))
+            files += matches or [path]
+        else:
+            files.append(path)
+    # the same file given twice is scanned once
+    return list(dict.fromkeys(files))
+
+
+def map_files(
+    func: Callable[[str], T], files: Iterable[str], workers: int = 0
+) -> List[T]:
+    """Apply func to files in a thread pool keeping the file order."""
+    files = list(files)
+    if len(files) == 1:
+        return [func(files[0])]
+    workers = workers or os.cpu_count() or 1
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(func, files))
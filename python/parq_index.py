@@ -0,0 +1,246 @@
+"""
+Zone map indexes of parquet columns for point lookups.
+
+A zone is a slice of zone_rows rows of a row group. The index of a column
+holds the min, max and null count of each zone in an arrow file under
+~/.parq-cli/indexes. A lookup reads the column of the row groups with a
+zone that may hold the value, finds the matching rows in those zones and
+only then reads all columns of the row groups with matches. pyarrow
+neither exposes the parquet column index nor reads single pages, so zones
+are computed by scanning the column once and reads are of whole column
+chunks: zones prune row groups, not pages.
+"""
+import os
+import pathlib
+
+from typing import List, NamedTuple, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import parq_aggregate
+import parq_footer
+
+CACHE_DIR = pathlib.Path.home() / ".parq-cli" / "indexes"
+# rows of 1 MB of 64 bit values
+ZONE_ROWS = 128 * 1024
+
+
+class Lookup(NamedTuple):
+    result: pa.Table
+    zones: int
+    candidate_zones: int
+    row_groups: int
+    candidate_row_groups: int
+    matched_row_groups: int
+    # compressed column chunk bytes
+    bytes_read: int
+    file_bytes: int
+
+
+class StaleIndex(Exception):
+    pass
+
+
+def index_path(parquet_file: str, column: str) -> pathlib.Path:
+    """Index file of a column of a parquet file."""
+    path_key = parq_footer.fingerprint(parquet_file).split("-")[0]
+    return CACHE_DIR / f"{path_key}-{column}.zonemap.arrow"
+
+
+def zones(tbl: pa.Table, column: str, row_group: int, zone_rows: int):
+    """Min, max and null count of each zone of a row group."""
+    values = tbl.column(column)
+    rows = []
+    for first_row in range(0, max(tbl.num_rows, 1), zone_rows):
+        zone = values.slice(first_row, zone_rows)
+        min_max = pc.min_max(zone).as_py()
+        rows.append(
+            {
+                "row_group": row_group,
+                "first_row": first_row,
+                "num_rows": len(zone),
+                "min": min_max["min"],
+                "max": min_max["max"],
+                "null_count": zone.null_count,
+            }
+        )
+    return rows
+
+
+def index_schema(value_type: pa.DataType, fingerprint: str, zone_rows: int):
+    return pa.schema(
+        [
+            ("row_group", pa.int32()),
+            ("first_row", pa.int64()),
+            ("num_rows", pa.int64()),
+            ("min", value_type),
+            ("max", value_type),
+            ("null_count", pa.int64()),
+        ],
+        metadata={"fingerprint": fingerprint, "zone_rows": str(zone_rows)},
+    )
+
+
+def build(
+    parquet_file: str,
+    columns: List[str],
+    zone_rows: int = ZONE_ROWS,
+    workers: int = 0,
+) -> List[pathlib.Path]:
+    """Build the zone maps of columns in one scan of the columns."""
+    metadata = parq_footer.read_metadata(parquet_file)
+    arrow_schema = metadata.schema.to_arrow_schema()
+    for column in columns:
+        if column not in arrow_schema.names:
+            raise ValueError(f"Invalid column {column}")
+
+    zone_rows_by_column = {column: [] for column in columns}
+    row_group_zones = parq_aggregate.map_row_groups(
+        parquet_file,
+        lambda tbl: tbl,
+        columns,
+        workers=workers,
+        metadata=metadata,
+    )
+    for row_group, tbl in enumerate(row_group_zones):
+        for column in columns:
+            zone_rows_by_column[column] += zones(
+                tbl, column, row_group, zone_rows
+            )
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    fingerprint = parq_footer.fingerprint(parquet_file)
+    paths = []
+    for column, rows in zone_rows_by_column.items():
+        schema = index_schema(
+            arrow_schema.field(column).type, fingerprint, zone_rows
+        )
+        path = index_path(parquet_file, column)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with pa.OSFile(str(tmp_path), "wb") as sink:
+            with pa.ipc.new_file(sink, schema) as writer:
+                writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+        os.replace(tmp_path, path)
+        paths.append(path)
+    return paths
+
+
+def load(parquet_file: str, column: str) -> Optional[pa.Table]:
+    """
+    Zone map of a column or None when there is none.
+
+    Raises StaleIndex when the file changed since the index was built.
+    """
+    path = index_path(parquet_file, column)
+    if not path.exists():
+        return None
+    try:
+        index = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+    except (OSError, pa.ArrowInvalid):
+        return None
+    built_for = index.schema.metadata[b"fingerprint"].decode()
+    if built_for != parq_footer.fingerprint(parquet_file):
+        raise StaleIndex(f"Index of {column} is older than {parquet_file}")
+    return index
+
+
+def chunk_bytes(metadata, row_groups, columns=None) -> int:
+    """Compressed bytes of the column chunks of row groups."""
+    names = metadata.schema.names
+    total = 0
+    for row_group in row_groups:
+        rg_meta = metadata.row_group(row_group)
+        for col_idx in range(rg_meta.num_columns):
+            if columns is None or names[col_idx] in columns:
+                total += rg_meta.column(col_idx).total_compressed_size
+    return total
+
+
+def typed_value(value, value_type: pa.DataType) -> pa.Scalar:
+    """Lookup value given on the command line as the column type."""
+    try:
+        return pa.scalar(value).cast(value_type)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+        return pa.array([str(value)]).cast(value_type)[0]
+
+
+def matching_rows(
+    values: pa.ChunkedArray, zones: List[dict], value: pa.Scalar
+) -> List[int]:
+    """Indexes of the rows of candidate zones equal to value."""
+    indexes = []
+    for zone in zones:
+        zone_values = values.slice(zone["first_row"], zone["num_rows"])
+        matches = pc.indices_nonzero(
+            pc.fill_null(pc.equal(zone_values, value), False)
+        )
+        indexes += [zone["first_row"] + idx for idx in matches.to_pylist()]
+    return indexes
+
+
+def lookup(
+    parquet_file: str, column: str, value, index: pa.Table, workers: int = 0
+) -> Lookup:
+    """
+    Rows of a parquet file where column equals value.
+
+    Row groups without a candidate zone are skipped, the others are read
+    as whole column chunks.
+    """
+    metadata = parq_footer.read_metadata(parquet_file)
+    value = typed_value(value, index.schema.field("min").type)
+    candidates = index.filter(
+        pc.and_(
+            pc.less_equal(index.column("min"), value),
+            pc.greater_equal(index.column("max"), value),
+        )
+    )
+    zones_by_row_group = {}
+    for zone in candidates.select(
+        ["row_group", "first_row", "num_rows"]
+    ).to_pylist():
+        zones_by_row_group.setdefault(zone["row_group"], []).append(zone)
+    row_groups = sorted(zones_by_row_group)
+
+    column_tables = parq_aggregate.map_row_groups(
+        parquet_file,
+        lambda tbl: tbl,
+        [column],
+        row_groups,
+        workers,
+        metadata,
+    )
+    matched = []
+    for row_group, tbl in zip(row_groups, column_tables):
+        indexes = matching_rows(
+            tbl.column(column), zones_by_row_group[row_group], value
+        )
+        if indexes:
+            matched.append((row_group, indexes))
+    matched_row_groups = [row_group for row_group, _ in matched]
+    tables = parq_aggregate.map_row_groups(
+        parquet_file,
+        lambda tbl: tbl,
+        metadata.schema.names,
+        matched_row_groups,
+        workers,
+        metadata,
+    )
+    results = [
+        tbl.take(pa.array(indexes, pa.int64()))
+        for (_, indexes), tbl in zip(matched, tables)
+    ]
+    if not results:
+        results = [metadata.schema.to_arrow_schema().empty_table()]
+    return Lookup(
+        pa.concat_tables(results),
+        index.num_rows,
+        candidates.num_rows,
+        metadata.num_row_groups,
+        len(row_groups),
+        len(matched),
+        chunk_bytes(metadata, row_groups, [column])
+        + chunk_bytes(metadata, matched_row_groups),
+        chunk_bytes(metadata, range(metadata.num_row_groups)),
+    )
@@ -0,0 +1,201 @@
+"""
+Rewrite parquet files with a layout chosen for fast scans.
+
+Files written by df.to_parquet have default row group sizes, no sort order
+and one codec for all columns. A rewrite can sort by a key so that row
+group statistics prune filters, size row groups and pages, choose
+dictionary encoding and the codec per column and add page indexes and
+bloom filters. The sort order is recorded in the row group metadata.
+"""
+import os
+import pathlib
+import time
+
+from typing import Dict, List, NamedTuple, Sequence
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import parq_query
+
+# pyarrow writes row groups of up to 1M rows by default
+ROW_GROUP_ROWS = 1024 * 1024
+PAGE_BYTES = 1024 * 1024
+# dictionary encode columns with fewer distinct values per row
+DICTIONARY_RATIO = 0.5
+BLOOM_FILTER_FPP = 0.05
+# rewrites go outside the input directories so they are not scanned with them
+OUTPUT_DIR = pathlib.Path.home() / ".parq-cli" / "optimized"
+
+
+class Layout(NamedTuple):
+    sort_by: List[str]
+    row_group_rows: int
+    page_bytes: int
+    dictionary: List[str]
+    codecs: Dict[str, str]
+    page_index: bool
+    bloom_filters: List[str]
+
+
+class Rewrite(NamedTuple):
+    layout: Layout
+    elapsed: float
+    source_bytes: int
+    target_bytes: int
+
+
+def parse_codecs(codec: str, columns: Sequence[str]) -> Dict[str, str]:
+    """
+    Codec of each column from a default and column overrides.
+
+    zstd,TailNum=snappy uses zstd for all columns but TailNum.
+    """
+    codecs = dict.fromkeys(columns, "snappy")
+    for part in parq_query.split_names(codec):
+        column, sep, name = part.rpartition("=")
+        if not sep:
+            codecs = dict.fromkeys(columns, name)
+        elif column not in codecs:
+            raise ValueError(f"Invalid column {column}")
+        else:
+            codecs[column] = name
+    return codecs
+
+
+def dictionary_columns(tbl: pa.Table, dictionary) -> List[str]:
+    """
+    Columns to dictionary encode.
+
+    dictionary is auto (columns with few distinct values), all, none or a
+    list of columns.
+    """
+    if dictionary in ("all", True):
+        return tbl.column_names
+    if dictionary in ("none", False):
+        return []
+    if dictionary != "auto":
+        return parq_query.split_names(dictionary)
+    columns = []
+    for name in tbl.column_names:
+        distinct = pc.count_distinct(tbl.column(name)).as_py()
+        if distinct <= DICTIONARY_RATIO * max(tbl.num_rows, 1):
+            columns.append(name)
+    return columns
+
+
+def bloom_filter_options(tbl: pa.Table, layout: Layout) -> dict:
+    """Bloom filters sized for the distinct values of a row group."""
+    options = {}
+    for name in layout.bloom_filters:
+        distinct = pc.count_distinct(tbl.column(name)).as_py()
+        ndv = max(min(distinct, layout.row_group_rows), 1)
+        options[name] = {"ndv": ndv, "fpp": BLOOM_FILTER_FPP}
+    return options
+
+
+def choose_layout(
+    tbl: pa.Table,
+    sort_by=(),
+    row_group_rows: int = ROW_GROUP_ROWS,
+    page_bytes: int = PAGE_BYTES,
+    dictionary="auto",
+    codec: str = "zstd",
+    page_index: bool = True,
+    bloom_filters=(),
+) -> Layout:
+    """Layout of a table from the optimize options."""
+    layout = Layout(
+        sort_by=parq_query.split_names(sort_by),
+        row_group_rows=row_group_rows,
+        page_bytes=page_bytes,
+        dictionary=dictionary_columns(tbl, dictionary),
+        codecs=parse_codecs(codec, tbl.column_names),
+        page_index=page_index,
+        bloom_filters=parq_query.split_names(bloom_filters),
+    )
+    names = set(tbl.column_names)
+    for column in layout.sort_by + layout.dictionary + layout.bloom_filters:
+        if column not in names:
+            raise ValueError(f"Invalid column {column}")
+    return layout
+
+
+def write(tbl: pa.Table, target: str, layout: Layout):
+    """Write a table in a layout, sorting it by the sort key."""
+    if layout.sort_by:
+        tbl = tbl.sort_by([(column, "ascending") for column in layout.sort_by])
+    options = {}
+    if layout.bloom_filters:
+        options["bloom_filter_options"] = bloom_filter_options(tbl, layout)
+    sorting_columns = None
+    if layout.sort_by:
+        sorting_columns = pq.SortingColumn.from_ordering(
+            tbl.schema, [(column, "ascending") for column in layout.sort_by]
+        )
+    with pq.ParquetWriter(
+        target,
+        tbl.schema,
+        use_dictionary=layout.dictionary,
+        compression=layout.codecs,
+        data_page_size=layout.page_bytes,
+        write_page_index=layout.page_index,
+        sorting_columns=sorting_columns,
+        **options,
+    ) as writer:
+        writer.write_table(tbl, row_group_size=layout.row_group_rows)
+
+
+def target_paths(files: List[str], target: str = "") -> List[pathlib.Path]:
+    """
+    Paths of the rewrites of files.
+
+    A single file is rewritten to target. Several files keep their paths
+    relative to their common directory below target. Without a target the
+    absolute paths of the files are kept below OUTPUT_DIR.
+    """
+    if target and len(files) == 1:
+        return [pathlib.Path(target)]
+    paths = [pathlib.Path(data_file).resolve() for data_file in files]
+    if not target:
+        return [OUTPUT_DIR / path.relative_to(path.anchor) for path in paths]
+    common = pathlib.Path(os.path.commonpath([path.parent for path in paths]))
+    return [pathlib.Path(target) / path.relative_to(common) for path in paths]
+
+
+def rewrite(parquet_file: str, target: str, **layout_options) -> Rewrite:
+    """Rewrite a parquet file to target in the layout of the options."""
+    start = time.perf_counter()
+    tbl = pq.read_table(parquet_file)
+    layout = choose_layout(tbl, **layout_options)
+    write(tbl, target, layout)
+    return Rewrite(
+        layout,
+        time.perf_counter() - start,
+        os.path.getsize(parquet_file),
+        os.path.getsize(target),
+    )
+
+
+def describe(metadata) -> str:
+    """Row groups, sizes and codecs of a file."""
+    codecs = set()
+    dictionary = 0
+    for row_group in range(metadata.num_row_groups):
+        rg_meta = metadata.row_group(row_group)
+        for col_idx in range(rg_meta.num_columns):
+            col_meta = rg_meta.column(col_idx)
+            codecs.add(col_meta.compression)
+            dictionary += col_meta.has_dictionary_page
+    chunks = metadata.num_row_groups * metadata.num_columns
+    return (
+        "{:,} rows in {} row groups, codecs {}, {}/{} column chunks "
+        "dictionary encoded"
+    ).format(
+        metadata.num_rows,
+        metadata.num_row_groups,
+        ",".join(sorted(codecs)),
+        dictionary,
+        chunks,
+    )
@@ -0,0 +1,114 @@
+"""
+Write query results as CSV, JSON lines, parquet or an arrow IPC stream.
+
+Results are written batch by batch from arrow without converting them to
+pandas, either to stdout (--output=csv) or to a file with a matching suffix
+(--output=result.parquet).
+"""
+import datetime
+import decimal
+import json
+import pathlib
+import sys
+
+from typing import Optional, Tuple
+
+import pyarrow as pa
+
+FORMATS = ["csv", "jsonl", "parquet", "arrow"]
+
+SUFFIXES = {
+    ".csv": "csv",
+    ".jsonl": "jsonl",
+    ".json": "jsonl",
+    ".parquet": "parquet",
+    ".parq": "parquet",
+    ".arrow": "arrow",
+    ".arrows": "arrow",
+}
+
+BATCH_ROWS = 64 * 1024
+
+
+def output_format(output: str) -> Tuple[str, Optional[str]]:
+    """Format and file of an output option, file None for stdout."""
+    if output in FORMATS:
+        return output, None
+    suffix = pathlib.Path(output).suffix.lower()
+    if suffix not in SUFFIXES:
+        sys.exit(
+            "Unknown output {}. Use one of {} or a file ending in {}".format(
+                output, ", ".join(FORMATS), ", ".join(SUFFIXES)
+            )
+        )
+    return SUFFIXES[suffix], output
+
+
+def json_default(value):
+    """JSON value of types the json module does not know."""
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+def write_jsonl(sink, tbl: pa.Table):
+    """Write a table as one JSON object per line."""
+    for batch in tbl.to_batches(BATCH_ROWS):
+        lines = [
+            json.dumps(row, default=json_default) + "\n"
+            for row in batch.to_pylist()
+        ]
+        sink.write("".join(lines).encode())
+
+
+def write_csv(sink, tbl: pa.Table):
+    """Write a table as CSV with a header line."""
+    import pyarrow.csv as csv
+
+    with csv.CSVWriter(sink, tbl.schema) as writer:
+        for batch in tbl.to_batches(BATCH_ROWS):
+            writer.write_batch(batch)
+
+
+def write_parquet(sink, tbl: pa.Table):
+    """Write a table as a parquet file."""
+    import pyarrow.parquet as pq
+
+    with pq.ParquetWriter(sink, tbl.schema) as writer:
+        for batch in tbl.to_batches(BATCH_ROWS):
+            writer.write_batch(batch)
+
+
+def write_arrow(sink, tbl: pa.Table):
+    """Write a table as an arrow IPC stream."""
+    with pa.ipc.new_stream(sink, tbl.schema) as writer:
+        for batch in tbl.to_batches(BATCH_ROWS):
+            writer.write_batch(batch)
+
+
+WRITERS = {
+    "csv": write_csv,
+    "jsonl": write_jsonl,
+    "parquet": write_parquet,
+    "arrow": write_arrow,
+}
+
+
+def write_table(tbl: pa.Table, output: str):
+    """Write a table to stdout or a file in the output format."""
+    fmt, output_file = output_format(output)
+    if output_file is None:
+        sys.stdout.flush()
+        sink = pa.PythonFile(sys.stdout.buffer, mode="w")
+        WRITERS[fmt](sink, tbl)
+        sys.stdout.buffer.flush()
+    else:
+        with pa.OSFile(output_file, "wb") as sink:
+            WRITERS[fmt](sink, tbl)
+
@@ -0,0 +1,268 @@
+"""
+Named phase spans and a sampling profiler for parq-cli commands.
+
+Spans record where the time of a command goes: footer (opening files and
+parsing footers), read (file I/O), decode (decompressing and decoding pages
+into arrow, excluding the reads made while decoding), aggregate, convert
+(to and from pandas) and render (printing or writing the result). Spans
+nest and the summary reports the self time of each phase, summed over
+threads. Recording is off unless enabled so the spans cost a function call.
+
+The spans are written as Chrome trace JSON (chrome://tracing, Perfetto or
+speedscope) and the stacks of the sampling profiler as folded stacks for
+flamegraph.pl or speedscope.
+"""
+import collections
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+import pyarrow as pa
+
+
+class Span(NamedTuple):
+    name: str
+    thread: int
+    start: float
+    duration: float
+
+
+class PhaseTime(NamedTuple):
+    name: str
+    calls: int
+    total: float
+    self_time: float
+
+
+class Profile:
+    """Spans recorded by all threads of the process."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans: List[Span] = []
+        self.thread_names: Dict[int, str] = {}
+        self.lock = threading.Lock()
+
+    def add(self, name: str, start: float, duration: float):
+        thread = threading.current_thread()
+        with self.lock:
+            self.thread_names.setdefault(thread.ident, thread.name)
+            self.spans.append(Span(name, thread.ident, start, duration))
+
+
+_profile: Optional[Profile] = None
+
+
+def enable() -> Profile:
+    """Start recording spans."""
+    global _profile
+    _profile = Profile()
+    return _profile
+
+
+def disable() -> Optional[Profile]:
+    """Stop recording spans and return the recorded profile."""
+    global _profile
+    profile, _profile = _profile, None
+    return profile
+
+
+def enabled() -> bool:
+    return _profile is not None
+
+
+@contextlib.contextmanager
+def span(name: str):
+    """Record the time spent in a block as a phase."""
+    profile = _profile
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, start, time.perf_counter() - start)
+
+
+def phase(name: str):
+    """Decorator recording every call of a function as a phase."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profile is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def iterate(name: str, iterable: Iterable) -> Iterator:
+    """Items of an iterable with the time to produce each as a phase."""
+    iterator = iter(iterable)
+    while True:
+        with span(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class TimedFile:
+    """File object recording its reads as read spans."""
+
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+
+    def read(self, size: int = -1) -> bytes:
+        with span("read"):
+            return self.file.read(size)
+
+    def __getattr__(self, attr):
+        return getattr(self.file, attr)
+
+
+def input_file(path: str):
+    """
+    Path to pass to a parquet reader, a file timing its reads when profiling.
+
+    The reads made by the reader are then told apart from decoding.
+    """
+    if _profile is None:
+        return path
+    return pa.PythonFile(TimedFile(path), mode="r")
+
+
+def phase_times(profile: Profile) -> List[PhaseTime]:
+    """Calls, total and self time of each phase in order of first use."""
+    calls = collections.Counter()
+    totals: Dict[str, float] = collections.defaultdict(float)
+    self_times: Dict[str, float] = collections.defaultdict(float)
+    by_thread = collections.defaultdict(list)
+    for rec in profile.spans:
+        by_thread[rec.thread].append(rec)
+    for spans in by_thread.values():
+        # parents start before and end after their children
+        spans.sort(key=lambda rec: (rec.start, -rec.duration))
+        open_spans: List[Span] = []
+        for rec in spans:
+            while open_spans and (
+                open_spans[-1].start + open_spans[-1].duration <= rec.start
+            ):
+                open_spans.pop()
+            if open_spans:
+                self_times[open_spans[-1].name] -= rec.duration
+            calls[rec.name] += 1
+            totals[rec.name] += rec.duration
+            self_times[rec.name] += rec.duration
+            open_spans.append(rec)
+    names = dict.fromkeys(
+        rec.name for rec in sorted(profile.spans, key=lambda rec: rec.start)
+    )
+    return [
+        PhaseTime(name, calls[name], totals[name], self_times[name])
+        for name in names
+    ]
+
+
+def print_summary(profile: Profile, file=sys.stderr):
+    """Print the calls, total and self time of each phase."""
+    wall = time.perf_counter() - profile.start
+    print(f"{'phase':<12s}{'calls':>8s}{'total':>10s}{'self':>10s}", file=file)
+    for phase_time in phase_times(profile):
+        print(
+            "{:<12s}{:>8d}{:>10.4f}{:>10.4f}".format(*phase_time), file=file
+        )
+    print(f"{'wall':<12s}{'':>8s}{wall:>10.4f}", file=file)
+
+
+def chrome_trace(profile: Profile) -> dict:
+    """Spans as complete events of the Chrome trace event format."""
+    pid = os.getpid()
+    tids = {thread: tid for tid, thread in enumerate(profile.thread_names)}
+    events = [
+        {
+            "name": "thread_name",
+            "ph": "M",
+            "pid": pid,
+            "tid": tids[thread],
+            "args": {"name": name},
+        }
+        for thread, name in profile.thread_names.items()
+    ]
+    for rec in profile.spans:
+        events.append(
+            {
+                "name": rec.name,
+                "cat": "phase",
+                "ph": "X",
+                "pid": pid,
+                "tid": tids[rec.thread],
+                "ts": round((rec.start - profile.start) * 1e6, 3),
+                "dur": round(rec.duration * 1e6, 3),
+            }
+        )
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_chrome_trace(profile: Profile, path: str):
+    with open(path, "w") as trace_file:
+        json.dump(chrome_trace(profile), trace_file)
+
+
+class Sampler:
+    """
+    Sampling profiler counting the python stacks of all threads.
+
+    Time spent in native code (arrow, duckdb) is attributed to the python
+    function which called it.
+    """
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run, name="sampler", daemon=True
+        )
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread, frame in sys._current_frames().items():
+                if thread == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    module = os.path.basename(code.co_filename)
+                    stack.append(f"{code.co_name} ({module})")
+                    frame = frame.f_back
+                stack.append(names.get(thread, str(thread)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def write_folded(self, path: str):
+        """Write the stacks in the folded format of flamegraph.pl."""
+        with open(path, "w") as folded:
+            for stack, count in self.stacks.most_common():
+                folded.write(f"{stack} {count}\n")
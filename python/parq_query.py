@@ -0,0 +1,539 @@
+"""
+Engine independent query specification for parq-cli.
+
+A query has optional group keys, aggregates and filters. When there are no
+aggregates the query is a projection of columns with the filters applied.
+The spec is compiled to SQL (duckdb, clickhouse-local), pandas, arrow,
+polars and datafusion.
+
+count(*) as ct, count_distinct(Carrier) as carrier_uniq_ct
+Year >= 2005 and Carrier = 'AA'
+"""
+import json
+import pathlib
+import re
+import sys
+
+from typing import Any, List, NamedTuple
+
+AGG_FUNCS = [
+    "count", "sum", "avg", "min", "max", "count_distinct", "null_count"
+]
+FILTER_OPS = ["=", "!=", "<", "<=", ">", ">=", "in"]
+
+
+class Agg(NamedTuple):
+    func: str
+    column: str  # * for count(*)
+    alias: str
+
+
+class Filter(NamedTuple):
+    column: str
+    op: str
+    value: Any  # list of values for the in operator
+
+
+class QuerySpec(NamedTuple):
+    group_by: List[str] = []
+    aggregates: List[Agg] = []
+    filters: List[Filter] = []
+    columns: List[str] = []  # projection when there are no aggregates
+
+    def input_columns(self) -> List[str]:
+        """Columns that have to be read to answer the query."""
+        names = list(self.group_by) + list(self.columns)
+        names += [agg.column for agg in self.aggregates if agg.column != "*"]
+        names += [flt.column for flt in self.filters]
+        return list(dict.fromkeys(names))
+
+    def output_columns(self) -> List[str]:
+        """Column names of the query result."""
+        if not self.aggregates:
+            return list(self.columns)
+        return list(self.group_by) + [agg.alias for agg in self.aggregates]
+
+    def count_column(self) -> str:
+        """Column to count when all rows are counted."""
+        input_columns = self.input_columns()
+        if not input_columns:
+            sys.exit("count(*) without group keys needs another column")
+        return input_columns[0]
+
+
+QUERIES = {
+    "year_carriers": QuerySpec(
+        group_by=["Year"],
+        aggregates=[
+            Agg("count", "*", "ct"),
+            Agg("count_distinct", "Carrier", "carrier_uniq_ct"),
+        ],
+    ),
+    "origin_delay": QuerySpec(
+        group_by=["Origin", "Year", "Month"],
+        aggregates=[
+            Agg("avg", "DepDelay", "avg_DepDelay"),
+            Agg("count", "DepDelay", "count_DepDelay"),
+        ],
+    ),
+}
+DEFAULT_QUERY = "year_carriers"
+
+
+def split_names(names) -> List[str]:
+    """List of names from a comma separated string or a sequence."""
+    if names is None:
+        return []
+    if isinstance(names, str):
+        names = names.split(",")
+    return [name.strip() for name in names if name.strip()]
+
+
+def parse_agg(agg_str: str) -> Agg:
+    """Parse an aggregate like count(*), avg(DepDelay) as avg_delay."""
+    agg_re = r"^\s*(\w+)\s*\(\s*(\*|\w+)\s*\)\s*(?:as\s+(\w+))?\s*$"
+    match = re.match(agg_re, agg_str, re.IGNORECASE)
+    if match is None:
+        sys.exit(f"Invalid aggregate {agg_str}")
+    func, column, alias = match.groups()
+    func = func.lower()
+    if func not in AGG_FUNCS:
+        sys.exit(
+            "Invalid aggregate {}. Choose from {}".format(
+                func, ", ".join(AGG_FUNCS)
+            )
+        )
+    if column == "*" and func != "count":
+        sys.exit(f"Only count can be used with *: {agg_str}")
+    if alias is None:
+        alias = "ct" if column == "*" else f"{func}_{column}"
+    return Agg(func, column, alias)
+
+
+def parse_aggregates(aggs) -> List[Agg]:
+    """Parse a comma separated list of aggregates."""
+    return [parse_agg(agg_str) for agg_str in split_names(aggs)]
+
+
+def parse_value(value_str: str):
+    """Parse a quoted string or number literal."""
+    value_str = value_str.strip()
+    if value_str[:1] in "'\"" and value_str[-1:] == value_str[:1]:
+        return value_str[1:-1]
+    try:
+        return int(value_str)
+    except ValueError:
+        pass
+    try:
+        return float(value_str)
+    except ValueError:
+        sys.exit(f"Invalid value {value_str}")
+
+
+def parse_filters(where: str) -> List[Filter]:
+    """
+    Parse a conjunction of comparisons.
+
+    Year >= 2005 and Carrier in ('AA', 'UA')
+    """
+    if not where:
+        return []
+    value_re = r"'[^']*'|\"[^\"]*\"|[-+.\w]+"
+    filter_re = (
+        r"^\s*(\w+)\s*(?:(in)\s*\(((?:\s*(?:{0})\s*,?)+)\)"
+        r"|(<>|!=|<=|>=|=|<|>)\s*({0}))\s*$"
+    ).format(value_re)
+    filters = []
+    for condition in re.split(r"\s+and\s+", where.strip(), flags=re.I):
+        match = re.match(filter_re, condition, re.IGNORECASE)
+        if match is None:
+            sys.exit(f"Invalid filter {condition}")
+        column, in_op, in_values, op, value = match.groups()
+        if in_op:
+            values = [
+                parse_value(val) for val in re.findall(value_re, in_values)
+            ]
+            filters.append(Filter(column, "in", values))
+        else:
+            op = "!=" if op == "<>" else op
+            filters.append(Filter(column, op, parse_value(value)))
+    return filters
+
+
+def load_spec(spec_file: str) -> QuerySpec:
+    """Load a query spec from a JSON file."""
+    with open(spec_file) as f:
+        spec_dict = json.load(f)
+    return QuerySpec(
+        group_by=split_names(spec_dict.get("group_by")),
+        aggregates=parse_aggregates(spec_dict.get("aggregates")),
+        filters=parse_filters(spec_dict.get("where", "")),
+        columns=split_names(spec_dict.get("columns")),
+    )
+
+
+def build_spec(
+    query: str = DEFAULT_QUERY, group_by=None, agg=None, where: str = ""
+) -> QuerySpec:
+    """
+    Query spec from a named query or JSON file with optional overrides.
+
+    The group keys and aggregates replace those of the named query and the
+    filters are added to them.
+    """
+    if query.endswith(".json") and pathlib.Path(query).exists():
+        spec = load_spec(query)
+    elif query in QUERIES:
+        spec = QUERIES[query]
+    else:
+        sys.exit(
+            "Invalid query {}. Choose from {} or a JSON file".format(
+                query, ", ".join(QUERIES)
+            )
+        )
+    if group_by is not None:
+        spec = spec._replace(group_by=split_names(group_by))
+    if agg is not None:
+        spec = spec._replace(aggregates=parse_aggregates(agg))
+    if where:
+        spec = spec._replace(filters=list(spec.filters) + parse_filters(where))
+    if not spec.aggregates and not spec.columns:
+        sys.exit("Query needs aggregates or columns")
+    return spec
+
+
+def describe(spec: QuerySpec) -> str:
+    """Query spec as a SQL like string."""
+    return to_sql(spec, "t")
+
+
+# SQL (duckdb and clickhouse-local)
+
+
+def sql_literal(value) -> str:
+    """Value as a SQL literal."""
+    if isinstance(value, str):
+        return "'{}'".format(value.replace("'", "''"))
+    return repr(value)
+
+
+def sql_filter(flt: Filter) -> str:
+    """Filter as a SQL condition."""
+    if flt.op == "in":
+        values = ", ".join(sql_literal(value) for value in flt.value)
+        return f"{flt.column} in ({values})"
+    return f"{flt.column} {flt.op} {sql_literal(flt.value)}"
+
+
+def sql_where(spec: QuerySpec) -> str:
+    """Filters as a SQL where condition without the where keyword."""
+    return " and ".join(sql_filter(flt) for flt in spec.filters)
+
+
+def sql_agg(agg: Agg) -> str:
+    """Aggregate as a SQL expression."""
+    if agg.func == "count_distinct":
+        return f"count(distinct {agg.column})"
+    if agg.func == "null_count":
+        return f"count(*) - count({agg.column})"
+    return f"{agg.func}({agg.column})"
+
+
+def sql_select_list(spec: QuerySpec) -> str:
+    """Select list of the query."""
+    if not spec.aggregates:
+        return ", ".join(spec.columns)
+    return ", ".join(
+        list(spec.group_by)
+        + [f"{sql_agg(agg)} as {agg.alias}" for agg in spec.aggregates]
+    )
+
+
+def to_sql(spec: QuerySpec, source: str) -> str:
+    """Query as SQL reading from source."""
+    sql = f"select {sql_select_list(spec)} from {source}"
+    if spec.filters:
+        sql += f" where {sql_where(spec)}"
+    if spec.aggregates and spec.group_by:
+        sql += " group by {}".format(", ".join(spec.group_by))
+    return sql
+
+
+# pandas
+
+
+def pandas_mask(df, flt: Filter):
+    """Boolean series for a filter."""
+    srs = df[flt.column]
+    if flt.op == "in":
+        return srs.isin(flt.value)
+    ops = {
+        "=": srs.eq,
+        "!=": srs.ne,
+        "<": srs.lt,
+        "<=": srs.le,
+        ">": srs.gt,
+        ">=": srs.ge,
+    }
+    return ops[flt.op](flt.value)
+
+
+def pandas_query(spec: QuerySpec, df):
+    """Run the query on a pandas dataframe."""
+    import pandas as pd
+
+    for flt in spec.filters:
+        df = df[pandas_mask(df, flt)]
+    if not spec.aggregates:
+        return df[spec.columns]
+
+    pandas_funcs = {
+        "count": "count",
+        "sum": "sum",
+        "avg": "mean",
+        "min": "min",
+        "max": "max",
+        "count_distinct": "nunique",
+        "null_count": lambda srs: srs.isna().sum(),
+    }
+    named_aggs = {}
+    for agg in spec.aggregates:
+        if agg.column == "*":
+            named_aggs[agg.alias] = (spec.count_column(), "size")
+        else:
+            named_aggs[agg.alias] = (agg.column, pandas_funcs[agg.func])
+    if spec.group_by:
+        # keep the null group as sql and arrow do
+        grouped = df.groupby(spec.group_by, dropna=False)
+        return grouped.agg(**named_aggs).reset_index()
+    return pd.DataFrame(
+        {
+            alias: [df[column].agg(func)]
+            for alias, (column, func) in named_aggs.items()
+        }
+    )
+
+
+# arrow
+
+
+def arrow_expression(filters: List[Filter]):
+    """Filters as a pyarrow dataset expression or None without filters."""
+    if not filters:
+        # importing pyarrow.dataset is slow, skip it for plain scans
+        return None
+    import pyarrow.dataset as ds
+
+    expr = None
+    for flt in filters:
+        field = ds.field(flt.column)
+        if flt.op == "in":
+            flt_expr = field.isin(flt.value)
+        else:
+            ops = {
+                "=": field.__eq__,
+                "!=": field.__ne__,
+                "<": field.__lt__,
+                "<=": field.__le__,
+                ">": field.__gt__,
+                ">=": field.__ge__,
+            }
+            flt_expr = ops[flt.op](flt.value)
+        expr = flt_expr if expr is None else expr & flt_expr
+    return expr
+
+
+def arrow_aggregations(spec: QuerySpec) -> dict:
+    """
+    Aggregations for pyarrow group by keyed by their output column name.
+
+    Aggregations are shared between aggregates, e.g. count(*) is used by
+    null_count which is the difference of all rows and valid rows.
+    """
+    import pyarrow.compute as pc
+
+    arrow_funcs = {
+        "count": "count",
+        "sum": "sum",
+        "avg": "mean",
+        "min": "min",
+        "max": "max",
+        "count_distinct": "count_distinct",
+        "null_count": "count",
+    }
+    aggregations = {}
+    for agg in spec.aggregates:
+        if agg.column == "*" or agg.func == "null_count":
+            aggregations["count_all"] = ([], "count_all")
+        if agg.column == "*":
+            continue
+        func = arrow_funcs[agg.func]
+        if func in ("count", "count_distinct"):
+            options = pc.CountOptions(mode="only_valid")
+            aggregations[f"{agg.column}_{func}"] = (agg.column, func, options)
+        else:
+            aggregations[f"{agg.column}_{func}"] = (agg.column, func)
+    return aggregations
+
+
+def arrow_agg_column(grouped, agg: Agg):
+    """Column of an aggregate from the output of arrow_aggregations."""
+    import pyarrow.compute as pc
+
+    if agg.column == "*":
+        return grouped.column("count_all")
+    if agg.func == "null_count":
+        valid = grouped.column(f"{agg.column}_count")
+        return pc.subtract(grouped.column("count_all"), valid)
+    func = "mean" if agg.func == "avg" else agg.func
+    return grouped.column(f"{agg.column}_{func}")
+
+
+def arrow_query(spec: QuerySpec, tbl):
+    """Run the query on a pyarrow table."""
+    import pyarrow as pa
+
+    expr = arrow_expression(spec.filters)
+    if expr is not None:
+        tbl = tbl.filter(expr)
+    if not spec.aggregates:
+        return tbl.select(spec.columns)
+
+    aggregations = arrow_aggregations(spec)
+    grouped = tbl.group_by(spec.group_by).aggregate(
+        list(aggregations.values())
+    )
+    columns = [grouped.column(key) for key in spec.group_by]
+    columns += [arrow_agg_column(grouped, agg) for agg in spec.aggregates]
+    return pa.table(columns, names=spec.output_columns())
+
+
+# polars
+
+
+def polars_expression(filters: List[Filter]):
+    """Filters as a polars expression or None without filters."""
+    import polars as pl
+
+    expr = None
+    for flt in filters:
+        column = pl.col(flt.column)
+        if flt.op == "in":
+            flt_expr = column.is_in(flt.value)
+        else:
+            ops = {
+                "=": column.__eq__,
+                "!=": column.__ne__,
+                "<": column.__lt__,
+                "<=": column.__le__,
+                ">": column.__gt__,
+                ">=": column.__ge__,
+            }
+            flt_expr = ops[flt.op](flt.value)
+        expr = flt_expr if expr is None else expr & flt_expr
+    return expr
+
+
+def polars_agg(agg: Agg):
+    """Aggregate as a polars expression."""
+    import polars as pl
+
+    if agg.column == "*":
+        return pl.count().alias(agg.alias)
+    column = pl.col(agg.column)
+    polars_exprs = {
+        "count": lambda: column.is_not_null().sum(),
+        "sum": column.sum,
+        "avg": column.mean,
+        "min": column.min,
+        "max": column.max,
+        "count_distinct": lambda: column.drop_nulls().n_unique(),
+        "null_count": column.null_count,
+    }
+    return polars_exprs[agg.func]().alias(agg.alias)
+
+
+def polars_query(spec: QuerySpec, lazy_frame):
+    """Run the query on a polars lazy frame."""
+    expr = polars_expression(spec.filters)
+    if expr is not None:
+        lazy_frame = lazy_frame.filter(expr)
+    if not spec.aggregates:
+        return lazy_frame.select(spec.columns)
+
+    aggs = [polars_agg(agg) for agg in spec.aggregates]
+    if spec.group_by:
+        return lazy_frame.groupby(spec.group_by).agg(aggs).sort(spec.group_by)
+    return lazy_frame.select(aggs)
+
+
+# datafusion
+
+
+def datafusion_expression(filters: List[Filter]):
+    """Filters as a datafusion expression or None without filters."""
+    from datafusion import col, literal
+
+    expr = None
+    for flt in filters:
+        column = col(flt.column)
+        if flt.op == "in":
+            flt_expr = None
+            for value in flt.value:
+                value_expr = column == literal(value)
+                flt_expr = (
+                    value_expr if flt_expr is None else flt_expr | value_expr
+                )
+        else:
+            ops = {
+                "=": column.__eq__,
+                "!=": column.__ne__,
+                "<": column.__lt__,
+                "<=": column.__le__,
+                ">": column.__gt__,
+                ">=": column.__ge__,
+            }
+            flt_expr = ops[flt.op](literal(flt.value))
+        expr = flt_expr if expr is None else expr & flt_expr
+    return expr
+
+
+def datafusion_agg(agg: Agg):
+    """
+    Aggregate as a datafusion expression.
+
+    count_distinct uses approx_distinct so results are approximate.
+    """
+    from datafusion import col, literal
+    from datafusion import functions as f
+
+    if agg.column == "*":
+        return f.count(literal(1)).alias(agg.alias)
+    if agg.func == "null_count":
+        null_count = f.count(literal(1)) - f.count(col(agg.column))
+        return null_count.alias(agg.alias)
+    datafusion_funcs = {
+        "count": f.count,
+        "sum": f.sum,
+        "avg": f.avg,
+        "min": f.min,
+        "max": f.max,
+        "count_distinct": f.approx_distinct,
+    }
+    return datafusion_funcs[agg.func](col(agg.column)).alias(agg.alias)
+
+
+def datafusion_query(spec: QuerySpec, df):
+    """Run the query on a datafusion dataframe."""
+    from datafusion import col
+
+    expr = datafusion_expression(spec.filters)
+    if expr is not None:
+        df = df.filter(expr)
+    if not spec.aggregates:
+        return df.select(*[col(name) for name in spec.columns])
+
+    return df.aggregate(
+        [col(name) for name in spec.group_by],
+        [datafusion_agg(agg) for agg in spec.aggregates],
+    )
@@ -0,0 +1,384 @@
+"""
+HyperLogLog sketches of parquet row groups for approximate distinct counts.
+
+A sidecar file under ~/.parq-cli/sketches holds one row per row group and
+group key with the number of rows and a HyperLogLog sketch of each sketched
+column. Distinct counts by any subset of the group keys are answered by
+merging the sketches (the maximum of each register) without reading the
+data pages. Each row group is identified by a fingerprint of its footer so
+rebuilding a sketch only scans row groups which are new or changed.
+"""
+import hashlib
+import json
+import math
+import os
+import pathlib
+
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import parq_aggregate
+import parq_footer
+
+from parq_query import QuerySpec, arrow_expression
+
+CACHE_DIR = pathlib.Path.home() / ".parq-cli" / "sketches"
+
+# 2**12 registers have a standard error of about 1.6%
+PRECISION = 12
+REGISTERS = 1 << PRECISION
+RANK_BITS = 64 - PRECISION
+
+
+class SketchInfo(NamedTuple):
+    path: pathlib.Path
+    keys: List[str]
+    columns: List[str]
+
+
+# the hash function is part of the sketch format
+HASH = "splitmix64-siphash"
+
+
+def mix64(bits: np.ndarray) -> np.ndarray:
+    """Splitmix64 finalizer of 64 bit integers."""
+    bits = bits + np.uint64(0x9E3779B97F4A7C15)
+    bits = (bits ^ (bits >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    bits = (bits ^ (bits >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return bits ^ (bits >> np.uint64(31))
+
+
+def hash64(values: Sequence) -> np.ndarray:
+    """Stable 64 bit hashes of the values of an array or sequence."""
+    if isinstance(values, pa.ChunkedArray):
+        arr = values.combine_chunks()
+    elif isinstance(values, pa.Array):
+        arr = values
+    else:
+        arr = pa.array(values)
+    if len(arr) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    arr_type = arr.type
+    if pa.types.is_floating(arr_type):
+        bits = arr.cast(pa.float64()).to_numpy().view(np.uint64)
+        return mix64(bits)
+    if (
+        pa.types.is_integer(arr_type)
+        or pa.types.is_temporal(arr_type)
+        or pa.types.is_boolean(arr_type)
+    ):
+        bits = arr.cast(pa.int64()).to_numpy().view(np.uint64)
+        return mix64(bits)
+    import pandas as pd
+
+    objects = arr.to_numpy(zero_copy_only=False)
+    return pd.util.hash_array(objects, categorize=False).astype(np.uint64)
+
+
+def group_registers(
+    hashes: np.ndarray, groups: np.ndarray, num_groups: int
+) -> np.ndarray:
+    """HyperLogLog registers of hashed values by group index."""
+    index = (hashes >> np.uint64(RANK_BITS)).astype(np.int64)
+    rest = hashes & np.uint64((1 << RANK_BITS) - 1)
+    # rest has at most 52 bits so it is exact as a double
+    bit_length = np.frexp(rest.astype(np.float64))[1]
+    rank = (RANK_BITS - bit_length + 1).astype(np.uint8)
+    regs = np.zeros((num_groups, REGISTERS), dtype=np.uint8)
+    np.maximum.at(regs, (groups, index), rank)
+    return regs
+
+
+def registers(hashes: np.ndarray) -> np.ndarray:
+    """HyperLogLog registers of hashed values."""
+    groups = np.zeros(len(hashes), dtype=np.int64)
+    return group_registers(hashes, groups, 1)[0]
+
+
+def estimate(regs: np.ndarray) -> float:
+    """Estimated number of distinct values of registers."""
+    alpha = 0.7213 / (1 + 1.079 / REGISTERS)
+    raw = alpha * REGISTERS**2 / np.sum(np.ldexp(1.0, -regs.astype(int)))
+    zeros = int(np.count_nonzero(regs == 0))
+    if raw <= 2.5 * REGISTERS and zeros:
+        # linear counting is more accurate for small cardinalities
+        return REGISTERS * math.log(REGISTERS / zeros)
+    return float(raw)
+
+
+def row_group_fingerprint(metadata, row_group: int) -> str:
+    """Identity of a row group from its footer entry."""
+    rg_meta = metadata.row_group(row_group)
+    parts = [rg_meta.num_rows, rg_meta.total_byte_size]
+    for col_idx in range(rg_meta.num_columns):
+        col_meta = rg_meta.column(col_idx)
+        parts += [col_meta.data_page_offset, col_meta.total_compressed_size]
+        if col_meta.is_stats_set and col_meta.statistics.has_min_max:
+            parts += [col_meta.statistics.min, col_meta.statistics.max]
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+
+
+def sketch_path(
+    parquet_file: str, keys: Sequence[str], columns: Sequence[str]
+) -> pathlib.Path:
+    """Sidecar file of a parquet file, group keys and sketched columns."""
+    path_key = parq_footer.fingerprint(parquet_file).split("-")[0]
+    layout = f"{','.join(keys)}:{','.join(columns)}"
+    layout_key = hashlib.sha1(layout.encode()).hexdigest()[:8]
+    return CACHE_DIR / f"{path_key}-{layout_key}.sketch.arrow"
+
+
+def sketch_schema(
+    arrow_schema: pa.Schema, keys: Sequence[str], columns: Sequence[str]
+) -> pa.Schema:
+    """Schema of a sketch table with its keys and columns as metadata."""
+    fields = [
+        pa.field("row_group", pa.int32()),
+        pa.field("rg_id", pa.string()),
+    ]
+    fields += [arrow_schema.field(key) for key in keys]
+    fields.append(pa.field("rows", pa.int64()))
+    fields += [pa.field(f"hll_{column}", pa.binary()) for column in columns]
+    metadata = {
+        "keys": json.dumps(list(keys)),
+        "columns": json.dumps(list(columns)),
+        "precision": str(PRECISION),
+        "hash": HASH,
+    }
+    return pa.schema(fields, metadata=metadata)
+
+
+def sketch_row_group(
+    tbl: pa.Table, keys: Sequence[str], columns: Sequence[str]
+) -> List[dict]:
+    """Rows and sketches of each group key of a row group."""
+    keys = list(keys)
+    counts = tbl.group_by(keys).aggregate([([], "count_all")])
+    groups: Dict[Tuple, dict] = {}
+    for row in counts.to_pylist():
+        key = tuple(row[name] for name in keys)
+        groups[key] = {name: row[name] for name in keys}
+        groups[key]["rows"] = row["count_all"]
+
+    for column in columns:
+        values = tbl.select(keys + [column]).filter(
+            pc.is_valid(tbl.column(column))
+        )
+        by_key = values.group_by(keys, use_threads=False).aggregate(
+            [(column, "distinct")]
+        )
+        distinct = by_key.column(f"{column}_distinct").combine_chunks()
+        hashes = hash64(pc.list_flatten(distinct))
+        parents = pc.list_parent_indices(distinct).to_numpy()
+        regs = group_registers(hashes, parents, by_key.num_rows)
+        key_columns = [by_key.column(name).to_pylist() for name in keys]
+        group_keys = zip(*key_columns) if keys else [()] * by_key.num_rows
+        for key, group_regs in zip(group_keys, regs):
+            groups[key][f"hll_{column}"] = group_regs.tobytes()
+        empty = np.zeros(REGISTERS, dtype=np.uint8).tobytes()
+        for group in groups.values():
+            group.setdefault(f"hll_{column}", empty)
+    return list(groups.values())
+
+
+def load(path: pathlib.Path) -> Optional[pa.Table]:
+    """Sketch table of a sidecar file or None when missing or unreadable."""
+    if not path.exists():
+        return None
+    try:
+        source = pa.memory_map(str(path))
+        return pa.ipc.open_file(source).read_all()
+    except (OSError, pa.ArrowInvalid):
+        return None
+
+
+def info(path: pathlib.Path, tbl: pa.Table) -> SketchInfo:
+    """Group keys and sketched columns of a sketch table."""
+    metadata = tbl.schema.metadata
+    return SketchInfo(
+        path,
+        json.loads(metadata[b"keys"]),
+        json.loads(metadata[b"columns"]),
+    )
+
+
+def build(
+    parquet_file: str,
+    columns: Sequence[str],
+    keys: Sequence[str] = (),
+    workers: int = 0,
+) -> Tuple[int, int]:
+    """
+    Build or update the sketches of columns by group keys.
+
+    Returns the number of row groups scanned and reused.
+    """
+    metadata = parq_footer.read_metadata(parquet_file)
+    path = sketch_path(parquet_file, keys, columns)
+    fingerprints = [
+        row_group_fingerprint(metadata, row_group)
+        for row_group in range(metadata.num_row_groups)
+    ]
+    schema = sketch_schema(
+        metadata.schema.to_arrow_schema(), keys, columns
+    )
+
+    old = load(path)
+    reused = []
+    reused_row_groups = set()
+    if old is not None and old.schema.equals(schema, check_metadata=True):
+        stale = set(stale_row_groups(metadata, old))
+        row_groups = old.column("row_group").to_pylist()
+        keep = [
+            row_group < metadata.num_row_groups and row_group not in stale
+            for row_group in row_groups
+        ]
+        reused = [old.filter(pa.array(keep, pa.bool_()))]
+        reused_row_groups = set(reused[0].column("row_group").to_pylist())
+    scan = [
+        row_group
+        for row_group in range(metadata.num_row_groups)
+        if row_group not in reused_row_groups
+    ]
+
+    sketches = parq_aggregate.map_row_groups(
+        parquet_file,
+        lambda tbl: sketch_row_group(tbl, keys, columns),
+        list(dict.fromkeys(list(keys) + list(columns))),
+        scan,
+        workers,
+        metadata,
+    )
+    rows = []
+    for row_group, groups in zip(scan, sketches):
+        for group in groups:
+            group["row_group"] = row_group
+            group["rg_id"] = fingerprints[row_group]
+            rows.append(group)
+    tables = reused + [pa.Table.from_pylist(rows, schema=schema)]
+    sketch = pa.concat_tables(tables).sort_by("row_group")
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with pa.OSFile(str(tmp_path), "wb") as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            writer.write_table(sketch)
+    os.replace(tmp_path, path)
+    return len(scan), len(reused_row_groups)
+
+
+def spec_columns(spec: QuerySpec) -> Tuple[List[str], List[str]]:
+    """Group keys and sketched columns needed to answer a spec."""
+    keys = list(spec.group_by)
+    for flt in spec.filters:
+        if flt.column not in keys:
+            keys.append(flt.column)
+    columns = []
+    for agg in spec.aggregates:
+        if agg.func == "count_distinct" and agg.column not in columns:
+            columns.append(agg.column)
+    return keys, columns
+
+
+def find(parquet_file: str, spec: QuerySpec) -> Optional[SketchInfo]:
+    """Sketch able to answer a spec or None."""
+    path_key = parq_footer.fingerprint(parquet_file).split("-")[0]
+    needed_keys = set(spec.group_by) | {flt.column for flt in spec.filters}
+    needed_columns = set()
+    for agg in spec.aggregates:
+        if agg.func == "count_distinct":
+            needed_columns.add(agg.column)
+        elif agg.func != "count" or agg.column != "*":
+            return None
+    candidates = []
+    for path in CACHE_DIR.glob(f"{path_key}-*.sketch.arrow"):
+        tbl = load(path)
+        if tbl is None:
+            continue
+        if tbl.schema.metadata.get(b"hash") != HASH.encode():
+            # sketches of an older hash function are rebuilt by build
+            continue
+        sketch_info = info(path, tbl)
+        if needed_keys <= set(sketch_info.keys) and needed_columns <= set(
+            sketch_info.columns
+        ):
+            candidates.append(sketch_info)
+    # fewer keys mean fewer sketches to merge
+    return min(candidates, key=lambda c: len(c.keys), default=None)
+
+
+def stale_row_groups(metadata, sketch: pa.Table) -> List[int]:
+    """Row groups of the file missing from or changed since the sketch."""
+    sketched = dict(
+        zip(
+            sketch.column("row_group").to_pylist(),
+            sketch.column("rg_id").to_pylist(),
+        )
+    )
+    return [
+        row_group
+        for row_group in range(metadata.num_row_groups)
+        if sketched.get(row_group)
+        != row_group_fingerprint(metadata, row_group)
+    ]
+
+
+def combine(sketches: Sequence[pa.Table], spec: QuerySpec) -> pa.Table:
+    """Sketch table of several files with the columns needed by a spec."""
+    keys, columns = spec_columns(spec)
+    names = keys + ["rows"] + [f"hll_{column}" for column in columns]
+    return pa.concat_tables(
+        sketch.select(names).replace_schema_metadata(None)
+        for sketch in sketches
+    )
+
+
+def query(sketch: pa.Table, spec: QuerySpec) -> pa.Table:
+    """Counts and approximate distinct counts from merged sketches."""
+    expr = arrow_expression(spec.filters)
+    if expr is not None:
+        sketch = sketch.filter(expr)
+    keys = list(spec.group_by)
+    merged: Dict[Tuple, dict] = {}
+    key_columns = [sketch.column(key).to_pylist() for key in keys]
+    rows = sketch.column("rows").to_pylist()
+    columns = {
+        agg.column: sketch.column(f"hll_{agg.column}").to_pylist()
+        for agg in spec.aggregates
+        if agg.func == "count_distinct"
+    }
+    group_keys = zip(*key_columns) if keys else [()] * len(rows)
+    for idx, key in enumerate(group_keys):
+        group = merged.setdefault(key, {"rows": 0})
+        group["rows"] += rows[idx]
+        for column, sketches in columns.items():
+            regs = np.frombuffer(sketches[idx], dtype=np.uint8)
+            if column in group:
+                regs = np.maximum(group[column], regs)
+            group[column] = regs
+    if not keys and not merged:
+        merged[()] = {"rows": 0}
+
+    result = {key: [] for key in keys}
+    for agg in spec.aggregates:
+        result[agg.alias] = []
+    for key, group in merged.items():
+        for name, value in zip(keys, key):
+            result[name].append(value)
+        for agg in spec.aggregates:
+            if agg.func == "count":
+                result[agg.alias].append(group["rows"])
+            elif agg.column in group:
+                result[agg.alias].append(round(estimate(group[agg.column])))
+            else:
+                result[agg.alias].append(0)
+    schema = sketch.schema
+    fields = [schema.field(key) for key in keys]
+    fields += [pa.field(agg.alias, pa.int64()) for agg in spec.aggregates]
+    tbl = pa.Table.from_pydict(result, schema=pa.schema(fields))
+    if not keys:
+        return tbl
+    return tbl.sort_by([(key, "ascending") for key in keys])
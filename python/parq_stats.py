@@ -0,0 +1,199 @@
+"""
+Use parquet footer statistics to answer questions about row groups.
+
+Filters are checked against the min/max and null counts of each row group.
+A row group matches NONE of its rows (skip it), ALL of its rows or SOME of
+them (read it) when the statistics are missing or inconclusive.
+"""
+from typing import List, NamedTuple, Optional
+
+import pyarrow as pa
+
+import parq_footer
+from parq_query import Filter
+
+NONE = "none"
+SOME = "some"
+ALL = "all"
+
+
+class ColumnStats(NamedTuple):
+    num_rows: int
+    min: object
+    max: object
+    null_count: Optional[int]
+
+
+def metadata_list(metadata) -> List:
+    """Footers of one file or of several files with the same schema."""
+    if isinstance(metadata, (list, tuple)):
+        return list(metadata)
+    return [metadata]
+
+
+def column_stats(
+    metadata, row_group: int, col_idx: int
+) -> Optional[ColumnStats]:
+    """Statistics of a column chunk or None when not set."""
+    rg_meta = metadata.row_group(row_group)
+    col_meta = rg_meta.column(col_idx)
+    if not col_meta.is_stats_set:
+        return None
+    stats = col_meta.statistics
+    null_count = stats.null_count if stats.has_null_count else None
+    if not stats.has_min_max:
+        return ColumnStats(rg_meta.num_rows, None, None, null_count)
+    return ColumnStats(rg_meta.num_rows, stats.min, stats.max, null_count)
+
+
+def compare_filter(flt: Filter, stats: ColumnStats) -> str:
+    """Whether NONE, SOME or ALL rows of a column chunk match a filter."""
+    if stats.null_count is not None and stats.null_count == stats.num_rows:
+        # null never matches a comparison
+        return NONE
+    if stats.min is None:
+        return SOME
+    no_nulls = stats.null_count == 0
+    lo, hi = stats.min, stats.max
+    value = flt.value
+    if flt.op == "in":
+        if all(val < lo or val > hi for val in value):
+            return NONE
+        if lo == hi and lo in value and no_nulls:
+            return ALL
+        return SOME
+
+    checks = {
+        "=": (value < lo or value > hi, lo == hi == value),
+        "!=": (lo == hi == value, value < lo or value > hi),
+        "<": (lo >= value, hi < value),
+        "<=": (lo > value, hi <= value),
+        ">": (hi <= value, lo > value),
+        ">=": (hi < value, lo >= value),
+    }
+    matches_none, matches_all = checks[flt.op]
+    if matches_none:
+        return NONE
+    if matches_all and no_nulls:
+        return ALL
+    return SOME
+
+
+def row_group_match(metadata, row_group: int, filters: List[Filter]) -> str:
+    """Whether NONE, SOME or ALL rows of a row group match the filters."""
+    names = metadata.schema.names
+    result = ALL
+    for flt in filters:
+        stats = column_stats(metadata, row_group, names.index(flt.column))
+        if stats is None:
+            result = SOME
+            continue
+        try:
+            match = compare_filter(flt, stats)
+        except TypeError:
+            # filter value cannot be compared with the statistics
+            match = SOME
+        if match == NONE:
+            return NONE
+        if match == SOME:
+            result = SOME
+    return result
+
+
+def row_group_matches(metadata, filters: List[Filter]) -> List[str]:
+    """Match of each row group against the filters."""
+    return [
+        row_group_match(metadata, row_group, filters)
+        for row_group in range(metadata.num_row_groups)
+    ]
+
+
+def matching_row_groups(metadata, filters: List[Filter]) -> List[int]:
+    """Row groups that cannot be skipped."""
+    matches = row_group_matches(metadata, filters)
+    return [idx for idx, match in enumerate(matches) if match != NONE]
+
+
+def pruning_summary(metadata, filters: List[Filter]) -> str:
+    """Number of row groups and rows of one or more files to be skipped."""
+    skipped_row_groups = total_row_groups = skipped_rows = total_rows = 0
+    for file_metadata in metadata_list(metadata):
+        matches = row_group_matches(file_metadata, filters)
+        skipped = [idx for idx, match in enumerate(matches) if match == NONE]
+        skipped_row_groups += len(skipped)
+        total_row_groups += len(matches)
+        skipped_rows += sum(
+            file_metadata.row_group(idx).num_rows for idx in skipped
+        )
+        total_rows += file_metadata.num_rows
+    return "Skipped {}/{} row groups ({:,}/{:,} rows)".format(
+        skipped_row_groups, total_row_groups, skipped_rows, total_rows
+    )
+
+
+def typed_extreme(values: pa.ChunkedArray, arrow_type, func: str) -> str:
+    """Min or max of statistics strings compared as the column type."""
+    import pyarrow.compute as pc
+
+    try:
+        values = values.cast(arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        # compared as strings
+        pass
+    extreme = getattr(pc, func)(values).as_py()
+    return None if extreme is None else parq_footer.stat_text(extreme)
+
+
+def summarize(stats: pa.Table, schema: pa.Schema) -> pa.Table:
+    """
+    One row per column of flattened statistics (see parq_footer).
+
+    Counts the row groups with and without statistics and sums nulls and
+    sizes over all row groups with arrow compute. Min and max are compared
+    as the column type.
+    """
+    import pyarrow.compute as pc
+
+    summary = stats.group_by("name", use_threads=False).aggregate(
+        [
+            ("column", "min"),
+            ("row_group", "count"),
+            ("is_stats_set", "sum"),
+            ("null_count", "sum"),
+            ("compressed_bytes", "sum"),
+            ("uncompressed_bytes", "sum"),
+            ("compression", "distinct"),
+            ("encodings", "distinct"),
+        ]
+    )
+    summary = summary.sort_by("column_min")
+    names = summary.column("name").to_pylist()
+    extremes = {"min": [], "max": []}
+    for name in names:
+        column_stats = stats.filter(pc.equal(stats.column("name"), name))
+        arrow_type = schema.field(name).type
+        for func in extremes:
+            extremes[func].append(
+                typed_extreme(column_stats.column(func), arrow_type, func)
+            )
+    missing = pc.subtract(
+        summary.column("row_group_count"), summary.column("is_stats_set_sum")
+    )
+    return pa.table(
+        {
+            "name": summary.column("name"),
+            "row_groups": summary.column("row_group_count"),
+            "missing_stats": missing,
+            "null_count": summary.column("null_count_sum"),
+            "min": pa.array(extremes["min"], pa.string()),
+            "max": pa.array(extremes["max"], pa.string()),
+            "compressed_bytes": summary.column("compressed_bytes_sum"),
+            "uncompressed_bytes": summary.column("uncompressed_bytes_sum"),
+            "compression": pc.binary_join(
+                summary.column("compression_distinct"), ","
+            ),
+            "encodings": pc.binary_join(
+                summary.column("encodings_distinct"), ";"
+            ),
+        }
+    )
@@ -0,0 +1,156 @@
+"""
+Compare query results of parq-cli engines.
+
+Results are normalized to arrow tables with the spec output column names
+and common types, sorted by the group keys, then compared column by column
+with a relative tolerance.
+"""
+from typing import Dict, List, NamedTuple, Optional, Set
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from parq_query import QuerySpec
+
+
+class Mismatch(NamedTuple):
+    column: str
+    row: int
+    expected: object
+    actual: object
+
+
+def normalize_type(arr: pa.ChunkedArray) -> pa.ChunkedArray:
+    """Decode dictionaries and widen numbers and strings to common types."""
+    if pa.types.is_dictionary(arr.type):
+        arr = arr.cast(arr.type.value_type)
+    if pa.types.is_integer(arr.type):
+        return arr.cast(pa.int64())
+    if pa.types.is_floating(arr.type) or pa.types.is_decimal(arr.type):
+        arr = arr.cast(pa.float64())
+        # NaN is used by pandas where SQL engines return null
+        return pc.if_else(pc.is_nan(arr), pa.scalar(None, pa.float64()), arr)
+    if pa.types.is_large_string(arr.type):
+        return arr.cast(pa.string())
+    return arr
+
+
+def to_arrow(result) -> pa.Table:
+    """Engine result (arrow, pandas or polars) as an arrow table."""
+    if isinstance(result, pa.Table):
+        return result
+    if hasattr(result, "to_arrow"):
+        return result.to_arrow()
+    return pa.Table.from_pandas(result, preserve_index=False)
+
+
+def normalize(result, spec: QuerySpec) -> pa.Table:
+    """Result with the spec column names and types sorted by group key."""
+    tbl = to_arrow(result)
+    names = spec.output_columns()
+    if tbl.num_columns != len(names):
+        raise ValueError(
+            "Expected columns {} got {}".format(names, tbl.column_names)
+        )
+    tbl = tbl.rename_columns(names)
+    tbl = pa.table(
+        [normalize_type(tbl.column(name)) for name in names], names=names
+    )
+    sort_keys = spec.group_by if spec.aggregates else names
+    if not sort_keys:
+        return tbl
+    return tbl.sort_by([(name, "ascending") for name in sort_keys])
+
+
+def column_matches(expected, actual, rtol: float) -> pa.ChunkedArray:
+    """Boolean array true where values are equal within tolerance."""
+    if pa.types.is_floating(expected.type) or (
+        rtol > 0 and pa.types.is_integer(expected.type)
+    ):
+        expected = expected.cast(pa.float64())
+        actual = actual.cast(pa.float64())
+        diff = pc.abs(pc.subtract(expected, actual))
+        tolerance = pc.multiply(pc.abs(expected), rtol)
+        matches = pc.less_equal(diff, tolerance)
+    else:
+        matches = pc.equal(expected, actual)
+    # null only matches null
+    both_null = pc.equal(pc.is_null(expected), pc.is_null(actual))
+    return pc.fill_null(matches, both_null)
+
+
+def compare(
+    expected: pa.Table,
+    actual: pa.Table,
+    rtol: float = 1e-9,
+    approx_columns: Set[str] = frozenset(),
+    approx_rtol: float = 0.05,
+    limit: int = 5,
+) -> List[Mismatch]:
+    """
+    List of mismatched values between normalized results.
+
+    approx_columns are compared with approx_rtol instead of rtol.
+    """
+    if expected.num_rows != actual.num_rows:
+        return [
+            Mismatch("<rows>", -1, expected.num_rows, actual.num_rows)
+        ]
+    if expected.num_rows == 0:
+        return []
+
+    mismatches = []
+    for name in expected.column_names:
+        col_rtol = approx_rtol if name in approx_columns else rtol
+        expected_col = expected.column(name)
+        actual_col = actual.column(name)
+        if expected_col.type != actual_col.type and not (
+            pa.types.is_integer(expected_col.type)
+            or pa.types.is_floating(expected_col.type)
+        ):
+            return [Mismatch(name, -1, expected_col.type, actual_col.type)]
+        matches = column_matches(expected_col, actual_col, col_rtol)
+        bad_rows = pc.indices_nonzero(pc.invert(matches)).to_pylist()
+        for row in bad_rows[:limit]:
+            mismatches.append(
+                Mismatch(
+                    name,
+                    row,
+                    expected_col[row].as_py(),
+                    actual_col[row].as_py(),
+                )
+            )
+    return mismatches
+
+
+def approx_columns(spec: QuerySpec, approx_funcs: Set[str]) -> Set[str]:
+    """Output columns of aggregates an engine only approximates."""
+    return {agg.alias for agg in spec.aggregates if agg.func in approx_funcs}
+
+
+def print_report(
+    reference: str,
+    mismatches_by_engine: Dict[str, List[Mismatch]],
+    failures: Optional[Dict[str, str]] = None,
+):
+    """
+    Print verification status of each engine against the reference.
+
+    failures are the errors of engines which did not return a result.
+    """
+    for engine, error in (failures or {}).items():
+        print(f"{engine:<28s}FAILED {error}")
+    for engine, mismatches in mismatches_by_engine.items():
+        status = "OK" if not mismatches else "MISMATCH"
+        print(f"{engine:<28s}{status} (reference {reference})")
+        for mismatch in mismatches:
+            if mismatch.column == "<rows>":
+                print(
+                    f"    rows: expected {mismatch.expected} "
+                    f"got {mismatch.actual}"
+                )
+            else:
+                print(
+                    f"    {mismatch.column} row {mismatch.row}: "
+                    f"expected {mismatch.expected!r} got {mismatch.actual!r}"
+                )
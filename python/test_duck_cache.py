@@ -1,8 +1,370 @@
+import concurrent.futures
+import threading
+
 import duck_cache as dc
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pytest
 
 
 def test_equal_df():
     df1 = pd.DataFrame([[1, 2], [4, 4]], columns=[list("ab")])
     df2 = pd.DataFrame([[1, 2], [4, 4]], columns=[list("ab")])
     assert df1.equals(df2)
+
+
+def test_put_get():
+    conn = dc.connect()
+    df = pd.DataFrame({'name': list('aab'), 'value': range(3)})
+    assert dc.get(conn, 'missing') is None
+    assert dc.put(conn, 'frame', df) == []
+    assert dc.get(conn, 'frame').equals(df)
+    assert dc.cache_bytes(conn) == dc.df_bytes(df)
+
+    # same content is not written again
+    table_name = dc.entries(conn).table_name[0]
+    dc.put(conn, 'frame', df.copy(), hash_content=True)
+    dc.put(conn, 'frame', df.copy(), hash_content=True)
+    assert dc.entries(conn).table_name[0] != table_name
+    table_name = dc.entries(conn).table_name[0]
+    dc.put(conn, 'frame', df.copy(), hash_content=True)
+    assert dc.entries(conn).table_name[0] == table_name
+    assert dc.df_hash(df) != dc.df_hash(df.assign(value=[0, 1, 3]))
+
+    assert dc.delete(conn, 'frame')
+    assert dc.get(conn, 'frame') is None
+    assert not dc.has_table(conn, table_name)
+
+
+def test_evict_least_recently_used():
+    conn = dc.connect()
+    df = pd.DataFrame({'value': range(100)})
+    size = dc.df_bytes(df)
+    for key in 'abc':
+        dc.put(conn, key, df)
+    dc.get(conn, 'a')
+    assert dc.put(conn, 'd', df, max_bytes=3 * size) == ['b']
+    assert dc.put(conn, 'e', df, max_entries=2) == ['c', 'a']
+    assert list(dc.entries(conn).key) == ['d', 'e']
+
+
+def test_persistent_cache(tmp_path):
+    database = str(tmp_path / 'cache.duckdb')
+    df = pd.DataFrame({'value': range(10)})
+    conn = dc.connect(database)
+    dc.put(conn, 'frame', df)
+    conn.close()
+    assert dc.get(dc.connect(database), 'frame').equals(df)
+
+
+def test_zero_copy_view():
+    conn = dc.connect()
+    df = pd.DataFrame({'value': range(10)})
+    dc.save_df(conn, df, 'frame', zero_copy=True)
+    assert dc.is_view(conn, 'frame')
+    for _ in range(dc.PROMOTE_AFTER - 1):
+        assert dc.get_df(conn, 'frame').equals(df)
+    assert dc.is_view(conn, 'frame')
+    assert dc.get_df(conn, 'frame').equals(df)
+    assert not dc.is_view(conn, 'frame')
+    dc.drop_df(conn, 'frame')
+    assert not dc.has_table(conn, 'frame')
+
+
+def test_release_zero_copy():
+    conn = dc.connect()
+    df = pd.DataFrame({'value': range(10)})
+    dc.put(conn, 'frame', df, zero_copy=True)
+    table_name = dc.entries(conn).table_name[0]
+    assert dc.release_df(conn, table_name)
+    assert not dc.release_df(conn, table_name)
+    del df
+    assert list(dc.get(conn, 'frame').value) == list(range(10))
+
+    arrow_df = pa.table({'value': range(5)})
+    dc.put(conn, 'arrow', arrow_df, zero_copy=True)
+    assert dc.delete(conn, 'arrow')
+    dc.save_df(conn, arrow_df, 'arrow', zero_copy=True)
+    dc.release_df(conn, 'arrow')
+    assert dc.has_table(conn, 'arrow')
+
+
+def test_chunked_save_and_batches():
+    conn = dc.connect()
+    df = pd.DataFrame({'name': list('abcdefghij'), 'value': range(10)})
+    progress = []
+    dc.save_df(conn, (df[i:i + 4] for i in range(0, 10, 4)), 'frames',
+               progress=lambda chunks, rows: progress.append((chunks, rows)))
+    assert progress == [(1, 4), (2, 8), (3, 10)]
+    batches = list(dc.get_batches(conn, 'frames', batch_size=3))
+    assert [len(batch) for batch in batches] == [3, 3, 3, 1]
+    assert pd.concat(batches, ignore_index=True).equals(df)
+
+    record_batches = pa.Table.from_pandas(df).to_batches(max_chunksize=5)
+    dc.put(conn, 'batches', iter(record_batches))
+    entry = dc.entries(conn).iloc[0]
+    assert entry['rows'] == 10
+    assert entry['bytes'] == sum(batch.nbytes for batch in record_batches)
+    assert dc.get(conn, 'batches').equals(df)
+    arrow_batches = dc.get_batches(conn, 'frames', arrow=True)
+    assert pa.Table.from_batches(arrow_batches).num_rows == 10
+
+
+def test_chunked_save_failure():
+    conn = dc.connect()
+
+    def chunks():
+        yield pd.DataFrame({'value': range(3)})
+        raise RuntimeError('source failed')
+
+    with pytest.raises(RuntimeError):
+        dc.save_df(conn, chunks(), 'partial')
+    assert not dc.has_table(conn, 'partial')
+    with pytest.raises(ValueError):
+        dc.save_df(conn, iter([]), 'empty')
+
+
+def test_put_failure_keeps_entry():
+    conn = dc.connect()
+    df = pd.DataFrame({'value': range(3)})
+    dc.put(conn, 'key', df)
+    tables = dc.list_tables(conn)
+
+    def chunks():
+        yield pd.DataFrame({'value': range(5)})
+        raise RuntimeError('source failed')
+
+    with pytest.raises(RuntimeError):
+        dc.put(conn, 'key', chunks())
+    assert dc.get(conn, 'key').equals(df)
+    assert dc.list_tables(conn) == tables
+
+    # the old table is dropped once replaced, views count their full size
+    view = pd.DataFrame({'value': range(4)})
+    dc.put(conn, 'key', view, zero_copy=True)
+    assert dc.get(conn, 'key').equals(view)
+    old_tables = set(tables) - {dc.ENTRIES_TABLE}
+    assert not old_tables & set(dc.list_tables(conn))
+    assert dc.cache_bytes(conn) == dc.df_bytes(view)
+    dc.put(conn, 'key', df)
+    assert dc.get(conn, 'key').equals(df)
+    assert len(dc.entries(conn)) == 1
+
+
+def test_read_write_lock():
+    lock = dc.ReadWriteLock()
+    readers = threading.Barrier(2, timeout=5)
+
+    def read():
+        with lock.read():
+            # both readers hold the lock at once
+            readers.wait()
+
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        list(executor.map(lambda _: read(), range(2)))
+    # a reader waits for the writer
+    order = []
+
+    def read_after_write():
+        with lock.read():
+            order.append('read')
+
+    with lock.write():
+        reader = threading.Thread(target=read_after_write)
+        reader.start()
+        reader.join(0.1)
+        order.append('write')
+    reader.join()
+    assert order == ['write', 'read']
+
+
+def test_cache_threads(tmp_path):
+    cache = dc.Cache(str(tmp_path / 'cache.duckdb'), max_entries=8)
+    frames = {f'key{i}': pd.DataFrame({'value': range(i, i + 100)})
+              for i in range(16)}
+
+    def put_get(key):
+        cache.put(key, frames[key])
+        df = cache.get(key)
+        return df is None or df.equals(frames[key])
+
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        assert all(executor.map(put_get, frames))
+    assert len(cache.entries()) == 8
+    keys = list(cache.entries().key)
+
+    def read(key):
+        batches = cache.get_batches(key, batch_size=30)
+        return pd.concat(batches, ignore_index=True).equals(frames[key])
+
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        assert all(executor.map(read, keys * 4))
+    assert cache.delete(keys[0])
+    assert cache.get(keys[0]) is None
+    cache.close()
+
+
+def test_cached():
+    conn = dc.connect()
+    calls = []
+
+    @dc.cached(conn)
+    def group_sum(df, column='name'):
+        calls.append(column)
+        return df.groupby(column, as_index=False).sum()
+
+    df = pd.DataFrame({'name': list('aab'), 'value': range(3)})
+    expected = group_sum(df)
+    assert group_sum(df.copy()).equals(expected)
+    assert group_sum(df, column='name').equals(expected)
+    group_sum(df.assign(value=[5, 6, 7]))
+    assert calls == ['name', 'name']
+    assert group_sum.stats['hits'] == 2
+    assert group_sum.stats['misses'] == 2
+    assert len(dc.entries(conn)) == 2
+
+    # a new version of the function drops the entries of the old one
+    stale_key = next(key for key in dc.entries(conn).key
+                     if dc.get(conn, key).equals(expected))
+    prefix, _, args_hash = stale_key.rsplit(':', 2)
+    conn.execute(
+        f'update {dc.ENTRIES_TABLE} set key = ? where key = ?',
+        [f'{prefix}:oldversion:{args_hash}', stale_key])
+
+    @dc.cached(conn)
+    def group_sum(df, column='name'):
+        calls.append(column)
+        return df.groupby(column, as_index=False).sum()
+
+    assert group_sum(df).equals(expected)
+    assert group_sum.stats['misses'] == 1
+    assert len(dc.entries(conn)) == 2
+
+
+def test_cached_shared_cache():
+    cache = dc.Cache()
+
+    @dc.cached(cache)
+    def square(n):
+        return pd.DataFrame({'value': [n * n]})
+
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(square, [2, 3] * 8))
+    assert [df.value[0] for df in results] == [4, 9] * 8
+    assert square.stats['hits'] + square.stats['misses'] == 16
+    assert len(cache.entries()) == 2
+
+
+def test_batches_while_using_connection():
+    conn = dc.connect()
+    df = pd.DataFrame({'value': range(1000)})
+    dc.save_df(conn, df, 'src')
+    dc.save_df(conn, df.head(3), 'other')
+    batches = []
+    for batch in dc.get_batches(conn, 'src', batch_size=100):
+        assert len(dc.get_df(conn, 'other')) == 3
+        batches.append(batch)
+    assert pd.concat(batches, ignore_index=True).equals(df)
+
+    # chunked round trip on one connection
+    dc.save_df(conn, (batch.assign(double=batch.value * 2)
+                      for batch in dc.get_batches(conn, 'src', 100)), 'dst')
+    assert len(dc.get_df(conn, 'dst')) == 1000
+
+    dc.save_df(conn, df, 'view', zero_copy=True)
+    batches = dc.get_batches(conn, 'view', batch_size=300)
+    assert sum(len(batch) for batch in batches) == 1000
+
+
+def test_save_record_batch_reader():
+    conn = dc.connect()
+    tbl = pa.table({'value': range(10)})
+
+    def reader():
+        return pa.RecordBatchReader.from_batches(
+            tbl.schema, tbl.to_batches(max_chunksize=4))
+
+    dc.put(conn, 'reader', reader())
+    assert dc.entries(conn).rows[0] == 10
+    assert len(dc.get(conn, 'reader')) == 10
+    assert len(dc.list_tables(conn)) == 2
+    with pytest.raises(ValueError):
+        dc.save_df(conn, reader(), 'view', zero_copy=True)
+    assert not dc.has_table(conn, 'view')
+
+
+def test_cache_put_while_reading_batches():
+    cache = dc.Cache()
+    df = pd.DataFrame({'value': range(100_000)})
+    cache.put('frame', df)
+    batches = cache.get_batches('frame', batch_size=10_000)
+    rows = len(next(batches))
+    # writers do not wait for the reader to finish
+    cache.put('frame', df.head(10))
+    cache.put('other', df.head(10))
+    rows += sum(len(batch) for batch in batches)
+    assert rows == 100_000
+    assert len(cache.get('frame')) == 10
+
+    abandoned = cache.get_batches('other', batch_size=3)
+    next(abandoned)
+    assert cache.delete('other')
+
+
+def test_cached_argument_keys():
+    conn = dc.connect()
+
+    @dc.cached(conn)
+    def total(values):
+        return pd.DataFrame({'total': [np.asarray(values).sum()]})
+
+    @dc.cached(conn)
+    def concat(frames):
+        return pd.concat(frames)
+
+    # the reprs of large arrays are truncated to the same text
+    a = np.arange(10_000)
+    b = a.copy()
+    b[5000] = 0
+    assert repr(a) == repr(b)
+    assert total(a).total[0] == a.sum()
+    assert total(b).total[0] == b.sum()
+    assert total(a.astype('int32')).total[0] == a.sum()
+    assert total.stats['misses'] == 3
+    assert total(b.copy()).total[0] == b.sum()
+    assert total.stats['hits'] == 1
+
+    d1 = pd.DataFrame({'value': range(1000)})
+    d2 = d1.assign(value=d1.value + 1)
+    assert concat([d1]).equals(d1)
+    assert concat([d2]).equals(d2)
+    assert concat({'frame': d2}).value.sum() == d2.value.sum()
+    assert concat([d1.copy()]).equals(d1)
+    assert concat.stats['misses'] == 3
+    assert concat.stats['hits'] == 1
+
+    class Opaque:
+        pass
+
+    calls = []
+
+    @dc.cached(conn)
+    def first(obj):
+        calls.append(obj)
+        return pd.DataFrame({'value': [1]})
+
+    # an address or a truncated repr does not identify the content
+    opaque = [Opaque()]
+    first(opaque)
+    first(opaque)
+    first(pd.Index(np.arange(2000)))
+    assert len(calls) == 3
+    # strings are keyed by their content whatever they contain
+    first('to be continued...')
+    first('to be continued...')
+    first(('at 0x1', b'...'))
+    first(('at 0x1', b'...'))
+    assert len(calls) == 5
+    assert first.stats['hits'] == 2
+    assert first.stats['uncached'] == 3
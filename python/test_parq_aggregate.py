@@ -0,0 +1,124 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import parq_aggregate as pa_agg
+import parq_footer
+import parq_query as pqy
+import parq_verify as pv
+
+
+@pytest.fixture(autouse=True)
+def footer_cache(tmp_path, monkeypatch):
+    """Keep the footers of the test files out of the home directory."""
+    monkeypatch.setattr(parq_footer, "CACHE_DIR", tmp_path / "footers")
+
+
+def example_table():
+    return pa.table({
+        "Year": [2000, 2000, 2001, 2001, 2001, None],
+        "Carrier": ["AA", "UA", "AA", "AA", None, "DL"],
+        "DepDelay": [1.0, 3.0, None, 5.0, 7.0, 2.0],
+    })
+
+
+SPECS = [
+    pqy.build_spec(),
+    pqy.build_spec(
+        group_by="Carrier",
+        agg="count(*),count(DepDelay),avg(DepDelay),min(Year),max(Year),"
+            "sum(DepDelay),count_distinct(Year)",
+        where="DepDelay > 1"),
+    pqy.build_spec(group_by="", agg="count_distinct(Carrier),avg(DepDelay)"),
+]
+
+
+def test_merge_of_chunks_matches_single_query():
+    tbl = example_table()
+    for spec in SPECS:
+        partials = [
+            pa_agg.partial_aggregate(spec, tbl.slice(offset, 2))
+            for offset in range(0, tbl.num_rows, 2)]
+        merged = pa_agg.fold(spec, partials, merge_every=2)
+        result = pv.normalize(pa_agg.finalize(spec, merged), spec)
+        expected = pv.normalize(pqy.arrow_query(spec, tbl), spec)
+        assert pv.compare(expected, result) == []
+
+
+def test_scan_row_groups(tmp_path):
+    parquet_file = str(tmp_path / "example.parquet")
+    pq.write_table(example_table(), parquet_file, row_group_size=2)
+    for spec in SPECS:
+        result = pa_agg.scan_row_groups(parquet_file, spec, workers=2)
+        expected = pqy.arrow_query(spec, example_table())
+        assert pv.compare(
+            pv.normalize(expected, spec), pv.normalize(result, spec)) == []
+
+
+def test_stats_fast_path(tmp_path):
+    parquet_file = str(tmp_path / "example.parquet")
+    tbl = pa.table({
+        "Year": [2000, 2000, 2001, 2001, 2001, 2002],
+        "Carrier": ["AA", "UA", "AA", None, "AA", "DL"],
+    })
+    pq.write_table(tbl, parquet_file, row_group_size=2)
+    metadata = pq.read_metadata(parquet_file)
+    spec = pqy.build_spec(
+        agg="count(*),null_count(Carrier),min(Carrier),max(Carrier)",
+        where="Year >= 2001")
+    plan = pa_agg.plan_row_groups(metadata, spec)
+    assert plan == pa_agg.ScanPlan([0], [1], [2])
+    result = pa_agg.scan_row_groups(
+        parquet_file, spec, plan.scanned, metadata=metadata,
+        stats_row_groups=plan.from_stats)
+    expected = pqy.arrow_query(spec, tbl)
+    assert pv.compare(
+        pv.normalize(expected, spec), pv.normalize(result, spec)) == []
+
+
+def test_stream_row_groups(tmp_path):
+    parquet_file = str(tmp_path / "example.parquet")
+    pq.write_table(example_table(), parquet_file, row_group_size=4)
+    for spec in SPECS:
+        # a budget smaller than the partials merges after every batch
+        result = pa_agg.stream_row_groups(
+            parquet_file, spec, memory_budget=1, batch_size=2)
+        expected = pqy.arrow_query(spec, example_table())
+        assert pv.compare(
+            pv.normalize(expected, spec), pv.normalize(result, spec)) == []
+
+
+def test_scan_and_stream_files(tmp_path):
+    tbl = example_table()
+    files = [str(tmp_path / f"part{idx}.parquet") for idx in range(2)]
+    pq.write_table(tbl.slice(0, 3), files[0], row_group_size=2)
+    pq.write_table(tbl.slice(3), files[1], row_group_size=2)
+    metadatas = [pq.read_metadata(parquet_file) for parquet_file in files]
+    for spec in SPECS:
+        plans = [
+            pa_agg.plan_row_groups(metadata, spec)
+            for metadata in metadatas]
+        expected = pv.normalize(pqy.arrow_query(spec, tbl), spec)
+        scanned = pa_agg.scan_files(files, spec, metadatas, plans, workers=2)
+        streamed = pa_agg.stream_files(
+            files, spec, metadatas, plans, batch_size=1)
+        assert pv.compare(expected, pv.normalize(scanned, spec)) == []
+        assert pv.compare(expected, pv.normalize(streamed, spec)) == []
+
+
+def test_map_row_groups_window(tmp_path):
+    parquet_file = str(tmp_path / "example.parquet")
+    pq.write_table(pa.table({"Year": list(range(40))}), parquet_file,
+                   row_group_size=1)
+    started = []
+
+    def first_year(tbl):
+        started.append(tbl["Year"][0].as_py())
+        return tbl["Year"][0].as_py()
+
+    results = pa_agg.map_row_groups(parquet_file, first_year, ["Year"],
+                                    workers=2)
+    assert [next(results) for _ in range(3)] == [0, 1, 2]
+    # row groups are submitted as results are taken, not all at once
+    assert len(started) <= 5
+    assert list(results) == list(range(3, 40))
@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+import parq_bench as pb
+
+
+def test_percentile():
+    values = [4.0, 1.0, 3.0, 2.0, 5.0]
+    assert pb.percentile(values, 0) == 1.0
+    assert pb.percentile(values, 50) == 3.0
+    assert pb.percentile(values, 100) == 5.0
+    assert pb.percentile(values, 95) == 4.8
+
+
+def test_time_runs_warmup():
+    calls = []
+    timings = pb.time_runs(lambda: calls.append(1), runs=3, warmup=2)
+    assert len(calls) == 5
+    assert len(timings) == 3
+
+
+def test_summarize_single_run():
+    stats = pb.summarize("engine", [0.5])
+    assert stats.min == stats.median == stats.p95 == 0.5
+    assert stats.stddev == 0.0
+
+
+def test_output_format():
+    assert pb.output_format("csv") == ("csv", None)
+    assert pb.output_format("bench.JSON") == ("json", "bench.JSON")
+    with pytest.raises(SystemExit):
+        pb.output_format("bench.txt")
+
+
+def test_write_results_stdout(capsys):
+    stats = pb.summarize("engine", [0.5, 1.5])
+    pb.write_results("json", {"host": "h"}, [stats])
+    results = json.loads(capsys.readouterr().out)
+    assert results["results"][0]["median"] == 1.0
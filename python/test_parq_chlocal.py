@@ -0,0 +1,88 @@
+import pathlib
+import stat
+import sys
+import time
+
+import pytest
+
+import parq_chlocal
+
+FAKE = pathlib.Path(__file__).parent / "fake-clickhouse-local.py"
+
+
+@pytest.fixture
+def executable(tmp_path):
+    """The stand-in for clickhouse-local run by this python."""
+    path = tmp_path / "clickhouse-local"
+    path.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE}" "$@"\n')
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def test_worker_query(executable):
+    worker = parq_chlocal.Worker(executable)
+    try:
+        assert worker.version == "0.0.0-fake"
+        sql = "SELECT Year, count() FROM file('a.parquet') GROUP BY Year"
+        result = worker.query(sql)
+        assert result.column("query").to_pylist() == [sql]
+        # one statement per line
+        assert worker.query("SELECT 1\nFROM t").column("query")[0].as_py() == (
+            "SELECT 1 FROM t"
+        )
+        start = time.perf_counter()
+        with pytest.raises(parq_chlocal.WorkerError, match="Syntax error"):
+            worker.query("SELECT bad")
+        # the error line ends the wait, not the timeout
+        assert time.perf_counter() - start < parq_chlocal.ERROR_WAIT / 2
+        assert worker.query("SELECT 2").num_rows == 1
+        assert not list(worker.result_dir.iterdir())
+    finally:
+        worker.close()
+    assert not worker.alive()
+    assert not worker.result_dir.exists()
+
+
+def test_pool_restarts_crashed_worker(executable):
+    with parq_chlocal.WorkerPool(2, executable) as pool:
+        assert len(pool.workers) == 2
+        pids = {
+            pool.query(f"SELECT {n}").column("pid")[0].as_py()
+            for n in range(4)
+        }
+        assert pids == {worker.process.pid for worker in pool.workers}
+
+        with pytest.raises(parq_chlocal.WorkerError, match="exited"):
+            pool.query("SELECT crash")
+        for n in range(4):
+            assert pool.query(f"SELECT {n}").num_rows == 1
+        assert len(pool.workers) == 2
+        assert all(worker.alive() for worker in pool.workers)
+        workers = list(pool.workers)
+    assert not any(worker.alive() for worker in workers)
+
+
+def test_pool_start_failure_stops_workers(executable, monkeypatch):
+    started = []
+
+    class FailingWorker(parq_chlocal.Worker):
+        def query(self, sql):
+            if sql == "SELECT version()":
+                started.append(self)
+                if len(started) == 2:
+                    raise parq_chlocal.WorkerError("cannot start")
+            return super().query(sql)
+
+    monkeypatch.setattr(parq_chlocal, "Worker", FailingWorker)
+    with pytest.raises(parq_chlocal.WorkerError, match="cannot start"):
+        parq_chlocal.WorkerPool(3, executable)
+    assert len(started) == 3
+    assert not any(worker.alive() for worker in started)
+
+
+def test_worker_start_failure(tmp_path):
+    path = tmp_path / "clickhouse-local"
+    path.write_text("#!/bin/sh\nexit 1\n")
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    with pytest.raises(parq_chlocal.WorkerError):
+        parq_chlocal.Worker(str(path))
@@ -0,0 +1,63 @@
+import importlib.util
+import pathlib
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import parq_derived
+import parq_footer
+import parq_query as pqy
+import parq_verify as pv
+
+CLI_PATH = pathlib.Path(__file__).parent / "parq-cli.py"
+
+
+@pytest.fixture(scope="module")
+def cli():
+    spec = importlib.util.spec_from_file_location("parq_cli", CLI_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def parquet_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(parq_derived, "CACHE_DIR", tmp_path / "derived")
+    monkeypatch.setattr(parq_footer, "CACHE_DIR", tmp_path / "footers")
+    files = []
+    for year in (2000, 2001):
+        parquet_file = str(tmp_path / f"{year}.parquet")
+        pq.write_table(
+            pa.table({
+                "Year": [year] * 4,
+                "Carrier": ["AA", "UA", None, "AA"],
+                "DepDelay": [1.0, None, 3.0, 4.0 + year],
+            }),
+            parquet_file,
+            row_group_size=2,
+        )
+        files.append(parquet_file)
+    return files
+
+
+def test_arrow_ipc_mmap_matches_arrow_parquet(cli, parquet_files, capsys):
+    spec = pqy.build_spec(
+        group_by="Year,Carrier",
+        agg="count(*),sum(DepDelay),count_distinct(Carrier)",
+        where="DepDelay > 2",
+    )
+    expected = pv.normalize(
+        cli.arrow_parquet_engine(parquet_files, spec)(), spec)
+    query = cli.arrow_ipc_mmap_engine(parquet_files, spec)
+    assert "Query column buffers are" in capsys.readouterr().out
+    assert pv.compare(expected, pv.normalize(query(), spec)) == []
+
+
+def test_invalid_query_column(cli, parquet_files):
+    cli.check_query_columns(parquet_files, pqy.build_spec(where="Year = 1"))
+    for options in ({"where": "Foo = 1"}, {"group_by": "Foo"},
+                    {"agg": "sum(Foo)"}):
+        with pytest.raises(SystemExit, match="Invalid column Foo"):
+            cli.check_query_columns(
+                parquet_files, pqy.build_spec(**options))
@@ -0,0 +1,61 @@
+import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import parq_clickhouse
+
+
+def test_clickhouse_types(tmp_path):
+    parquet_file = str(tmp_path / "example.parquet")
+    tbl = pa.table({
+        "Year": pa.array([1987, 2008, 2000], pa.int64()),
+        "Delta": pa.array([-5, 3, None], pa.int16()),
+        "Day": pa.array([datetime.date(2000, 1, 1)] * 3),
+        "Carrier": ["AA", "UA", "AA"],
+        "TailNum": ["N1", "N2", "N3"],
+        "Price": pa.array([1.5, 2.5, 3.5], pa.float32()),
+    })
+    pq.write_table(
+        tbl, parquet_file, row_group_size=2,
+        use_dictionary=["Carrier"])
+    metadata = pq.read_metadata(parquet_file)
+    assert dict(parq_clickhouse.clickhouse_types(metadata)) == {
+        "Year": "UInt16",
+        "Delta": "Nullable(Int8)",
+        "Day": "Date",
+        "Carrier": "LowCardinality(String)",
+        "TailNum": "String",
+        "Price": "Float32",
+    }
+
+
+def test_types_without_statistics(tmp_path):
+    parquet_file = str(tmp_path / "example.parquet")
+    tbl = pa.table({
+        "Delta": pa.array([-5, 3], pa.int16()),
+        "At": pa.array([0, 1], pa.timestamp("ms")),
+    })
+    pq.write_table(tbl, parquet_file, write_statistics=False)
+    metadata = pq.read_metadata(parquet_file)
+    assert parq_clickhouse.structure(metadata) == (
+        "Delta Nullable(Int16), At Nullable(DateTime64(3))")
+
+
+def test_low_cardinality_compressed(tmp_path):
+    # compressed dictionary pages are smaller than the plain dictionary
+    values = [f"N{value:05d}XY" for value in range(20000)]
+    rows = [values[(i * 7919) % len(values)] for i in range(100000)]
+    small = [values[i % 300] for i in range(100000)]
+    for compression in ("none", "snappy", "zstd"):
+        parquet_file = str(tmp_path / f"{compression}.parquet")
+        pq.write_table(
+            pa.table({"TailNum": rows, "Carrier": small}), parquet_file,
+            compression=compression)
+        metadata = pq.read_metadata(parquet_file)
+        entries = parq_clickhouse.dictionary_entries(metadata, 0, 8)
+        assert 18000 < entries < 22000
+        assert dict(parq_clickhouse.clickhouse_types(metadata)) == {
+            "TailNum": "String",
+            "Carrier": "LowCardinality(String)",
+        }
@@ -0,0 +1,81 @@
+import os
+
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+import parq_derived
+
+
+def write_example(parquet_file, years):
+    tbl = pa.table({"Year": years, "Carrier": ["AA"] * len(years)})
+    pq.write_table(tbl, parquet_file)
+
+
+def test_derived_copies(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "derived"
+    monkeypatch.setattr(parq_derived, "CACHE_DIR", cache_dir)
+    parquet_file = str(tmp_path / "example.parquet")
+    write_example(parquet_file, [2000, 2001, 2001])
+
+    derived = parq_derived.derived_copy(parquet_file, "feather")
+    assert derived.convert_time > 0
+    assert feather.read_table(derived.path).num_rows == 3
+    assert parq_derived.derived_copy(parquet_file, "feather") == (
+        derived._replace(convert_time=0.0))
+
+    # a different layout is a different entry
+    partitioned = parq_derived.derived_copy(
+        parquet_file, "partitioned", partition_cols=["Year"])
+    assert sorted(path.name for path in partitioned.path.iterdir()) == [
+        "Year=2000", "Year=2001"]
+    assert len(parq_derived.entries()) == 2
+
+    # a changed file replaces the stale copies
+    write_example(parquet_file, [2002])
+    os.utime(parquet_file, ns=(1, 1))
+    derived = parq_derived.derived_copy(parquet_file, "feather")
+    assert feather.read_table(derived.path).num_rows == 1
+    assert [entry.path for entry in parq_derived.entries()] == [derived.path]
+
+
+def test_evict_least_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(parq_derived, "CACHE_DIR", tmp_path / "derived")
+    parquet_file = str(tmp_path / "example.parquet")
+    write_example(parquet_file, list(range(1000)))
+
+    first = parq_derived.derived_copy(parquet_file, "feather", codec="lz4")
+    os.utime(first.path, (1, 1))
+    second = parq_derived.derived_copy(
+        parquet_file, "feather", codec="uncompressed", budget_mb=0)
+    assert [entry.path for entry in parq_derived.entries()] == [second.path]
+
+
+def test_copies_of_several_files_evicted_together(tmp_path, monkeypatch):
+    monkeypatch.setattr(parq_derived, "CACHE_DIR", tmp_path / "derived")
+    files = [str(tmp_path / f"part{idx}.parquet") for idx in range(4)]
+    for idx, parquet_file in enumerate(files):
+        write_example(parquet_file, list(range(idx * 100, idx * 100 + 500)))
+
+    copies = parq_derived.derived_copies(files, "feather", budget_mb=0)
+    assert all(derived.path.exists() for derived in copies)
+    assert {entry.path for entry in parq_derived.entries()} == {
+        derived.path for derived in copies}
+    # the next batch evicts the copies it does not use
+    copies = parq_derived.derived_copies(files[:1], "feather", budget_mb=0)
+    assert [entry.path for entry in parq_derived.entries()] == [
+        copies[0].path]
+
+
+def test_clear_removes_legacy_copies(tmp_path, monkeypatch):
+    monkeypatch.setattr(parq_derived, "CACHE_DIR", tmp_path / "derived")
+    legacy_feather = tmp_path / "example.feather"
+    legacy_feather.write_bytes(b"")
+    legacy_dataset = tmp_path / "example" / "Year=2000"
+    legacy_dataset.mkdir(parents=True)
+    (tmp_path / "footers").mkdir()
+    (tmp_path / "footers" / "key.footer").write_bytes(b"")
+    assert sorted(parq_derived.legacy_copies()) == [
+        tmp_path / "example", legacy_feather]
+    parq_derived.clear()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["footers"]
@@ -0,0 +1,22 @@
+import parq_files
+
+
+def test_expand(tmp_path):
+    (tmp_path / "sub").mkdir()
+    for name in ["2000.parq", "2001.parq", "sub/2002.parquet", "notes.txt"]:
+        (tmp_path / name).write_bytes(b"")
+    directory = [
+        str(tmp_path / name)
+        for name in ["2000.parq", "2001.parq", "sub/2002.parquet"]]
+    assert parq_files.expand(str(tmp_path)) == directory
+    assert parq_files.expand(str(tmp_path / "*.parq")) == directory[:2]
+    listed = f"{directory[1]},{directory[0]},{directory[1]}"
+    assert parq_files.expand(listed) == [directory[1], directory[0]]
+    missing = str(tmp_path / "missing*.parq")
+    assert parq_files.expand([missing]) == [missing]
+
+
+def test_map_files_keeps_order():
+    files = [f"{idx}.parq" for idx in range(20)]
+    assert parq_files.map_files(str.upper, files, workers=4) == [
+        name.upper() for name in files]
@@ -0,0 +1,59 @@
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import parq_footer
+
+
+def write_example(parquet_file, years):
+    tbl = pa.table({"Year": years, "Carrier": ["AA"] * len(years)})
+    pq.write_table(tbl, parquet_file, row_group_size=2)
+
+
+def test_footer_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(parq_footer, "CACHE_DIR", tmp_path / "footers")
+    monkeypatch.setattr(parq_footer, "_footers", {})
+    parquet_file = str(tmp_path / "example.parquet")
+    write_example(parquet_file, [2000, 2001, 2002])
+
+    stats = parq_footer.read_statistics(parquet_file)
+    assert stats.num_rows == 4
+    assert stats.column("min").to_pylist() == ["2000", "AA", "2002", "AA"]
+    assert len(list((tmp_path / "footers").iterdir())) == 2
+
+    # loaded from the sidecar files, the footer is parsed on first use
+    parq_footer._footers.clear()
+    assert parq_footer.read_statistics(parquet_file).equals(stats)
+    (key,) = parq_footer._footers
+    assert parq_footer._footers[key]._metadata is None
+    metadata = parq_footer.read_metadata(parquet_file)
+    assert metadata.num_row_groups == 2
+
+    # a changed file gets a new entry and the stale one is removed
+    write_example(parquet_file, [2000])
+    os.utime(parquet_file, ns=(1, 1))
+    assert parq_footer.read_metadata(parquet_file).num_row_groups == 1
+    assert len(list((tmp_path / "footers").iterdir())) == 2
+
+
+def test_binary_statistics_text(tmp_path, monkeypatch):
+    monkeypatch.setattr(parq_footer, "CACHE_DIR", tmp_path / "footers")
+    parquet_file = str(tmp_path / "binary.parquet")
+    values = pa.array([b"abc", b"xyz\xff"], pa.binary())
+    pq.write_table(pa.table({"b": values}), parquet_file)
+    stats = parq_footer.read_statistics(parquet_file)
+    assert stats.column("min").to_pylist() == ["abc"]
+    assert stats.column("max").to_pylist() == ["xyz\\xff"]
+
+
+def test_unreadable_footer_sidecar(tmp_path, monkeypatch):
+    monkeypatch.setattr(parq_footer, "CACHE_DIR", tmp_path / "footers")
+    monkeypatch.setattr(parq_footer, "_footers", {})
+    parquet_file = str(tmp_path / "example.parquet")
+    write_example(parquet_file, [2000, 2001, 2002])
+    parq_footer.read_statistics(parquet_file)
+    parq_footer._footers.clear()
+    for entry in (tmp_path / "footers").glob("*.footer"):
+        entry.write_bytes(b"not a footer")
+    assert parq_footer.read_metadata(parquet_file).num_row_groups == 2
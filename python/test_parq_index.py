@@ -0,0 +1,45 @@
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import parq_footer
+import parq_index
+
+
+def test_lookup(tmp_path, monkeypatch):
+    monkeypatch.setattr(parq_index, "CACHE_DIR", tmp_path / "indexes")
+    monkeypatch.setattr(parq_footer, "CACHE_DIR", tmp_path / "footers")
+    parquet_file = str(tmp_path / "example.parquet")
+    tbl = pa.table({
+        "FlightNum": list(range(100)),
+        "TailNum": [f"N{idx // 10}" for idx in range(100)],
+    })
+    pq.write_table(tbl, parquet_file, row_group_size=25)
+    parq_index.build(parquet_file, ["FlightNum", "TailNum"], zone_rows=10)
+
+    index = parq_index.load(parquet_file, "TailNum")
+    assert index.num_rows == 12
+    found = parq_index.lookup(parquet_file, "TailNum", "N3", index)
+    assert found.result.column("FlightNum").to_pylist() == list(
+        range(30, 40))
+    assert (found.candidate_zones, found.candidate_row_groups) == (2, 1)
+    metadata = pq.read_metadata(parquet_file)
+    tail_bytes = metadata.row_group(1).column(1).total_compressed_size
+    assert found.bytes_read == tail_bytes + (
+        parq_index.chunk_bytes(metadata, [1]))
+    assert found.file_bytes == parq_index.chunk_bytes(metadata, range(4))
+
+    index = parq_index.load(parquet_file, "FlightNum")
+    found = parq_index.lookup(parquet_file, "FlightNum", "57", index)
+    assert found.result.column("TailNum").to_pylist() == ["N5"]
+    assert found.candidate_row_groups == 1
+    missing = parq_index.lookup(parquet_file, "FlightNum", 1000, index)
+    assert missing.result.num_rows == 0 and missing.candidate_zones == 0
+
+    # a changed file needs a new index
+    pq.write_table(tbl.slice(0, 10), parquet_file)
+    os.utime(parquet_file, ns=(1, 1))
+    with pytest.raises(parq_index.StaleIndex):
+        parq_index.load(parquet_file, "FlightNum")
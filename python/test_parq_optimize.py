@@ -0,0 +1,69 @@
+import pathlib
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import parq_optimize
+
+
+def example_table():
+    return pa.table({
+        "Year": [2001, 2000, 2001, 2000] * 50,
+        "Carrier": ["UA", "AA", "AA", "DL"] * 50,
+        "DepDelay": [float(idx) for idx in range(200)],
+    })
+
+
+def test_parse_codecs():
+    columns = ["Year", "Carrier"]
+    assert parq_optimize.parse_codecs("zstd,Carrier=lz4", columns) == {
+        "Year": "zstd", "Carrier": "lz4"}
+    assert parq_optimize.parse_codecs("gzip", columns) == {
+        "Year": "gzip", "Carrier": "gzip"}
+
+
+def test_rewrite(tmp_path):
+    parquet_file = str(tmp_path / "example.parquet")
+    target = str(tmp_path / "example.optimized.parquet")
+    pq.write_table(example_table(), parquet_file)
+    rewritten = parq_optimize.rewrite(
+        parquet_file, target, sort_by="Year,Carrier", row_group_rows=50,
+        codec="zstd,DepDelay=snappy", bloom_filters="Carrier")
+    assert rewritten.layout.dictionary == ["Year", "Carrier"]
+
+    metadata = pq.read_metadata(target)
+    assert metadata.num_row_groups == 4
+    rg_meta = metadata.row_group(0)
+    assert [col.column_index for col in rg_meta.sorting_columns] == [0, 1]
+    assert rg_meta.column(0).compression == "ZSTD"
+    assert rg_meta.column(2).compression == "SNAPPY"
+    assert not rg_meta.column(2).has_dictionary_page
+
+    tbl = pq.read_table(target)
+    assert tbl.equals(example_table().sort_by(
+        [("Year", "ascending"), ("Carrier", "ascending")]))
+
+
+def test_target_paths(tmp_path, monkeypatch):
+    monkeypatch.setattr(parq_optimize, "OUTPUT_DIR", tmp_path / "optimized")
+    files = [
+        str(tmp_path / "data" / "a.2020.parquet"),
+        str(tmp_path / "data" / "a.2021.parquet"),
+        str(tmp_path / "data" / "old" / "a.2020.parquet"),
+    ]
+    targets = parq_optimize.target_paths(files)
+    assert len(set(targets)) == 3
+    assert targets[0] == tmp_path / "optimized" / (
+        tmp_path / "data" / "a.2020.parquet"
+    ).relative_to("/")
+    assert all((tmp_path / "data") not in path.parents for path in targets)
+
+    out = tmp_path / "out"
+    assert parq_optimize.target_paths(files, str(out)) == [
+        out / "a.2020.parquet",
+        out / "a.2021.parquet",
+        out / "old" / "a.2020.parquet",
+    ]
+    assert parq_optimize.target_paths(files[:1], "one.parquet") == [
+        pathlib.Path("one.parquet")
+    ]
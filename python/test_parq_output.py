@@ -0,0 +1,42 @@
+import datetime
+import json
+
+import pyarrow as pa
+import pyarrow.csv as csv
+import pyarrow.parquet as pq
+
+import parq_output
+
+
+def example_table():
+    return pa.table({
+        "Year": [2000, 2001, None],
+        "Carrier": ["AA", None, "UA"],
+        "Day": [datetime.date(2000, 1, 1)] * 3,
+    })
+
+
+def test_output_format():
+    assert parq_output.output_format("csv") == ("csv", None)
+    assert parq_output.output_format("out.arrow") == ("arrow", "out.arrow")
+
+
+def test_write_table(tmp_path, monkeypatch):
+    monkeypatch.setattr(parq_output, "BATCH_ROWS", 2)
+    tbl = example_table()
+    for suffix in [".csv", ".jsonl", ".parquet", ".arrow"]:
+        output_file = str(tmp_path / f"result{suffix}")
+        parq_output.write_table(tbl, output_file)
+
+    assert csv.read_csv(tmp_path / "result.csv").num_rows == 3
+    with open(tmp_path / "result.jsonl") as f:
+        rows = [json.loads(line) for line in f]
+    assert rows[1] == {"Year": 2001, "Carrier": None, "Day": "2000-01-01"}
+    assert pq.read_table(tmp_path / "result.parquet").equals(tbl)
+    with pa.OSFile(str(tmp_path / "result.arrow")) as source:
+        assert pa.ipc.open_stream(source).read_all().equals(tbl)
+
+
+def test_write_stdout(capfd):
+    parq_output.write_table(example_table(), "jsonl")
+    assert len(capfd.readouterr().out.splitlines()) == 3
@@ -0,0 +1,50 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import parq_profile
+
+
+def test_self_time_of_nested_spans():
+    profile = parq_profile.Profile()
+    profile.spans = [
+        parq_profile.Span("decode", 1, 0.0, 1.0),
+        parq_profile.Span("read", 1, 0.1, 0.25),
+        parq_profile.Span("read", 1, 0.5, 0.25),
+        parq_profile.Span("aggregate", 1, 1.0, 0.5),
+        parq_profile.Span("aggregate", 2, 0.0, 0.5),
+    ]
+    times = {
+        phase_time.name: phase_time
+        for phase_time in parq_profile.phase_times(profile)}
+    assert list(times) == ["decode", "aggregate", "read"]
+    assert times["decode"].self_time == 0.5
+    assert times["read"] == ("read", 2, 0.5, 0.5)
+    assert times["aggregate"].calls == 2
+    assert times["aggregate"].self_time == 1.0
+
+
+def test_spans_of_parquet_reads(tmp_path):
+    parquet_file = str(tmp_path / "example.parquet")
+    pq.write_table(pa.table({"x": list(range(1000))}), parquet_file)
+    assert parq_profile.input_file(parquet_file) == parquet_file
+    profile = parq_profile.enable()
+    try:
+        with parq_profile.span("decode"):
+            tbl = pq.read_table(parq_profile.input_file(parquet_file))
+        chunks = list(parq_profile.iterate("convert", [1, 2]))
+    finally:
+        parq_profile.disable()
+    assert tbl.num_rows == 1000 and chunks == [1, 2]
+    names = [rec.name for rec in profile.spans]
+    assert "read" in names and names.count("convert") == 3
+    trace = parq_profile.chrome_trace(profile)
+    phases = [
+        event for event in trace["traceEvents"] if event["ph"] == "X"]
+    assert len(phases) == len(profile.spans)
+    assert {"name", "ts", "dur", "pid", "tid"} <= set(phases[0])
+
+
+def test_span_without_profile():
+    with parq_profile.span("read"):
+        pass
+    assert not parq_profile.enabled()
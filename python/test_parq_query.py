@@ -0,0 +1,76 @@
+import pandas as pd
+import pyarrow as pa
+
+import parq_query as pqy
+
+
+def example_table():
+    return pa.table({
+        "Year": [2000, 2000, 2001, 2001, 2001],
+        "Carrier": ["AA", "UA", "AA", "AA", None],
+        "DepDelay": [1.0, 3.0, None, 5.0, 7.0],
+    })
+
+
+def test_parse_agg():
+    assert pqy.parse_agg("count(*)") == pqy.Agg("count", "*", "ct")
+    assert pqy.parse_agg("AVG(DepDelay) as delay") == pqy.Agg(
+        "avg", "DepDelay", "delay")
+
+
+def test_parse_filters():
+    filters = pqy.parse_filters(
+        "Year >= 2005 and Carrier in ('AA', 'UA') and Origin <> 'SFO'")
+    assert filters == [
+        pqy.Filter("Year", ">=", 2005),
+        pqy.Filter("Carrier", "in", ["AA", "UA"]),
+        pqy.Filter("Origin", "!=", "SFO"),
+    ]
+
+
+def test_to_sql():
+    spec = pqy.build_spec(where="Year = 2000")
+    assert pqy.to_sql(spec, "t") == (
+        "select Year, count(*) as ct, count(distinct Carrier) as "
+        "carrier_uniq_ct from t where Year = 2000 group by Year")
+
+
+def test_pandas_and_arrow_agree():
+    spec = pqy.build_spec(
+        group_by="Year",
+        agg="count(*),count(DepDelay),count_distinct(Carrier),sum(DepDelay)",
+        where="Year >= 2000")
+    tbl = example_table()
+    arrow_df = pqy.arrow_query(spec, tbl).to_pandas().sort_values("Year")
+    pandas_df = pqy.pandas_query(spec, tbl.to_pandas())
+    assert list(arrow_df.columns) == spec.output_columns()
+    assert list(pandas_df.columns) == spec.output_columns()
+    assert arrow_df.values.tolist() == pandas_df.values.tolist()
+    assert arrow_df["ct"].tolist() == [2, 3]
+    assert arrow_df["count_distinct_Carrier"].tolist() == [2, 1]
+
+
+def test_projection():
+    spec = pqy.QuerySpec(
+        columns=["Carrier"], filters=pqy.parse_filters("Year = 2001"))
+    result = pqy.arrow_query(spec, example_table())
+    assert result.column("Carrier").to_pylist() == ["AA", "AA", None]
+    assert isinstance(pqy.pandas_query(spec, example_table().to_pandas()),
+                      pd.DataFrame)
+
+
+def test_null_group_key():
+    spec = pqy.build_spec(group_by="Carrier", agg="count(*),sum(DepDelay)")
+    tbl = example_table()
+    arrow_df = pqy.arrow_query(spec, tbl).to_pandas()
+    pandas_df = pqy.pandas_query(spec, tbl.to_pandas())
+    assert len(pandas_df) == len(arrow_df) == 3
+    null_group = pandas_df[pandas_df["Carrier"].isna()]
+    assert null_group["ct"].tolist() == [1]
+    assert null_group["sum_DepDelay"].tolist() == [7.0]
+
+
+def test_arrow_expression_without_filters():
+    assert pqy.arrow_expression([]) is None
+    expr = pqy.arrow_expression(pqy.parse_filters("Year=2000"))
+    assert str(expr) == "(Year == 2000)"
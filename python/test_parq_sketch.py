@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import parq_footer
+import parq_query as pqy
+import parq_sketch
+
+
+def test_estimate():
+    for count in [0, 10, 1000, 100000]:
+        regs = parq_sketch.registers(parq_sketch.hash64(range(count)))
+        assert abs(parq_sketch.estimate(regs) - count) <= 0.05 * count
+    # merging is the maximum of the registers
+    evens = parq_sketch.registers(parq_sketch.hash64(range(0, 2000, 2)))
+    odds = parq_sketch.registers(parq_sketch.hash64(range(1, 2000, 2)))
+    merged = parq_sketch.estimate(np.maximum(evens, odds))
+    assert abs(merged - 2000) <= 100
+
+
+def test_hash64_types():
+    words = [f"N{idx}" for idx in range(1000)]
+    hashes = parq_sketch.hash64(words)
+    # hashes are stable across calls and array layouts
+    assert (hashes == parq_sketch.hash64(pa.chunked_array(
+        [words[:500], words[500:]]))).all()
+    assert len(set(hashes.tolist())) == 1000
+    assert (parq_sketch.hash64(pa.array(range(5), pa.int32()))
+            == parq_sketch.hash64(range(5))).all()
+    assert len(set(parq_sketch.hash64([0.5, 1.5, -0.0]).tolist())) == 3
+    assert len(parq_sketch.hash64([])) == 0
+    regs = parq_sketch.registers(parq_sketch.hash64(words))
+    assert abs(parq_sketch.estimate(regs) - 1000) <= 50
+
+
+def write_example(parquet_file, years):
+    tbl = pa.table({
+        "Year": years,
+        "Carrier": [f"C{idx % 7}" for idx in range(len(years))],
+    })
+    pq.write_table(tbl, parquet_file, row_group_size=10)
+    return tbl
+
+
+def test_build_incrementally(tmp_path, monkeypatch):
+    monkeypatch.setattr(parq_sketch, "CACHE_DIR", tmp_path / "sketches")
+    monkeypatch.setattr(parq_footer, "CACHE_DIR", tmp_path / "footers")
+    parquet_file = str(tmp_path / "example.parquet")
+    spec = pqy.build_spec()
+    keys, columns = parq_sketch.spec_columns(spec)
+    assert (keys, columns) == (["Year"], ["Carrier"])
+
+    write_example(parquet_file, [2000] * 15 + [2001] * 5)
+    assert parq_sketch.build(parquet_file, columns, keys) == (2, 0)
+
+    # appended row groups are sketched, the others are reused
+    tbl = write_example(parquet_file, [2000] * 15 + [2001] * 10)
+    os.utime(parquet_file, ns=(1, 1))
+    assert parq_sketch.build(parquet_file, columns, keys) == (1, 2)
+
+    sketch_info = parq_sketch.find(parquet_file, spec)
+    sketch = parq_sketch.load(sketch_info.path)
+    result = parq_sketch.query(sketch, spec)
+    assert result.equals(pqy.arrow_query(spec, tbl).cast(result.schema))
+    assert parq_sketch.find(
+        parquet_file, pqy.build_spec(agg="count_distinct(Year)")) is None
@@ -0,0 +1,68 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import parq_footer
+import parq_query as pqy
+import parq_stats as ps
+
+
+def match(where, stats):
+    return ps.compare_filter(pqy.parse_filters(where)[0], stats)
+
+
+def test_compare_filter():
+    stats = ps.ColumnStats(num_rows=10, min=2000, max=2005, null_count=0)
+    assert match("Year = 1999", stats) == ps.NONE
+    assert match("Year = 2001", stats) == ps.SOME
+    assert match("Year >= 2000", stats) == ps.ALL
+    assert match("Year > 2005", stats) == ps.NONE
+    assert match("Year in (1990, 2010)", stats) == ps.NONE
+    assert match("Year != 2001", stats) == ps.SOME
+
+
+def test_compare_filter_nulls():
+    stats = ps.ColumnStats(num_rows=10, min="AA", max="AA", null_count=2)
+    assert match("Carrier = 'AA'", stats) == ps.SOME
+    assert match("Carrier != 'AA'", stats) == ps.NONE
+    all_null = ps.ColumnStats(num_rows=10, min=None, max=None, null_count=10)
+    assert match("Carrier = 'AA'", all_null) == ps.NONE
+
+
+def test_matching_row_groups(tmp_path):
+    parquet_file = str(tmp_path / "example.parquet")
+    tbl = pa.table({"Year": [2000, 2000, 2001, 2001, 2002, 2002]})
+    pq.write_table(tbl, parquet_file, row_group_size=2)
+    metadata = pq.read_metadata(parquet_file)
+    filters = pqy.parse_filters("Year >= 2001")
+    assert ps.matching_row_groups(metadata, filters) == [1, 2]
+    assert ps.row_group_matches(metadata, filters) == [
+        ps.NONE, ps.ALL, ps.ALL]
+    assert ps.pruning_summary(metadata, filters).startswith(
+        "Skipped 1/3 row groups")
+
+
+def test_summarize(tmp_path):
+    parquet_file = str(tmp_path / "example.parquet")
+    tbl = pa.table({
+        "Month": [9, 10, 12, 2, None],
+        "Carrier": ["UA", "AA", "DL", "AA", "AA"],
+    })
+    pq.write_table(
+        tbl, parquet_file, row_group_size=2, compression="zstd",
+        write_statistics=["Month"])
+    metadata = pq.read_metadata(parquet_file)
+    stats = parq_footer.flatten_statistics(metadata)
+    summary = ps.summarize(stats, metadata.schema.to_arrow_schema())
+    assert summary.column("name").to_pylist() == ["Month", "Carrier"]
+    assert summary.column("row_groups").to_pylist() == [3, 3]
+    assert summary.column("missing_stats").to_pylist() == [0, 3]
+    assert summary.column("null_count").to_pylist() == [1, None]
+    # compared as numbers, not as strings
+    assert summary.column("min").to_pylist() == ["2", None]
+    assert summary.column("max").to_pylist() == ["12", None]
+    assert summary.column("compression").to_pylist() == ["ZSTD", "ZSTD"]
+    assert summary.column("compressed_bytes").to_pylist() == [
+        sum(
+            metadata.row_group(rg).column(col).total_compressed_size
+            for rg in range(3))
+        for col in range(2)]
@@ -0,0 +1,45 @@
+import pandas as pd
+import pyarrow as pa
+
+import parq_query as pqy
+import parq_verify as pv
+
+
+SPEC = pqy.build_spec()
+
+
+def test_normalize_sorts_and_renames():
+    df = pd.DataFrame({"y": [2001, 2000], "a": [3, 2], "b": [1, 1]})
+    tbl = pv.normalize(df, SPEC)
+    assert tbl.column_names == ["Year", "ct", "carrier_uniq_ct"]
+    assert tbl.column("Year").to_pylist() == [2000, 2001]
+    assert tbl.schema.field("ct").type == pa.int64()
+
+
+def test_compare_tolerance():
+    expected = pv.normalize(
+        pa.table({"Year": [2000], "ct": [10], "uniq": [100]}), SPEC)
+    actual = pv.normalize(
+        pa.table({"Year": [2000], "ct": [10], "uniq": [103]}), SPEC)
+    assert pv.compare(expected, actual) == [
+        pv.Mismatch("carrier_uniq_ct", 0, 100, 103)]
+    approx = pv.approx_columns(SPEC, {"count_distinct"})
+    assert pv.compare(expected, actual, approx_columns=approx) == []
+
+
+def test_compare_nulls_and_rows():
+    spec = pqy.build_spec(agg="avg(DepDelay)")
+    expected = pv.normalize(pd.DataFrame(
+        {"Year": [2000, 2001], "avg": [None, 1.0]}), spec)
+    actual = pv.normalize(pa.table(
+        {"Year": [2000, 2001], "avg": [None, 1.0]}), spec)
+    assert pv.compare(expected, actual) == []
+    assert pv.compare(expected, actual.slice(1))[0].column == "<rows>"
+
+
+def test_print_report_failures(capsys):
+    pv.print_report("pandas", {"arrow_parquet": []},
+                    {"polars_parquet": "TypeError: boom"})
+    out = capsys.readouterr().out
+    assert "polars_parquet" in out and "FAILED TypeError: boom" in out
+    assert "arrow_parquet" in out and "OK" in out